@@ -0,0 +1,111 @@
+"""Unpacking of zip/tar archives uploaded to ``/upload/batch``.
+
+Members are read one at a time from the request spool (tar archives as a
+stream, so gzip/bz2/xz-compressed tars work too) and copied into their own
+spooled temporary files. Small members stay in memory and large ones spill
+to disk. Nothing is extracted to a directory, and members are handed out as
+they are read, so the caller decides how many are spooled at once.
+"""
+import mimetypes
+import os
+import tarfile
+import zipfile
+from tempfile import SpooledTemporaryFile
+
+from fastapi import UploadFile
+from starlette.datastructures import Headers
+
+from app.config import MAX_FILE_SIZE, UPLOAD_BLOCK_SIZE
+
+
+class ArchiveError(Exception):
+    """Raised when an uploaded archive is neither a zip nor a tar file, or is corrupt."""
+
+
+# Directory entries and OS metadata that are not user files
+def _skip(name: str) -> bool:
+    base = os.path.basename(name)
+    return not base or base.startswith(".") or name.startswith("__MACOSX/")
+
+
+def _member_upload(name: str, source):
+    """Copy one member into a spool. Returns ``(filename, upload, error)``; upload is None on error."""
+    filename = os.path.basename(name)
+    spool = SpooledTemporaryFile(max_size=UPLOAD_BLOCK_SIZE)
+    size = 0
+    while True:
+        block = source.read(UPLOAD_BLOCK_SIZE)
+        if not block:
+            break
+        size += len(block)
+        if size > MAX_FILE_SIZE:
+            spool.close()
+            return filename, None, f"File too big (max {MAX_FILE_SIZE} bytes)"
+        spool.write(block)
+    spool.seek(0)
+    content_type = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+    upload = UploadFile(spool, size=size, filename=filename, headers=Headers({"content-type": content_type}))
+    return filename, upload, None
+
+
+def _zip_members(archive: zipfile.ZipFile):
+    return [info for info in archive.infolist() if not info.is_dir() and not _skip(info.filename)]
+
+
+class ArchiveMembers:
+    """The members of an archive, at most max_files, as ``(filename, upload, error)`` tuples.
+
+    Iterating is blocking (each step reads one member into its spool); run
+    each ``next`` in a thread. ``truncated`` is set once the archive turns
+    out to have more than max_files members. Raises ArchiveError if the
+    archive is not a zip or tar file or is corrupt.
+    """
+
+    def __init__(self, fileobj, max_files: int):
+        self.fileobj = fileobj
+        self.max_files = max(max_files, 0)
+        self.truncated = False
+
+    def names(self):
+        """The filenames of the members (up to max_files), or None for a tar stream, whose members are only known as they are read.
+
+        A zip file lists its members up front, so this only reads its central directory.
+        """
+        try:
+            self.fileobj.seek(0)
+            if not zipfile.is_zipfile(self.fileobj):
+                return None
+            self.fileobj.seek(0)
+            with zipfile.ZipFile(self.fileobj) as archive:
+                return [os.path.basename(info.filename) for info in _zip_members(archive)][:self.max_files]
+        except (zipfile.BadZipFile, EOFError, OSError) as e:
+            raise ArchiveError(str(e) or "Not a zip or tar archive")
+
+    def __iter__(self):
+        count = 0
+        try:
+            self.fileobj.seek(0)
+            if zipfile.is_zipfile(self.fileobj):
+                self.fileobj.seek(0)
+                with zipfile.ZipFile(self.fileobj) as archive:
+                    for info in _zip_members(archive):
+                        if count >= self.max_files:
+                            self.truncated = True
+                            return
+                        count += 1
+                        with archive.open(info) as source:
+                            yield _member_upload(info.filename, source)
+                return
+
+            self.fileobj.seek(0)
+            with tarfile.open(fileobj=self.fileobj, mode="r|*") as archive:
+                for info in archive:
+                    if not info.isfile() or _skip(info.name):
+                        continue
+                    if count >= self.max_files:
+                        self.truncated = True
+                        return
+                    count += 1
+                    yield _member_upload(info.name, archive.extractfile(info))
+        except (tarfile.TarError, zipfile.BadZipFile, EOFError, OSError) as e:
+            raise ArchiveError(str(e) or "Not a zip or tar archive")
@@ -0,0 +1,86 @@
+"""In-memory cache of small, frequently downloaded files.
+
+Most downloads are small images and json/text files, and each one used to
+read all of its GridFS chunks from MongoDB again. Files up to
+``BLOB_CACHE_MAX_OBJECT`` bytes in ``BLOB_CACHE_BUCKETS`` are kept in a
+size-aware LRU bounded by ``BLOB_CACHE_MAX_BYTES``.
+
+Entries are keyed by (bucket, blob_id). A blob's bytes never change (an
+update stores a new blob), so the key already identifies the version and
+files sharing a blob share the entry. Deleting or replacing a file discards
+its blob anyway to free the memory early.
+"""
+import asyncio
+import logging
+from collections import OrderedDict
+
+from app.config import BLOB_CACHE_BUCKETS, BLOB_CACHE_MAX_BYTES, BLOB_CACHE_MAX_OBJECT
+
+logger = logging.getLogger(__name__)
+
+
+class BlobCache:
+    def __init__(self, max_bytes: int, max_object: int, buckets):
+        self.max_bytes = max_bytes
+        self.max_object = max_object
+        self.buckets = set(buckets)
+        self.entries = OrderedDict()  # (bucket, blob_id) -> bytes
+        self.size = 0
+        self._loading = {}  # (bucket, blob_id) -> Future, so concurrent misses read the blob once
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def accepts(self, bucket: str, length: int) -> bool:
+        return self.max_bytes > 0 and bucket in self.buckets and length <= min(self.max_object, self.max_bytes)
+
+    def _put(self, key, data: bytes):
+        if key in self.entries:
+            return
+        self.entries[key] = data
+        self.size += len(data)
+        while self.size > self.max_bytes:
+            _, evicted = self.entries.popitem(last=False)
+            self.size -= len(evicted)
+            self.evictions += 1
+
+    async def get(self, bucket: str, blob_id, load):
+        """Return ``(data, hit)`` for a blob, awaiting load() for its bytes on a miss."""
+        key = (bucket, blob_id)
+        data = self.entries.get(key)
+        if data is not None:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return data, True
+        self.misses += 1
+        if key in self._loading:
+            return await asyncio.shield(self._loading[key]), False
+
+        future = asyncio.get_running_loop().create_future()
+        self._loading[key] = future
+        try:
+            data = await load()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Nobody else may be waiting; don't let the loop warn about an unretrieved exception
+            future.exception()
+            raise
+        finally:
+            del self._loading[key]
+        future.set_result(data)
+        self._put(key, data)
+        return data, False
+
+    def discard(self, bucket: str, blob_id):
+        data = self.entries.pop((bucket, blob_id), None)
+        if data is not None:
+            self.size -= len(data)
+
+    def stats(self) -> dict:
+        return {"entries": len(self.entries), "bytes": self.size, "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+
+blob_cache = BlobCache(BLOB_CACHE_MAX_BYTES, BLOB_CACHE_MAX_OBJECT, BLOB_CACHE_BUCKETS)
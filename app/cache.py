@@ -0,0 +1,166 @@
+"""Response cache for the listing, search and leaderboard endpoints.
+
+Rendered JSON bodies are cached under the request path and query string,
+with an ETag so repeat clients get a 304. The backend is an in-process LRU
+with a TTL, or a Redis-compatible server when ``RESPONSE_CACHE_URL`` is set
+(``pip install redis``), which lets several workers share entries.
+
+Invalidation uses a generation counter per bucket. Every key embeds the
+current generations of the buckets its response depends on, so bumping a
+bucket's counter (on upload, update, delete or finished extraction) makes
+the old entries unreachable; they age out on their own. Download and view
+counts are not invalidated: they may be up to ``RESPONSE_CACHE_TTL`` seconds
+stale, like the counter flush already allows.
+"""
+import hashlib
+import logging
+import time
+from collections import OrderedDict
+from urllib.parse import urlencode
+
+from fastapi import Request, Response
+from fastapi.responses import JSONResponse
+
+from app.config import RESPONSE_CACHE_MAX_ENTRIES, RESPONSE_CACHE_TTL, RESPONSE_CACHE_URL
+from app.utils import etag_matches
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryCache:
+    name = "memory"
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # key -> (expires_at, value)
+        self.generations = {}
+        self.evictions = 0
+        self.expired = 0
+
+    async def get(self, key: str):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= time.monotonic():
+            del self.entries[key]
+            self.expired += 1
+            return None
+        self.entries.move_to_end(key)
+        return entry[1]
+
+    async def set(self, key: str, value: bytes, ttl: float):
+        self.entries[key] = (time.monotonic() + ttl, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    async def get_generations(self, buckets) -> list:
+        return [self.generations.get(bucket, 0) for bucket in buckets]
+
+    async def bump(self, bucket: str):
+        self.generations[bucket] = self.generations.get(bucket, 0) + 1
+
+    def stats(self) -> dict:
+        return {"entries": len(self.entries), "evictions": self.evictions, "expired": self.expired}
+
+
+class RedisCache:
+    name = "redis"
+    PREFIX = "file-upload-api:"
+
+    def __init__(self, url: str):
+        import redis.asyncio as redis
+        self.client = redis.from_url(url)
+
+    async def get(self, key: str):
+        return await self.client.get(self.PREFIX + key)
+
+    async def set(self, key: str, value: bytes, ttl: float):
+        await self.client.set(self.PREFIX + key, value, px=int(ttl * 1000))
+
+    async def get_generations(self, buckets) -> list:
+        values = await self.client.mget([f"{self.PREFIX}gen:{bucket}" for bucket in buckets])
+        return [int(value or 0) for value in values]
+
+    async def bump(self, bucket: str):
+        await self.client.incr(f"{self.PREFIX}gen:{bucket}")
+
+    def stats(self) -> dict:
+        # Redis evicts and expires on the server; see its INFO stats
+        return {}
+
+
+class ResponseCache:
+    def __init__(self, backend, ttl: float):
+        self.backend = backend
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    async def invalidate(self, bucket: str):
+        """Drop every cached response that depends on bucket."""
+        if self.ttl <= 0:
+            return
+        try:
+            await self.backend.bump(bucket)
+        except Exception as e:
+            self.errors += 1
+            logger.error(f"Response cache invalidation failed for {bucket}: {str(e)}")
+
+    async def _key(self, request: Request, buckets) -> str:
+        generations = await self.backend.get_generations(buckets)
+        scope = ",".join(f"{bucket}.{generation}" for bucket, generation in zip(buckets, generations))
+        query = urlencode(sorted(request.query_params.multi_items()))
+        return f"{request.url.path}?{query}#{scope}"
+
+    async def respond(self, request: Request, buckets, compute) -> Response:
+        """Serve request from the cache, or await compute() for the JSON content and cache it.
+
+        ``buckets`` are the buckets the response is built from; an exception
+        raised by compute (e.g. a 404) is not cached.
+        """
+        key = body = None
+        if self.ttl > 0:
+            try:
+                key = await self._key(request, buckets)
+                body = await self.backend.get(key)
+            except Exception as e:
+                # A cache outage must not take the endpoint down with it
+                self.errors += 1
+                logger.error(f"Response cache read failed: {str(e)}")
+
+        status = "HIT" if body is not None else "MISS"
+        if body is None:
+            self.misses += 1
+            body = JSONResponse(await compute()).body
+            if key is not None:
+                try:
+                    await self.backend.set(key, body, self.ttl)
+                except Exception as e:
+                    self.errors += 1
+                    logger.error(f"Response cache write failed: {str(e)}")
+        else:
+            self.hits += 1
+
+        etag = f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+        headers = {"ETag": etag, "X-Cache": status}
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            return Response(status_code=304, headers=headers)
+        return Response(body, media_type="application/json", headers=headers)
+
+    def stats(self) -> dict:
+        return {"backend": self.backend.name, "ttl": self.ttl, "hits": self.hits, "misses": self.misses, "errors": self.errors, **self.backend.stats()}
+
+
+def make_backend():
+    if RESPONSE_CACHE_URL:
+        try:
+            return RedisCache(RESPONSE_CACHE_URL)
+        except ImportError:
+            logger.error("RESPONSE_CACHE_URL is set but the redis package is not installed, using the in-process cache")
+    return MemoryCache(RESPONSE_CACHE_MAX_ENTRIES)
+
+
+response_cache = ResponseCache(make_backend(), RESPONSE_CACHE_TTL)
@@ -0,0 +1,70 @@
+"""Unified, indexed catalog of every stored file across the GridFS buckets.
+
+Listing used to scan all nine ``<bucket>.files`` collections and sort in
+Python. The ``catalog`` collection holds one small document per file (keyed
+by the GridFS file id) so listings become a single indexed, server-sorted
+query. Upload, update, delete and the counters keep it in sync.
+"""
+import logging
+
+from pymongo import ASCENDING, DESCENDING, IndexModel
+
+from app.db import LISTING_READS, db
+
+logger = logging.getLogger(__name__)
+
+catalog = db["catalog"]
+# Listing, search and top queries (possibly served by a secondary, see app.db)
+catalog_reads = catalog.with_options(read_preference=LISTING_READS)
+
+BUCKETS = ["pdf", "image", "json", "word", "text", "csv", "audio", "video", "other"]
+
+CATALOG_INDEXES = [
+    IndexModel([("uploadDate", DESCENDING), ("_id", DESCENDING)], name="uploadDate_id"),
+    IndexModel([("filename_lower", ASCENDING), ("_id", ASCENDING)], name="filename_lower_id"),
+    IndexModel([("bucket", ASCENDING), ("uploadDate", DESCENDING), ("_id", DESCENDING)], name="bucket_uploadDate_id"),
+    IndexModel([("bucket", ASCENDING), ("filename_lower", ASCENDING), ("_id", ASCENDING)], name="bucket_filename_lower_id"),
+    IndexModel([("blob_id", ASCENDING)], name="blob_id"),
+    IndexModel([("downloadsCount", DESCENDING)], name="downloadsCount"),
+    IndexModel([("viewsCount", DESCENDING)], name="viewsCount"),
+]
+
+
+# Catalog document for a GridFS .files document
+def catalog_entry(bucket: str, file_doc: dict) -> dict:
+    return {
+        "_id": file_doc["_id"],
+        "blob_id": file_doc.get("blob_id", file_doc["_id"]),
+        "bucket": bucket,
+        "filename": file_doc["filename"],
+        "filename_lower": file_doc["filename"].lower(),
+        "content_type": file_doc.get("contentType"),
+        "length": file_doc.get("length", 0),
+        "uploadDate": file_doc["uploadDate"],
+        "downloadsCount": file_doc.get("downloadsCount", 0),
+        "viewsCount": file_doc.get("viewsCount", 0),
+    }
+
+
+async def upsert_catalog_entry(bucket: str, file_doc: dict):
+    await catalog.replace_one({"_id": file_doc["_id"]}, catalog_entry(bucket, file_doc), upsert=True)
+
+
+async def remove_catalog_entry(file_id):
+    await catalog.delete_one({"_id": file_id})
+
+
+async def ensure_catalog():
+    """Create the catalog indexes and backfill it from the buckets if it is empty."""
+    await catalog.create_indexes(CATALOG_INDEXES)
+    if await catalog.find_one({}, {"_id": 1}):
+        # Entries written before blob_id existed point at their own chunks
+        await catalog.update_many({"blob_id": {"$exists": False}}, [{"$set": {"blob_id": "$_id"}}])
+        return
+    count = 0
+    for bucket in BUCKETS:
+        entries = [catalog_entry(bucket, file_doc) async for file_doc in db[f"{bucket}.files"].find()]
+        if entries:
+            await catalog.insert_many(entries, ordered=False)
+        count += len(entries)
+    logger.info(f"Catalog backfilled with {count} files")
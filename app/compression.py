@@ -0,0 +1,143 @@
+"""Storage codecs for compressing file data in GridFS.
+
+``STORAGE_CODECS`` maps buckets to a codec (e.g. ``text=zstd,csv=gzip``).
+Such a bucket's chunks hold the compressed bytes. The ``.files`` document
+keeps the original ``length`` and adds ``codec`` and ``storedLength``.
+Documents without ``codec`` are stored as-is, so existing files keep
+working.
+
+``gzip`` uses the standard library. ``zstd`` needs the zstandard package
+(``pip install zstandard``); without it those buckets are stored uncompressed.
+The codec names double as HTTP content-codings, so a client that accepts one
+can be sent the stored bytes directly.
+
+Decompression never produces more than one block (``UPLOAD_BLOCK_SIZE``) at
+a time, however well the data compressed: a small stored chunk of a file of
+zeros would otherwise expand to the whole file in memory.
+"""
+import asyncio
+import gzip
+import logging
+import zlib
+
+from app.config import STORAGE_CODECS, UPLOAD_BLOCK_SIZE
+
+logger = logging.getLogger(__name__)
+
+
+class GzipCodec:
+    name = "gzip"
+
+    def __init__(self, level: int = 6):
+        self.level = level
+
+    def compressor(self):
+        return zlib.compressobj(self.level, zlib.DEFLATED, 31)  # 31: gzip container
+
+    def decompressor(self):
+        return zlib.decompressobj(31)
+
+    def reader(self, source):
+        """A file-like object reading the original bytes from a file of stored bytes."""
+        return gzip.GzipFile(fileobj=source, mode="rb")
+
+    async def decode(self, chunks, block_size: int):
+        decompressor = self.decompressor()
+        async for data in chunks:
+            # max_length bounds each block; the rest of the input waits in unconsumed_tail
+            while data:
+                block = decompressor.decompress(data, block_size)
+                data = decompressor.unconsumed_tail
+                if block:
+                    yield block
+        while True:
+            block = decompressor.decompress(b"", block_size)
+            if not block:
+                break
+            yield block
+        tail = decompressor.flush()
+        if tail:
+            yield tail
+
+
+class ZstdCodec:
+    name = "zstd"
+
+    def __init__(self, level: int = 3):
+        import zstandard
+        self.level = level
+        self._zstd = zstandard
+
+    def compressor(self):
+        return self._zstd.ZstdCompressor(level=self.level).compressobj()
+
+    def reader(self, source):
+        """A file-like object reading the original bytes from a file of stored bytes."""
+        return self._zstd.ZstdDecompressor().stream_reader(source)
+
+    async def decode(self, chunks, block_size: int):
+        # zstandard's decompressobj can't bound its output, its stream reader can but pulls its
+        # input with blocking reads: run it in a thread and fetch each chunk back on the event loop
+        loop = asyncio.get_running_loop()
+        reader = self.reader(_BlockingSource(chunks, loop))
+        while True:
+            block = await loop.run_in_executor(None, reader.read, block_size)
+            if not block:
+                break
+            yield block
+
+
+# A blocking read() over an async iterator of bytes, for a worker thread
+class _BlockingSource:
+    def __init__(self, chunks, loop):
+        self.chunks = chunks.__aiter__()
+        self.loop = loop
+
+    def read(self, size: int = -1) -> bytes:
+        try:
+            return asyncio.run_coroutine_threadsafe(self.chunks.__anext__(), self.loop).result()
+        except StopAsyncIteration:
+            return b""
+
+
+CODEC_TYPES = {"gzip": GzipCodec, "zstd": ZstdCodec}
+
+
+def get_codec(name: str):
+    """The codec named in a .files document, or None for data stored as-is."""
+    if not name:
+        return None
+    return CODEC_TYPES[name]()
+
+
+def _bucket_codecs() -> dict:
+    codecs = {}
+    for bucket, name in STORAGE_CODECS.items():
+        if name not in CODEC_TYPES:
+            logger.error(f"Unknown storage codec {name!r} for bucket {bucket}, storing it uncompressed")
+            continue
+        try:
+            codecs[bucket] = get_codec(name)
+        except ImportError:
+            logger.error(f"Storage codec {name} for bucket {bucket} needs the zstandard package, storing it uncompressed")
+    return codecs
+
+
+# Codec new uploads to each bucket are written with
+BUCKET_CODECS = _bucket_codecs()
+
+
+async def decode_stream(chunks, codec, start: int = 0, end: int = None):
+    """Decompress an async iterator of stored bytes, yielding original bytes start..end (inclusive) in bounded blocks.
+
+    A range is served by decompressing from the beginning and skipping what
+    comes before start; compressed data can't be entered in the middle.
+    """
+    position = 0  # Offset in the original data of the next decompressed byte
+    async for data in codec.decode(chunks, UPLOAD_BLOCK_SIZE):
+        if end is not None and position > end:
+            break
+        piece = data[max(start - position, 0):len(data) if end is None else end - position + 1]
+        position += len(data)
+        if piece:
+            yield piece
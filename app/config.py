@@ -7,6 +7,30 @@ load_dotenv()
 # print(f"ALLOWED_TYPES: {os.getenv('ALLOWED_TYPES')}")
 
 MONGODB_URI = os.getenv("MONGODB_URI")
+# Debug mode: ?profile=1 on any request returns its sampled stacks (see app.profiling), sampled every PROFILE_INTERVAL seconds
+DEBUG = os.getenv("DEBUG", "false").lower() in ("1", "true", "yes")
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", 0.001))
+# Ping the server at startup so the first request finds an open connection
+MONGO_WARMUP = os.getenv("MONGO_WARMUP", "true").lower() in ("1", "true", "yes")
+# Create the indexes (and backfill the catalog) at startup. Only needed once per database;
+# turn it off to shorten serverless cold starts once it has run
+ENSURE_INDEXES = os.getenv("ENSURE_INDEXES", "true").lower() in ("1", "true", "yes")
+
+# MongoDB connection pool per worker process: most and fewest open connections, and how long an idle one is kept
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", 100))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", 0))
+MONGO_MAX_IDLE_TIME_MS = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", 0)) or None
+# Milliseconds to wait for a connection / a usable server before a request fails
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", 20000))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", 30000))
+# Wire compression, in order of preference, e.g. "zstd,snappy,zlib" (zstd needs zstandard, snappy needs python-snappy; empty = none)
+MONGO_COMPRESSORS = os.getenv("MONGO_COMPRESSORS", "").replace(" ", "")
+# Read preference of listing, search and top/stats queries ("secondaryPreferred" offloads them from the primary on a replica set)
+MONGO_LISTING_READ_PREFERENCE = os.getenv("MONGO_LISTING_READ_PREFERENCE", "primary")
+# Seconds a secondary may lag behind and still serve those reads (-1 = no limit, otherwise at least 90)
+MONGO_MAX_STALENESS = int(os.getenv("MONGO_MAX_STALENESS", -1))
+# Write concern of the view/download counter flushes, e.g. "1" or "0" (unacknowledged; failed flushes are not retried); empty = the client's
+COUNTER_WRITE_CONCERN = os.getenv("COUNTER_WRITE_CONCERN", "")
 MAX_FILE_SIZE = int(os.getenv("MAX_FILE_SIZE"))
 
 
@@ -33,4 +57,93 @@ ALLOWED_TYPES = {
     "video/webm",           # .webm video
     "video/ogg"             # .ogv
 }
-# print(ALLOWED_TYPES)
\ No newline at end of file
+# print(ALLOWED_TYPES)
+
+# Uploads are read from the request spool and written to GridFS in blocks of this size
+UPLOAD_BLOCK_SIZE = int(os.getenv("UPLOAD_BLOCK_SIZE", 1024 * 1024))
+
+# Text extraction worker processes (0 = extract inside the request, e.g. on serverless hosts)
+EXTRACTION_WORKERS = int(os.getenv("EXTRACTION_WORKERS", min(os.cpu_count() or 1, 4)))
+# Seconds a single extraction job may run before it is marked as failed
+EXTRACTION_TIMEOUT = float(os.getenv("EXTRACTION_TIMEOUT", 120))
+
+# Content-addressed uploads: identical bytes in the same bucket share one stored copy
+DEDUP_UPLOADS = os.getenv("DEDUP_UPLOADS", "true").lower() in ("1", "true", "yes")
+
+# View/download counters are buffered in memory and flushed every N seconds (0 = write through)
+COUNTER_FLUSH_INTERVAL = float(os.getenv("COUNTER_FLUSH_INTERVAL", 5))
+# Flush early once this many files have pending increments
+COUNTER_MAX_BUFFER = int(os.getenv("COUNTER_MAX_BUFFER", 1000))
+
+# Files kept in each top-downloads / top-viewed ranking (the most /top-downloads/ can return)
+LEADERBOARD_SIZE = int(os.getenv("LEADERBOARD_SIZE", 100))
+# Reload the rankings from the database every N seconds (0 = only at startup; set it when running several workers)
+LEADERBOARD_REFRESH_INTERVAL = float(os.getenv("LEADERBOARD_REFRESH_INTERVAL", 0))
+
+# Seconds listing/search/top responses are cached (0 = no response cache)
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", 30))
+# Most responses the in-process cache keeps before evicting the least recently used
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", 1024))
+# redis://host:port/db to share the response cache between workers (needs the redis package)
+RESPONSE_CACHE_URL = os.getenv("RESPONSE_CACHE_URL", "")
+
+# Small files from these buckets (and "derivatives", the thumbnails) are cached in memory for downloads
+BLOB_CACHE_BUCKETS = [bucket for bucket in os.getenv("BLOB_CACHE_BUCKETS", "image,json,text,derivatives").split(",") if bucket]
+# Total bytes the blob cache may hold (0 = no blob cache)
+BLOB_CACHE_MAX_BYTES = int(os.getenv("BLOB_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+# Files larger than this are always streamed from GridFS
+BLOB_CACHE_MAX_OBJECT = int(os.getenv("BLOB_CACHE_MAX_OBJECT", 256 * 1024))
+
+# Most files one /upload/batch request may contain
+BATCH_MAX_FILES = int(os.getenv("BATCH_MAX_FILES", 1000))
+# Files of a batch stored (and archive members read ahead into spools) at the same time
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", 8))
+
+# Most files one /download/zip archive may contain
+ZIP_MAX_FILES = int(os.getenv("ZIP_MAX_FILES", 500))
+
+# Seconds an updated file's previous blob is kept (so downloads already streaming it can finish) before it is released
+REVISION_GC_DELAY = float(os.getenv("REVISION_GC_DELAY", 60))
+
+# Per-bucket GridFS chunk size in bytes, e.g. "video=4194304,json=65536" (others use GridFS's 255 KiB)
+GRIDFS_CHUNK_SIZES = {bucket: int(size) for bucket, size in (item.split("=", 1) for item in os.getenv("GRIDFS_CHUNK_SIZES", "").replace(" ", "").split(",") if "=" in item)}
+
+# Per-bucket storage compression, e.g. "text=zstd,csv=gzip,json=gzip" (empty = store everything as-is)
+STORAGE_CODECS = dict(item.split("=", 1) for item in os.getenv("STORAGE_CODECS", "").replace(" ", "").split(",") if "=" in item)
+# WiredTiger block compressor for newly created extracted-text collections: <bucket>Content, pdfPages,
+# content_chunks and json_values (e.g. "zstd"; empty = server default)
+CONTENT_BLOCK_COMPRESSOR = os.getenv("CONTENT_BLOCK_COMPRESSOR", "")
+
+# PDF extraction limits: pages, total text bytes, and seconds per page (pages past the limit are skipped)
+PDF_MAX_PAGES = int(os.getenv("PDF_MAX_PAGES", 5000))
+PDF_MAX_TEXT_BYTES = int(os.getenv("PDF_MAX_TEXT_BYTES", 32 * 1024 * 1024))
+PDF_PAGE_TIMEOUT = float(os.getenv("PDF_PAGE_TIMEOUT", 10))
+
+# CSV extraction: bytes sampled to detect the encoding, and rows parsed per pandas chunk
+CSV_SAMPLE_BYTES = int(os.getenv("CSV_SAMPLE_BYTES", 64 * 1024))
+CSV_CHUNK_ROWS = int(os.getenv("CSV_CHUNK_ROWS", 50000))
+
+# JSON key paths whose values are indexed for /json/search, e.g. "id,customer.id,status" (array positions are left out: "items.sku")
+JSON_INDEX_PATHS = [path for path in os.getenv("JSON_INDEX_PATHS", "").replace(" ", "").split(",") if path]
+# Most distinct values indexed per path of one JSON file (the rest are still searchable as text)
+JSON_INDEX_MAX_VALUES = int(os.getenv("JSON_INDEX_MAX_VALUES", 100000))
+
+# Lines of each file's extracted text kept for ?summary=true previews (computed at extraction)
+PREVIEW_LINES = int(os.getenv("PREVIEW_LINES", 20))
+# Most lines/pages/rows one windowed preview (?offset=&limit=) may return
+PREVIEW_MAX_LIMIT = int(os.getenv("PREVIEW_MAX_LIMIT", 10000))
+
+# Thumbnail variants of image/video files (?variant=name): name=longest edge in pixels
+THUMBNAIL_SIZES = {name: int(size) for name, size in (item.split("=", 1) for item in os.getenv("THUMBNAIL_SIZES", "thumb=160,small=480,medium=1024").replace(" ", "").split(",") if "=" in item)}
+# Format of a variant asked for without one, "webp" or "jpeg" (WebP falls back to JPEG for clients that don't accept it)
+THUMBNAIL_FORMAT = os.getenv("THUMBNAIL_FORMAT", "webp")
+THUMBNAIL_QUALITY = int(os.getenv("THUMBNAIL_QUALITY", 80))
+# Variants generated right after upload instead of on first request, e.g. "thumb,small.jpeg"
+THUMBNAIL_PREGENERATE = [variant for variant in os.getenv("THUMBNAIL_PREGENERATE", "").replace(" ", "").split(",") if variant]
+# ffmpeg binary that grabs video poster frames (none found = no video variants), and the second it grabs
+FFMPEG_PATH = os.getenv("FFMPEG_PATH", "ffmpeg")
+VIDEO_POSTER_SECOND = float(os.getenv("VIDEO_POSTER_SECOND", 1))
+# Most bytes of a video fed to ffmpeg to find its poster frame
+VIDEO_POSTER_MAX_BYTES = int(os.getenv("VIDEO_POSTER_MAX_BYTES", 64 * 1024 * 1024))
+# Largest image read into memory to make its thumbnails (larger ones get a 413)
+THUMBNAIL_MAX_SOURCE_BYTES = int(os.getenv("THUMBNAIL_MAX_SOURCE_BYTES", 64 * 1024 * 1024))
@@ -0,0 +1,125 @@
+"""Write-behind buffering for the downloadsCount / viewsCount counters.
+
+Serving a file used to cost an extra ``update_one($inc)`` on the hot read
+path. Increments are now summed in memory per (bucket, file_id) and
+flushed every ``COUNTER_FLUSH_INTERVAL`` seconds (or once
+``COUNTER_MAX_BUFFER`` files are pending, and on shutdown) as one unordered
+``bulk_write`` per collection. Without a running flush timer
+(``COUNTER_FLUSH_INTERVAL=0``, or no lifespan startup) every increment is
+written through. Updates never upsert, so counting an unknown
+id does not create a phantom ``.files`` document.
+
+Every increment also updates the in-memory leaderboard right away, and the
+flush adds it to the hour's ``counter_history`` document that the 24h/7d
+rankings are rebuilt from.
+
+Flushes use ``COUNTER_WRITE_CONCERN``: a counter can afford a weaker write
+concern than the files themselves. A write that fails is retried by the
+next flush on its own collection only (only its failed operations, for a
+partially applied bulk_write), so the writes that went through are not
+applied twice.
+"""
+import asyncio
+import logging
+from collections import Counter, defaultdict
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from app.catalog import BUCKETS
+from app.config import COUNTER_FLUSH_INTERVAL, COUNTER_MAX_BUFFER
+from app.db import COUNTER_WRITES, db
+from app.leaderboard import current_hour, leaderboard
+
+logger = logging.getLogger(__name__)
+
+# The collections a flush writes to, with the counter write concern
+counter_collections = {name: db[name].with_options(write_concern=COUNTER_WRITES) for name in ["catalog", "counter_history", *(f"{bucket}.files" for bucket in BUCKETS)]}
+
+
+# The update adding counts to one counter_history (key is (bucket, file_id, hour)) or file (key is (bucket, file_id)) document
+def _counter_op(collection: str, key: tuple, counts: Counter):
+    if collection == "counter_history":
+        bucket, file_id, hour = key
+        # History documents are ours to create, so this one upserts
+        return UpdateOne({"file_id": file_id, "hour": hour}, {"$inc": dict(counts), "$setOnInsert": {"bucket": bucket}}, upsert=True)
+    return UpdateOne({"_id": key[1]}, {"$inc": dict(counts)})
+
+
+def _unwritten():
+    return defaultdict(lambda: defaultdict(Counter))
+
+
+class CounterBuffer:
+    def __init__(self, flush_interval: float, max_buffer: int):
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self.pending = defaultdict(Counter)  # (bucket, file_id, hour) -> {field: increment}
+        self.unwritten = _unwritten()  # collection -> key -> {field: increment} that failed to flush
+        self._task = None
+
+    async def increment(self, bucket: str, file_id, field: str, amount: int = 1):
+        await self.increment_many([(bucket, file_id)], field, amount)
+
+    # Count several files at once; in write-through mode they still go out in one flush
+    async def increment_many(self, files, field: str, amount: int = 1):
+        hour = current_hour()
+        for bucket, file_id in files:
+            self.pending[(bucket, file_id, hour)][field] += amount
+            leaderboard.record(bucket, file_id, field, amount, hour)
+        # Write-through when there is no flush timer: a flush interval of 0, or a host that never ran the
+        # lifespan startup (some serverless runtimes), where buffered counts would be lost with the instance
+        if self._task is None or len(self.pending) >= self.max_buffer:
+            await self.flush()
+
+    async def flush(self):
+        if not self.pending and not self.unwritten:
+            return
+        pending, self.pending = self.pending, defaultdict(Counter)
+        writes, self.unwritten = self.unwritten, _unwritten()
+        for (bucket, file_id, hour), counts in pending.items():
+            writes["counter_history"][(bucket, file_id, hour)].update(counts)
+            writes["catalog"][(bucket, file_id)].update(counts)
+            writes[f"{bucket}.files"][(bucket, file_id)].update(counts)
+
+        names = list(writes)
+        results = await asyncio.gather(
+            *(counter_collections[name].bulk_write([_counter_op(name, key, counts) for key, counts in writes[name].items()], ordered=False) for name in names),
+            return_exceptions=True
+        )
+        failed = False
+        for name, result in zip(names, results):
+            if not isinstance(result, Exception):
+                continue
+            logger.error(f"Counter flush to {name} failed, will retry: {str(result)}")
+            keys = list(writes[name])
+            if isinstance(result, BulkWriteError):
+                # The other operations were applied (write concern errors included); only these are retried
+                keys = [keys[error["index"]] for error in result.details.get("writeErrors", [])]
+            for key in keys:
+                self.unwritten[name][key].update(writes[name][key])
+            failed = True
+        if not failed:
+            logger.info(f"Flushed counters for {len({(bucket, file_id) for bucket, file_id, hour in pending})} files")
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    def start(self):
+        if self.flush_interval > 0 and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+
+counter_buffer = CounterBuffer(COUNTER_FLUSH_INTERVAL, COUNTER_MAX_BUFFER)
@@ -1,18 +1,139 @@
-from pymongo import MongoClient
-from gridfs import GridFS
-from app.config import MONGODB_URI
-
-# Connect to MongoDB Atlas
-mongo_client = MongoClient(MONGODB_URI)
-db = mongo_client["file_upload_db"] #Atlas
-
-# Define separate GridFS buckets
-pdf_gridfs = GridFS(db, collection="pdf")      # For PDFs
-image_gridfs = GridFS(db, collection="image")  # For images
-json_gridfs = GridFS(db, collection="json")  # For json file
-word_gridfs = GridFS(db, collection="word")  # For word file
-text_gridfs = GridFS(db, collection="text")  # For text file
-csv_gridfs = GridFS(db, collection="csv")  # For csv file
-audio_gridfs = GridFS(db, collection="audio") #For audio file
-video_gridfs = GridFS(db, collection="video") #For video file
-other_gridfs = GridFS(db, collection="other")  # For other files
+"""MongoDB client, created when the app starts instead of at import.
+
+Creating the client resolves a mongodb+srv:// URI's DNS records and starts
+the driver's monitor threads, and importing Motor takes a while too; done at
+import, all of that landed on every serverless cold start before the app
+could even load. ``connect()`` now does it from the app's lifespan handler,
+and with ``warm_up`` pings the server so the first request finds an open
+connection. Code that runs without lifespan events gets the client on first
+use instead.
+
+``db`` stands in for the database: ``db["name"]`` is a handle that looks the
+collection up on the current client each time it is used, so modules can
+keep defining their collections at import. ``db["name"].with_options(...)``
+gives such a handle with its own read preference or write concern.
+
+The pool, timeouts and wire compression come from the MONGO_* settings in
+app.config (they take precedence over the same options in the URI).
+Listing, search and top/stats queries read with
+``LISTING_READS``, so on a replica set they can be served by
+secondaries, and the counter flushes write with ``COUNTER_WRITES``.
+Everything else keeps the client defaults: primary reads, so a file is
+readable right after its upload returns.
+"""
+from gridfs import DEFAULT_CHUNK_SIZE
+from pymongo.read_preferences import Nearest, Primary, PrimaryPreferred, Secondary, SecondaryPreferred
+from pymongo.write_concern import WriteConcern
+
+from app.config import (
+    COUNTER_WRITE_CONCERN, GRIDFS_CHUNK_SIZES, MONGO_COMPRESSORS, MONGO_CONNECT_TIMEOUT_MS, MONGO_LISTING_READ_PREFERENCE, MONGO_MAX_IDLE_TIME_MS,
+    MONGO_MAX_POOL_SIZE, MONGO_MAX_STALENESS, MONGO_MIN_POOL_SIZE, MONGO_SERVER_SELECTION_TIMEOUT_MS, MONGODB_URI,
+)
+from app.instrumentation import RoundTripListener
+
+DATABASE_NAME = "file_upload_db"
+
+READ_PREFERENCES = {"primaryPreferred": PrimaryPreferred, "secondary": Secondary, "secondaryPreferred": SecondaryPreferred, "nearest": Nearest}
+
+
+def read_preference(mode: str, max_staleness: int = -1):
+    if mode == "primary":
+        return Primary()
+    if mode not in READ_PREFERENCES:
+        raise ValueError(f"Unknown read preference {mode!r} (choose from primary, {', '.join(READ_PREFERENCES)})")
+    return READ_PREFERENCES[mode](max_staleness=max_staleness)
+
+
+# "" keeps the client's write concern, digits are a number of nodes, anything else is a tag like "majority"
+def write_concern(value: str):
+    if not value:
+        return None
+    return WriteConcern(w=int(value) if value.isdigit() else value)
+
+
+LISTING_READS = read_preference(MONGO_LISTING_READ_PREFERENCE, MONGO_MAX_STALENESS)
+COUNTER_WRITES = write_concern(COUNTER_WRITE_CONCERN)
+
+_client = None
+
+
+def client_options() -> dict:
+    options = {
+        "maxPoolSize": MONGO_MAX_POOL_SIZE,
+        "minPoolSize": MONGO_MIN_POOL_SIZE,
+        "maxIdleTimeMS": MONGO_MAX_IDLE_TIME_MS,
+        "connectTimeoutMS": MONGO_CONNECT_TIMEOUT_MS,
+        "serverSelectionTimeoutMS": MONGO_SERVER_SELECTION_TIMEOUT_MS,
+    }
+    if MONGO_COMPRESSORS:
+        options["compressors"] = MONGO_COMPRESSORS
+    return options
+
+
+def get_client():
+    global _client
+    if _client is None:
+        from motor.motor_asyncio import AsyncIOMotorClient
+        # Connect to MongoDB Atlas (Motor keeps every database call off the event loop)
+        _client = AsyncIOMotorClient(MONGODB_URI, event_listeners=[RoundTripListener()], **client_options())
+    return _client
+
+
+def get_database():
+    return get_client()[DATABASE_NAME]
+
+
+class LazyCollection:
+    """A collection handle resolved against the current client on each use."""
+
+    def __init__(self, name: str, **options):
+        self.name = name
+        self.options = options
+        self._client = None
+        self._collection = None
+
+    def with_options(self, **options) -> "LazyCollection":
+        return LazyCollection(self.name, **{**self.options, **options})
+
+    def _resolve(self):
+        client = get_client()
+        if self._client is not client:
+            collection = client[DATABASE_NAME][self.name]
+            if self.options:
+                collection = collection.with_options(**self.options)
+            self._client, self._collection = client, collection
+        return self._collection
+
+    def __getattr__(self, attr):
+        return getattr(self._resolve(), attr)
+
+
+class LazyDatabase:
+    def __getitem__(self, name: str) -> LazyCollection:
+        return LazyCollection(name)
+
+    def __getattr__(self, attr):
+        return getattr(get_database(), attr)
+
+
+db = LazyDatabase() #Atlas
+
+
+# GridFS chunk size of new files in a bucket (app.storage writes the chunks with it): larger chunks mean fewer
+# documents (and round trips) per video, smaller ones less wasted reading for Range requests on small files
+def chunk_size_of(bucket: str) -> int:
+    return GRIDFS_CHUNK_SIZES.get(bucket, DEFAULT_CHUNK_SIZE)
+
+
+async def connect(warm_up: bool = False):
+    """Create the client; with warm_up, also open a connection to the server."""
+    client = get_client()
+    if warm_up:
+        await client.admin.command("ping")
+
+
+def close():
+    global _client
+    if _client is not None:
+        _client.close()
+        _client = None
@@ -0,0 +1,251 @@
+"""Thumbnails and video poster frames, served instead of the original.
+
+``GET /file/{file_id}/{bucket}?variant=`` returns a resized copy of an image,
+or of a frame of a video, so a gallery doesn't download full-size originals
+to show a grid. A variant is a size name from ``THUMBNAIL_SIZES`` with an
+optional format: ``thumb``, ``small.webp``, ``medium.jpeg``. Without a format
+it is ``THUMBNAIL_FORMAT``, and WebP falls back to JPEG for clients whose
+Accept header doesn't list it.
+
+Resizing needs Pillow (``pip install Pillow``); video frames also need an
+ffmpeg binary (``FFMPEG_PATH``). Without them variant requests get a 501 and
+everything else works as before. ffmpeg reads the video from a pipe and
+stops at the first frame it needs, reading at most
+``VIDEO_POSTER_MAX_BYTES``. A video it can't decode from its beginning (an
+MP4 with its index at the end) gets a 415. Images over
+``THUMBNAIL_MAX_SOURCE_BYTES`` get a 413.
+
+Derivatives are made on first request, or right after upload for the
+variants in ``THUMBNAIL_PREGENERATE``, and stored in the ``derivatives``
+GridFS bucket keyed by (blob, variant). Files sharing a blob share their
+thumbnails, and they are deleted along with the blob.
+"""
+import asyncio
+import io
+import logging
+import shutil
+
+from bson.objectid import ObjectId
+from fastapi import HTTPException
+from pymongo import ASCENDING, IndexModel
+from pymongo.errors import DuplicateKeyError
+from starlette.concurrency import run_in_threadpool
+
+from app.blobcache import blob_cache
+from app.config import (
+    EXTRACTION_TIMEOUT, FFMPEG_PATH, THUMBNAIL_FORMAT, THUMBNAIL_MAX_SOURCE_BYTES, THUMBNAIL_PREGENERATE, THUMBNAIL_QUALITY, THUMBNAIL_SIZES,
+    VIDEO_POSTER_MAX_BYTES, VIDEO_POSTER_SECOND,
+)
+from app.db import db, get_database
+
+logger = logging.getLogger(__name__)
+
+# Buckets whose files have variants
+DERIVATIVE_BUCKETS = ("image", "video")
+
+# Output formats: content type and Pillow format name
+FORMATS = {"webp": ("image/webp", "WEBP"), "jpeg": ("image/jpeg", "JPEG")}
+FORMAT_ALIASES = {"jpg": "jpeg"}
+
+derivative_files = db["derivatives.files"]
+
+# (blob_id, variant) -> Task, so concurrent first requests generate a variant once
+_generating = {}
+# Background pregeneration tasks (kept so they are not garbage collected)
+_tasks = set()
+
+
+# The derivatives GridFS bucket, on the current client (see app.db)
+def derivatives_gridfs():
+    from motor.motor_asyncio import AsyncIOMotorGridFSBucket
+    return AsyncIOMotorGridFSBucket(get_database(), bucket_name="derivatives")
+
+
+async def ensure_derivative_indexes():
+    await derivative_files.create_indexes([
+        IndexModel([("metadata.blob_id", ASCENDING), ("metadata.variant", ASCENDING)], name="blob_id_variant", unique=True)
+    ])
+
+
+def parse_variant(value: str, accept: str = ""):
+    """Return ``(variant, negotiated)``: the canonical "name.format" and whether the format came from Accept."""
+    name, _, fmt = value.lower().partition(".")
+    if name not in THUMBNAIL_SIZES:
+        raise HTTPException(status_code=400, detail=f"Unknown variant (choose from {', '.join(THUMBNAIL_SIZES)})")
+    negotiated = not fmt
+    if negotiated:
+        fmt = THUMBNAIL_FORMAT
+        if fmt == "webp" and "image/webp" not in accept:
+            fmt = "jpeg"
+    fmt = FORMAT_ALIASES.get(fmt, fmt)
+    if fmt not in FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unknown variant format (choose from {', '.join(FORMATS)})")
+    return f"{name}.{fmt}", negotiated
+
+
+def content_type_of(variant: str) -> str:
+    return FORMATS[variant.rpartition(".")[2]][0]
+
+
+# Pillow is imported on first use, so the API runs without it
+def _pillow():
+    try:
+        from PIL import Image, ImageOps
+    except ImportError:
+        raise HTTPException(status_code=501, detail="Thumbnails need the Pillow package")
+    return Image, ImageOps
+
+
+def render(data: bytes, size: int, fmt: str) -> bytes:
+    """Resize an encoded image to fit in size x size pixels and encode it as fmt. Blocking; run it in a thread."""
+    Image, ImageOps = _pillow()
+    try:
+        with Image.open(io.BytesIO(data)) as original:
+            # JPEGs are decoded straight at a reduced scale
+            original.draft("RGB", (size, size))
+            image = ImageOps.exif_transpose(original)
+            image.thumbnail((size, size))
+            has_alpha = image.mode in ("RGBA", "LA", "PA") or "transparency" in image.info
+            mode = ("L" if image.mode == "L" else "RGB") if fmt == "jpeg" else ("RGBA" if has_alpha else "RGB")
+            if image.mode != mode:
+                image = image.convert(mode)
+            out = io.BytesIO()
+            image.save(out, FORMATS[fmt][1], quality=THUMBNAIL_QUALITY)
+            return out.getvalue()
+    except (OSError, Image.DecompressionBombError) as e:
+        logger.error(f"Could not make a thumbnail: {str(e)}")
+        raise HTTPException(status_code=415, detail="Could not decode the image")
+
+
+# Feed at most VIDEO_POSTER_MAX_BYTES of the video to ffmpeg's stdin; it stops reading once it has its frame
+async def _feed(stdin, chunks):
+    sent = 0
+    try:
+        async for data in chunks:
+            data = data[:VIDEO_POSTER_MAX_BYTES - sent]
+            stdin.write(data)
+            await stdin.drain()
+            sent += len(data)
+            if sent >= VIDEO_POSTER_MAX_BYTES:
+                break
+    except (BrokenPipeError, ConnectionResetError):
+        pass  # ffmpeg exited
+    finally:
+        stdin.close()
+
+
+# Grab one frame of a video as PNG with ffmpeg, piping it the start of the video
+async def grab_frame(open_source) -> bytes:
+    ffmpeg = shutil.which(FFMPEG_PATH)
+    if ffmpeg is None:
+        raise HTTPException(status_code=501, detail="No video decoder available for poster frames")
+    # A clip shorter than VIDEO_POSTER_SECOND gives no frame there; take its first one instead
+    for second in dict.fromkeys((VIDEO_POSTER_SECOND, 0)):
+        process = await asyncio.create_subprocess_exec(
+            ffmpeg, "-v", "error", "-ss", str(second), "-i", "pipe:0", "-frames:v", "1", "-f", "image2pipe", "-vcodec", "png", "-",
+            stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+        )
+        feeding = asyncio.create_task(_feed(process.stdin, open_source()))
+        try:
+            frame, errors = await asyncio.wait_for(asyncio.gather(process.stdout.read(), process.stderr.read()), EXTRACTION_TIMEOUT)
+        except asyncio.TimeoutError:
+            process.kill()
+            raise HTTPException(status_code=504, detail="Timed out grabbing a video frame")
+        finally:
+            feeding.cancel()
+            await process.wait()
+        if frame:
+            return frame
+    logger.error(f"ffmpeg found no frame: {errors.decode(errors='replace').strip()}")
+    raise HTTPException(status_code=415, detail="Could not decode a frame of the video")
+
+
+# Read an original image into memory, refusing ones too large to thumbnail
+async def read_image(chunks) -> bytes:
+    parts, size = [], 0
+    async for data in chunks:
+        size += len(data)
+        if size > THUMBNAIL_MAX_SOURCE_BYTES:
+            raise HTTPException(status_code=413, detail=f"Image too large for a thumbnail (max {THUMBNAIL_MAX_SOURCE_BYTES} bytes)")
+        parts.append(data)
+    return b"".join(parts)
+
+
+async def _create(bucket: str, blob_id, variant: str, open_source) -> bytes:
+    name, _, fmt = variant.partition(".")
+    if bucket == "video":
+        picture = await grab_frame(open_source)
+    else:
+        picture = await read_image(open_source())
+    data = await run_in_threadpool(render, picture, THUMBNAIL_SIZES[name], fmt)
+
+    derivative_id = ObjectId()
+    metadata = {"blob_id": blob_id, "bucket": bucket, "variant": variant, "contentType": content_type_of(variant)}
+    try:
+        await derivatives_gridfs().upload_from_stream_with_id(derivative_id, f"{blob_id}-{variant}", data, metadata=metadata)
+    except DuplicateKeyError:
+        # Another worker stored the same variant first; ours is identical
+        await db["derivatives.chunks"].delete_many({"files_id": derivative_id})
+    logger.info(f"Created {variant} of blob {blob_id}, Bucket: {bucket}, Size: {len(data)}")
+    return data
+
+
+async def _load(bucket: str, blob_id, variant: str, open_source) -> bytes:
+    doc = await derivative_files.find_one({"metadata.blob_id": blob_id, "metadata.variant": variant}, {"_id": 1})
+    if doc is not None:
+        grid_out = await derivatives_gridfs().open_download_stream(doc["_id"])
+        return await grid_out.read()
+    task = _generating.get((blob_id, variant))
+    if task is None:
+        task = asyncio.create_task(_create(bucket, blob_id, variant, open_source))
+        _generating[(blob_id, variant)] = task
+        task.add_done_callback(lambda task: _generating.pop((blob_id, variant), None))
+    # A client that goes away doesn't cancel the generation others may be waiting for
+    return await asyncio.shield(task)
+
+
+async def get_derivative(bucket: str, file_doc: dict, variant: str, open_source) -> bytes:
+    """Return a variant of a file, generating it first if needed.
+
+    ``open_source()`` returns an async iterator over the original's bytes.
+    """
+    if bucket == "image" and file_doc.get("length", 0) > THUMBNAIL_MAX_SOURCE_BYTES:
+        raise HTTPException(status_code=413, detail=f"Image too large for a thumbnail (max {THUMBNAIL_MAX_SOURCE_BYTES} bytes)")
+    blob_id = file_doc.get("blob_id", file_doc["_id"])
+    load = lambda: _load(bucket, blob_id, variant, open_source)
+    # Thumbnails are small; their size is only known once loaded
+    if blob_cache.accepts("derivatives", 0):
+        data, hit = await blob_cache.get("derivatives", (blob_id, variant), load)
+        return data
+    return await load()
+
+
+async def _pregenerate(bucket: str, file_doc: dict, open_source):
+    for value in THUMBNAIL_PREGENERATE:
+        try:
+            variant, negotiated = parse_variant(value, "image/webp")
+            await get_derivative(bucket, file_doc, variant, open_source)
+        except HTTPException as e:
+            logger.error(f"Could not pregenerate {value} of {file_doc['filename']}, Bucket: {bucket}: {e.detail}")
+        except Exception as e:
+            logger.error(f"Could not pregenerate {value} of {file_doc['filename']}, Bucket: {bucket}: {str(e)}")
+
+
+def schedule_derivatives(bucket: str, file_doc: dict, open_source):
+    """Generate the THUMBNAIL_PREGENERATE variants of a new upload in the background."""
+    if bucket not in DERIVATIVE_BUCKETS or not THUMBNAIL_PREGENERATE:
+        return
+    task = asyncio.create_task(_pregenerate(bucket, file_doc, open_source))
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+
+
+async def delete_derivatives(blob_ids: list):
+    """Delete the variants of blobs nobody references any more."""
+    ids = []
+    async for doc in derivative_files.find({"metadata.blob_id": {"$in": blob_ids}}, {"metadata": 1}):
+        ids.append(doc["_id"])
+        blob_cache.discard("derivatives", (doc["metadata"]["blob_id"], doc["metadata"]["variant"]))
+    if ids:
+        await derivative_files.delete_many({"_id": {"$in": ids}})
+        await db["derivatives.chunks"].delete_many({"files_id": {"$in": ids}})
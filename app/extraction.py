@@ -0,0 +1,447 @@
+"""Text extraction for the content buckets (pdf, word, text, csv, json).
+
+Extraction is CPU-bound and holds the GIL, so it runs in a separate process
+pool (see ``queue_extraction`` in app.main). This module is what the worker
+processes import: it only needs the config and a plain pymongo client, not
+the FastAPI app or the Motor client.
+
+The parsing libraries (PyPDF2, python-docx, pandas, chardet) take about half
+a second to import, so each is imported by the function that uses it. The
+API process imports this module at startup but only pays for them once it
+extracts a file itself (EXTRACTION_WORKERS=0).
+
+JSON is parsed with ijson when it is installed, incrementally, and otherwise
+read whole and parsed with orjson or the json module (see iter_json_leaves).
+"""
+import codecs
+import signal
+import threading
+import time
+from contextlib import contextmanager
+from tempfile import SpooledTemporaryFile
+
+from bson.objectid import ObjectId
+from gridfs import GridOut
+from pymongo import MongoClient
+
+from app.compression import get_codec
+from app.db import DATABASE_NAME, client_options
+from app.config import MONGODB_URI, UPLOAD_BLOCK_SIZE, PDF_MAX_PAGES, PDF_MAX_TEXT_BYTES, PDF_PAGE_TIMEOUT, CSV_SAMPLE_BYTES, CSV_CHUNK_ROWS, PREVIEW_LINES, JSON_INDEX_PATHS, JSON_INDEX_MAX_VALUES
+
+
+class ExtractionTimeout(Exception):
+    """Raised inside a worker when a job runs past its time limit."""
+
+
+class PageTimeout(Exception):
+    """Raised inside a worker when a single PDF page runs past PDF_PAGE_TIMEOUT."""
+
+
+# Monotonic time the running job must finish by, while SIGALRM enforces it (None otherwise)
+_deadline = None
+
+
+# Limit one page to seconds, within what is left of the job's own time limit.
+# Only possible while the job timer is armed; otherwise the page runs unlimited.
+@contextmanager
+def page_time_limit(seconds: float):
+    if _deadline is None or not seconds:
+        yield
+        return
+    signal.setitimer(signal.ITIMER_REAL, max(min(seconds, _deadline - time.monotonic()), 0.001))
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, max(_deadline - time.monotonic(), 0.001))
+
+
+# Yield (page_no, text) for each page of a PDF, calling extract_text once per page.
+# A page that runs past PDF_PAGE_TIMEOUT is yielded with text None.
+def iter_pdf_pages(stream):
+    import PyPDF2 #PDF to text
+    reader = PyPDF2.PdfReader(stream)
+    for page_no, page in enumerate(reader.pages, start=1):
+        try:
+            with page_time_limit(PDF_PAGE_TIMEOUT):
+                text = page.extract_text() or ""
+        except PageTimeout:
+            text = None
+        yield page_no, text
+
+# Lines of text are handed to write_line_chunks this many at a time
+LINES_PER_BATCH = 50000
+
+# Yield Series of lines, LINES_PER_BATCH at a time
+def _batches(lines):
+    import pandas as pd
+    batch = []
+    for line in lines:
+        batch.append(line)
+        if len(batch) == LINES_PER_BATCH:
+            yield pd.Series(batch, dtype=object)
+            batch = []
+    if batch:
+        yield pd.Series(batch, dtype=object)
+
+# Yield the lines of a .docx file (a paragraph with line breaks gives several lines)
+def iter_docx_lines(stream):
+    from docx import Document  #Word to text
+    doc = Document(stream)
+    return _batches(line for para in doc.paragraphs for line in para.text.split("\n"))
+
+# Yield the lines of a UTF-8 text file, decoding it a block at a time
+def iter_text_lines(stream):
+    def lines():
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        rest = ""
+        while True:
+            block = stream.read(UPLOAD_BLOCK_SIZE)
+            parts = (rest + decoder.decode(block, final=not block)).splitlines(keepends=True)
+            # The last line may continue in the next block (even a "\r" may be half of "\r\n")
+            rest = parts.pop() if block and parts and not parts[-1].endswith("\n") else ""
+            yield from (part.splitlines()[0] for part in parts)
+            if not block:
+                break
+    return _batches(lines())
+
+#Detects encoding of a file using chardet, feeding it at most sample_size bytes (it usually decides sooner).
+def detect_encoding(stream, sample_size: int = CSV_SAMPLE_BYTES):
+    from chardet.universaldetector import UniversalDetector #Detect encoder
+    detector = UniversalDetector()
+    fed = 0
+    while not detector.done and fed < sample_size:
+        block = stream.read(min(UPLOAD_BLOCK_SIZE, sample_size - fed))
+        if not block:
+            break
+        detector.feed(block)
+        fed += len(block)
+    detector.close()
+    encoding = detector.result["encoding"]
+    # A pure-ASCII sample says nothing about the rest of the file; UTF-8 covers both
+    if not encoding or encoding.lower() == "ascii":
+        return "utf-8"
+    return encoding
+
+# Yield a CSV as Series of "a, b, c" row strings, CSV_CHUNK_ROWS rows at a time.
+# Rows are joined column by column (vectorized) instead of with a Python lambda per row.
+def iter_csv_lines(stream, encoding: str):
+    import pandas as pd #CSV to text
+    reader = pd.read_csv(stream, dtype=str, encoding=encoding, encoding_errors="replace", header=None, chunksize=CSV_CHUNK_ROWS)
+    for chunk in reader:
+        columns = [chunk[name].astype(str) for name in chunk.columns]
+        lines = columns[0].str.cat(columns[1:], sep=", ") if len(columns) > 1 else columns[0]
+        # A quoted field may span lines; keep one row per line so rows can be counted in the chunks
+        if lines.str.contains("[\r\n]").any():
+            lines = lines.str.replace(r"\r\n|[\r\n]", " ", regex=True)
+        yield lines
+
+# Header, inferred dtypes of a CSV from its first rows (for previews); empty if pandas can't parse them
+def csv_column_metadata(stream, encoding: str) -> dict:
+    import pandas as pd
+    try:
+        sample = pd.read_csv(stream, encoding=encoding, encoding_errors="replace", nrows=CSV_SAMPLE_ROWS)
+    except (ValueError, pd.errors.ParserError):
+        return {}
+    return {"columns": [str(name) for name in sample.columns], "dtypes": [str(dtype) for dtype in sample.dtypes]}
+
+
+# Decompress a stored blob into a seekable spool (extractors seek back to the start), one block at a time
+def decompress_to_spool(source, codec):
+    spool = SpooledTemporaryFile(max_size=16 * UPLOAD_BLOCK_SIZE)
+    reader = codec.reader(source)
+    while True:
+        block = reader.read(UPLOAD_BLOCK_SIZE)
+        if not block:
+            break
+        spool.write(block)
+    spool.seek(0)
+    return spool
+
+
+# Pages are written to pdfPages this many at a time
+PAGES_PER_INSERT = 50
+
+
+def store_pdf_pages(db, blob_id, stream) -> dict:
+    """Extract a PDF page by page into pdfPages documents (file_id, page_no, text).
+
+    Pages are written in small batches as they are extracted, so neither the
+    whole text nor a single oversized document is ever built. Extraction stops
+    at PDF_MAX_PAGES pages or PDF_MAX_TEXT_BYTES of text. Returns the fields
+    of the pdfContent document that summarizes the pages.
+    """
+    pages = db["pdfPages"]
+    pages.delete_many({"file_id": blob_id})  # Left over from an earlier, interrupted attempt
+    batch = []
+    page_count = 0
+    text_bytes = 0
+    skipped = []
+    truncated = False
+    preview = []
+    try:
+        for page_no, text in iter_pdf_pages(stream):
+            if page_no > PDF_MAX_PAGES:
+                truncated = True
+                break
+            if text is None:
+                skipped.append(page_no)
+                text = ""
+            text_bytes += len(text.encode("utf-8"))
+            if text_bytes > PDF_MAX_TEXT_BYTES:
+                truncated = True
+                break
+            page_count = page_no
+            if len(preview) < PREVIEW_LINES:
+                preview.extend(line for line in text.splitlines() if line.strip())
+                del preview[PREVIEW_LINES:]
+            batch.append({"file_id": blob_id, "page_no": page_no, "text": text})
+            if len(batch) == PAGES_PER_INSERT:
+                pages.insert_many(batch)
+                batch = []
+        if batch:
+            pages.insert_many(batch)
+    except BaseException:
+        pages.delete_many({"file_id": blob_id})
+        raise
+    return {"pages": page_count, "truncated": truncated, "skipped_pages": skipped, "preview": preview}
+
+
+# Rows of a CSV sampled for column metadata
+CSV_SAMPLE_ROWS = 1000
+
+# Target size of one content_chunks document. Well below MongoDB's 16 MB limit, and small
+# enough that a preview window only reads a little more text than it returns.
+CONTENT_CHUNK_CHARS = 256 * 1024
+
+
+def write_line_chunks(db, blob_id, bucket_name: str, batches):
+    """Write lines of extracted text into content_chunks documents.
+
+    ``batches`` yields pandas Series of lines (without line breaks). Each
+    document holds ``text`` (lines joined with newlines, about
+    CONTENT_CHUNK_CHARS at most), ``first_line`` and ``lines``, so a preview
+    window can find the few chunks it overlaps. Documents are written as each
+    batch arrives, so memory stays at one batch of lines. Returns
+    ``(line_count, chunk_count, preview)`` with the first PREVIEW_LINES lines.
+    """
+    chunks = db["content_chunks"]
+    chunks.delete_many({"file_id": blob_id})  # Left over from an earlier, interrupted attempt
+    line_count = 0
+    chunk_no = 0
+    preview = []
+    try:
+        for lines in batches:
+            if len(preview) < PREVIEW_LINES:
+                preview.extend(lines.iloc[:PREVIEW_LINES - len(preview)].tolist())
+            # Cut the lines into groups of about CONTENT_CHUNK_CHARS, by running length
+            groups = ((lines.str.len() + 1).cumsum().to_numpy() - 1) // CONTENT_CHUNK_CHARS
+            docs = []
+            for group, group_lines in lines.groupby(groups, sort=True):
+                docs.append({"file_id": blob_id, "bucket": bucket_name, "chunk_no": chunk_no, "first_line": line_count, "lines": len(group_lines), "text": "\n".join(group_lines)})
+                line_count += len(group_lines)
+                chunk_no += 1
+            if docs:
+                chunks.insert_many(docs)
+    except BaseException:
+        chunks.delete_many({"file_id": blob_id})
+        raise
+    return line_count, chunk_no, preview
+
+
+def store_csv_chunks(db, blob_id, stream) -> dict:
+    """Extract a CSV into content_chunks documents of consecutive rows.
+
+    Returns the fields of the csvContent document: row count, encoding, the
+    column metadata and the first rows as a preview.
+    """
+    encoding = detect_encoding(stream)
+    stream.seek(0)
+    metadata = csv_column_metadata(stream, encoding)
+    stream.seek(0)
+    rows, chunk_count, preview = write_line_chunks(db, blob_id, "csv", iter_csv_lines(stream, encoding))
+    return {"rows": rows, "chunks": chunk_count, "encoding": encoding, **metadata, "preview": preview}
+
+
+# Yield (path, value) for every scalar of a JSON file: a document, a top-level array, or NDJSON /
+# concatenated documents. The path is the dotted object keys with array positions left out, as
+# MongoDB queries name them ("items.sku"). counts["records"] is the number of top-level values,
+# counting the items of a top-level array instead of the array.
+def iter_json_leaves(stream, counts: dict):
+    try:
+        import ijson
+    except ImportError:
+        return _parsed_json_leaves(stream, counts)
+    return _streamed_json_leaves(ijson.parse(stream, multiple_values=True), counts)
+
+
+def _streamed_json_leaves(events, counts: dict):
+    stack = []  # [is_array, own path, path of the value being read] per open object/array
+    for prefix, event, value in events:
+        if event == "map_key":
+            top = stack[-1]
+            top[2] = f"{top[1]}.{value}" if top[1] else value
+            continue
+        if event in ("start_map", "start_array"):
+            path = stack[-1][2] if stack else ""
+            stack.append([event == "start_array", path, path])
+            continue
+        closed_array = False
+        if event in ("end_map", "end_array"):
+            closed_array = stack.pop()[0]
+        else:
+            # Non-integers come as Decimal (use_float overflows on huge integers in the C backend)
+            if event == "number" and not isinstance(value, int):
+                value = float(value)
+            yield (stack[-1][2] if stack else ""), value
+        if (not stack and not closed_array) or (len(stack) == 1 and stack[0][0]):
+            counts["records"] += 1
+
+
+# Without ijson: read the file whole and parse it with orjson (or json), line by line if it is not one document
+def _parsed_json_leaves(stream, counts: dict):
+    try:
+        from orjson import loads
+    except ImportError:
+        from json import loads
+    data = stream.read()
+    try:
+        values = [loads(data)]
+    except ValueError:
+        values = (loads(line) for line in data.splitlines() if line.strip())
+    for document in values:
+        for record in document if isinstance(document, list) else [document]:
+            counts["records"] += 1
+            stack = [("", record)]
+            while stack:
+                path, value = stack.pop()
+                if isinstance(value, dict):
+                    stack.extend(reversed([(f"{path}.{key}" if path else key, item) for key, item in value.items()]))
+                elif isinstance(value, list):
+                    stack.extend((path, item) for item in reversed(value))
+                else:
+                    yield path, value
+
+
+# Strings longer than this are not indexed in json_values (they are still searchable as text)
+JSON_MAX_VALUE_CHARS = 256
+# Indexed values are written to json_values this many at a time
+JSON_VALUES_PER_INSERT = 1000
+
+
+def indexable(value) -> bool:
+    if isinstance(value, str):
+        return len(value) <= JSON_MAX_VALUE_CHARS
+    if isinstance(value, int) and not isinstance(value, bool):
+        return -2 ** 63 <= value < 2 ** 63  # BSON has no bigger integers
+    return True
+
+
+def store_json(db, blob_id, stream) -> dict:
+    """Extract a JSON file into a text projection and the values of its indexed key paths.
+
+    Every scalar becomes a ``path: value`` line in content_chunks, so the
+    file is searchable by keys and values like a text file; the values found
+    at JSON_INDEX_PATHS go to ``json_values`` as (file_id, path, value)
+    documents, which /json/search looks up by index. The parsed document is
+    never stored; with ijson it is not even built, and memory stays at one
+    batch of lines. Returns the fields of the jsonContent document.
+    """
+    values = db["json_values"]
+    values.delete_many({"file_id": blob_id})  # Left over from an earlier, interrupted attempt
+    counts = {"records": 0, "values": 0}
+    seen = {path: set() for path in JSON_INDEX_PATHS}
+    batch = []
+
+    def lines():
+        for path, value in iter_json_leaves(stream, counts):
+            found = seen.get(path)
+            # (is bool, value): True and 1 are the same set member otherwise
+            if found is not None and len(found) < JSON_INDEX_MAX_VALUES and indexable(value) and (isinstance(value, bool), value) not in found:
+                found.add((isinstance(value, bool), value))
+                batch.append({"file_id": blob_id, "path": path, "value": value})
+                if len(batch) == JSON_VALUES_PER_INSERT:
+                    values.insert_many(batch)
+                    counts["values"] += len(batch)
+                    batch.clear()
+            if isinstance(value, str):
+                text = value if value.isprintable() else " ".join(value.splitlines())
+            else:
+                text = "null" if value is None else "true" if value is True else "false" if value is False else str(value)
+            yield f"{path}: {text}" if path else text
+
+    try:
+        line_count, chunk_count, preview = write_line_chunks(db, blob_id, "json", _batches(lines()))
+        if batch:
+            values.insert_many(batch)
+            counts["values"] += len(batch)
+    except BaseException:
+        values.delete_many({"file_id": blob_id})
+        raise
+    return {"records": counts["records"], "lines": line_count, "chunks": chunk_count, "indexed_values": counts["values"], "preview": preview}
+
+
+# One synchronous client per worker process, created on the first job
+_worker_client = None
+
+# A worker runs one job at a time, so it needs only a couple of connections whatever MONGO_MAX_POOL_SIZE is
+WORKER_MAX_POOL_SIZE = 2
+
+def get_worker_db():
+    global _worker_client
+    if _worker_client is None:
+        # Same timeouts and compressors as the API's client
+        _worker_client = MongoClient(MONGODB_URI, **{**client_options(), "maxPoolSize": WORKER_MAX_POOL_SIZE, "minPoolSize": 0})
+    return _worker_client[DATABASE_NAME]
+
+
+def _raise_timeout(signum, frame):
+    # Page limits share the job's timer; it is only the job's own limit once its deadline has passed
+    if _deadline is not None and time.monotonic() < _deadline - 0.001:
+        raise PageTimeout()
+    raise ExtractionTimeout()
+
+
+def run_extraction(bucket_name: str, blob_id: str, timeout: float = None) -> dict:
+    """Worker entry point: read a stored blob back from GridFS and build its content fields.
+
+    Returns the fields of the ``<bucket>Content`` document: a summary (counts
+    and the first lines), with the text itself in pdfPages / content_chunks
+    (and JSON values in json_values). When run in a process's main thread on
+    a POSIX system the job is interrupted with ExtractionTimeout after
+    ``timeout`` seconds.
+    """
+    global _deadline
+    use_alarm = (
+        bool(timeout)
+        and hasattr(signal, "setitimer")
+        and threading.current_thread() is threading.main_thread()
+    )
+    if use_alarm:
+        signal.signal(signal.SIGALRM, _raise_timeout)
+        _deadline = time.monotonic() + timeout
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        db = get_worker_db()
+        blob_id = ObjectId(blob_id)
+        # Any .files document referencing the blob has its length and chunk size
+        file_doc = db[f"{bucket_name}.files"].find_one({"$or": [{"blob_id": blob_id}, {"_id": blob_id}]})
+        if file_doc is None:
+            raise FileNotFoundError(f"No file references blob {blob_id}")
+        stored = {"_id": blob_id, "length": file_doc.get("storedLength", file_doc["length"])}
+        stream = GridOut(db[bucket_name], file_document={**file_doc, **stored})
+        codec = get_codec(file_doc.get("codec"))
+        if codec:
+            stream = decompress_to_spool(stream, codec)
+        if bucket_name == "json":
+            return store_json(db, blob_id, stream)
+        if bucket_name == "pdf":
+            return store_pdf_pages(db, blob_id, stream)
+        if bucket_name == "csv":
+            return store_csv_chunks(db, blob_id, stream)
+        lines = iter_docx_lines(stream) if bucket_name == "word" else iter_text_lines(stream)
+        line_count, chunk_count, preview = write_line_chunks(db, blob_id, bucket_name, lines)
+        return {"lines": line_count, "chunks": chunk_count, "preview": preview}
+    finally:
+        if use_alarm:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            _deadline = None
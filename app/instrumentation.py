@@ -0,0 +1,41 @@
+"""Per-request MongoDB round-trip counting, and per-command timings.
+
+A pymongo CommandListener sees every command the client sends. Motor runs
+each operation in a worker thread with a copy of the caller's context, so a
+counter object stored in a ContextVar is shared with the request that
+started the operation (including tasks it spawns with asyncio.gather).
+Every command's duration also goes to the /metrics histograms.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from pymongo import monitoring
+
+from app.metrics import mongo_command_failures, mongo_command_seconds
+
+current_round_trips = ContextVar("current_round_trips", default=None)
+
+
+class RoundTripListener(monitoring.CommandListener):
+    def started(self, event):
+        counter = current_round_trips.get()
+        if counter is not None:
+            counter["round_trips"] += 1
+
+    def succeeded(self, event):
+        mongo_command_seconds.observe(event.duration_micros / 1e6, event.command_name)
+
+    def failed(self, event):
+        mongo_command_seconds.observe(event.duration_micros / 1e6, event.command_name)
+        mongo_command_failures.inc(event.command_name)
+
+
+@contextmanager
+def count_round_trips():
+    """Count the database commands issued inside the block: ``with count_round_trips() as stats``."""
+    stats = {"round_trips": 0}
+    token = current_round_trips.set(stats)
+    try:
+        yield stats
+    finally:
+        current_round_trips.reset(token)
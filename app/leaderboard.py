@@ -0,0 +1,252 @@
+"""In-memory download/view leaderboards.
+
+``/top-downloads/`` used to run a sorted scan of all nine ``.files``
+collections per request, capped at 10 files per bucket. Rankings are now
+kept in memory as top-K lists (one per counter, window and bucket, plus an
+overall one) that the counter path updates on every increment, so a read is
+O(K). They are loaded from the catalog and the ``counter_history``
+collection at startup.
+
+Time windows (last 24h / 7d) come from hourly per-file counts: the counter
+flush writes them to ``counter_history`` (expired by a TTL index) and the
+leaderboard keeps the same hourly slots in memory, dropping them as they age
+out of a window.
+
+Each server process ranks what it has loaded plus what it has counted
+itself; with several workers set ``LEADERBOARD_REFRESH_INTERVAL`` to reload
+from the database periodically.
+"""
+import asyncio
+import heapq
+import logging
+from bisect import bisect_left, insort
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta, timezone
+
+from pymongo import ASCENDING, IndexModel
+
+from app.catalog import catalog_reads
+from app.config import LEADERBOARD_REFRESH_INTERVAL, LEADERBOARD_SIZE
+from app.db import LISTING_READS, db
+
+logger = logging.getLogger(__name__)
+
+counter_history = db["counter_history"]
+
+FIELDS = ("downloadsCount", "viewsCount")
+
+# Window name -> length in hours (None = all time)
+WINDOWS = {"all": None, "24h": 24, "7d": 24 * 7}
+HISTORY_HOURS = max(hours for hours in WINDOWS.values() if hours)
+
+
+def current_hour() -> datetime:
+    # Naive UTC, like the dates read back from BSON
+    return datetime.now(timezone.utc).replace(tzinfo=None, minute=0, second=0, microsecond=0)
+
+
+async def ensure_leaderboard_indexes():
+    await counter_history.create_indexes([
+        IndexModel([("file_id", ASCENDING), ("hour", ASCENDING)], name="file_id_hour", unique=True),
+        # Keep a spare day so a window never loses its oldest hour before the leaderboard does
+        IndexModel([("hour", ASCENDING)], name="hour_ttl", expireAfterSeconds=(HISTORY_HOURS + 24) * 3600),
+    ])
+
+
+class Ranking:
+    """The top ``size`` files by count, kept sorted (highest first, ties by id)."""
+
+    def __init__(self, size: int):
+        self.size = size
+        self.keys = []  # (-count, file_id), ascending
+        self.members = {}  # file_id -> count
+
+    def update(self, file_id, count: int):
+        if file_id in self.members:
+            del self.keys[bisect_left(self.keys, (-self.members.pop(file_id), file_id))]
+        elif len(self.keys) >= self.size and (-count, file_id) >= self.keys[-1]:
+            return
+        insort(self.keys, (-count, file_id))
+        self.members[file_id] = count
+        if len(self.keys) > self.size:
+            del self.members[self.keys.pop()[1]]
+
+    def remove(self, file_id) -> bool:
+        if file_id not in self.members:
+            return False
+        del self.keys[bisect_left(self.keys, (-self.members.pop(file_id), file_id))]
+        return True
+
+    def rebuild(self, counts: dict):
+        self.keys = heapq.nsmallest(self.size, ((-count, file_id) for file_id, count in counts.items() if count > 0))
+        self.members = {file_id: -key for key, file_id in self.keys}
+
+    def top(self, n: int):
+        return [(file_id, -key) for key, file_id in self.keys[:n]]
+
+
+class Leaderboard:
+    def __init__(self, size: int):
+        self.size = size
+        self.buckets = {}  # file_id -> bucket
+        self.counts = {window: {field: Counter() for field in FIELDS} for window in WINDOWS}
+        self.slots = defaultdict(Counter)  # hour -> {(field, file_id): count}
+        self.hour = current_hour()
+        self.window_start = {window: self.hour - timedelta(hours=hours - 1) for window, hours in WINDOWS.items() if hours}
+        self.rankings = {}  # (window, field, bucket or None) -> Ranking
+        self._recorded = None  # Increments seen while load() runs, replayed afterwards
+        self._task = None
+
+    def _ranking(self, window: str, field: str, bucket=None) -> Ranking:
+        key = (window, field, bucket)
+        if key not in self.rankings:
+            self.rankings[key] = Ranking(self.size)
+        return self.rankings[key]
+
+    def _scope_counts(self, window: str, field: str, bucket=None) -> dict:
+        counts = self.counts[window][field]
+        if bucket is None:
+            return counts
+        return {file_id: count for file_id, count in counts.items() if self.buckets.get(file_id) == bucket}
+
+    def _rebuild_rankings(self, window: str):
+        for field in FIELDS:
+            by_bucket = defaultdict(dict)
+            for file_id, count in self.counts[window][field].items():
+                by_bucket[self.buckets.get(file_id)][file_id] = count
+            self._ranking(window, field).rebuild(self.counts[window][field])
+            # Buckets that were ranked before but have nothing left must be emptied too
+            ranked = {key[2] for key in self.rankings if key[:2] == (window, field)}
+            for bucket in (set(by_bucket) | ranked) - {None}:
+                self._ranking(window, field, bucket).rebuild(by_bucket.get(bucket, {}))
+
+    # Move the windows forward to hour, subtracting the slots that fell out of them
+    def _advance(self, hour: datetime):
+        if hour <= self.hour:
+            return
+        self.hour = hour
+        for window, hours in WINDOWS.items():
+            if not hours:
+                continue
+            start = hour - timedelta(hours=hours - 1)
+            expired = [slot for slot_hour, slot in self.slots.items() if self.window_start[window] <= slot_hour < start]
+            self.window_start[window] = start
+            if not expired:
+                continue
+            for slot in expired:
+                for (field, file_id), count in slot.items():
+                    counts = self.counts[window][field]
+                    counts[file_id] -= count
+                    if counts[file_id] <= 0:
+                        del counts[file_id]
+            self._rebuild_rankings(window)
+        oldest = hour - timedelta(hours=HISTORY_HOURS - 1)
+        for slot_hour in [slot_hour for slot_hour in self.slots if slot_hour < oldest]:
+            del self.slots[slot_hour]
+
+    def _add(self, window: str, bucket: str, file_id, field: str, amount: int):
+        counts = self.counts[window][field]
+        counts[file_id] += amount
+        self._ranking(window, field).update(file_id, counts[file_id])
+        self._ranking(window, field, bucket).update(file_id, counts[file_id])
+
+    def record(self, bucket: str, file_id, field: str, amount: int = 1, hour: datetime = None):
+        hour = hour or current_hour()
+        if self._recorded is not None:
+            self._recorded.append((bucket, file_id, field, amount, hour))
+        self._advance(hour)
+        self.buckets[file_id] = bucket
+        self.slots[hour][(field, file_id)] += amount
+        for window, hours in WINDOWS.items():
+            if not hours or hour >= self.window_start[window]:
+                self._add(window, bucket, file_id, field, amount)
+
+    def remove(self, file_id):
+        """Forget a deleted (or replaced) file."""
+        bucket = self.buckets.pop(file_id, None)
+        for slot in self.slots.values():
+            for field in FIELDS:
+                slot.pop((field, file_id), None)
+        for window in WINDOWS:
+            for field in FIELDS:
+                self.counts[window][field].pop(file_id, None)
+                for scope in (None, bucket):
+                    ranking = self.rankings.get((window, field, scope))
+                    # A member left, so whoever was ranked just below the cut moves up
+                    if ranking and ranking.remove(file_id):
+                        ranking.rebuild(self._scope_counts(window, field, scope))
+
+    def top(self, field: str, n: int, bucket: str = None, window: str = "all"):
+        """The top n (file_id, count) pairs for a counter, optionally in one bucket and time window."""
+        self._advance(current_hour())
+        ranking = self.rankings.get((window, field, bucket))
+        return ranking.top(n) if ranking else []
+
+    def total(self, file_id, field: str) -> int:
+        return self.counts["all"][field].get(file_id, 0)
+
+    async def load(self):
+        """Rebuild every ranking from the catalog totals and the hourly counter history."""
+        self._recorded = []
+        try:
+            fresh = Leaderboard(self.size)
+            query = {"$or": [{field: {"$gt": 0}} for field in FIELDS]}
+            async for doc in catalog_reads.find(query, {"bucket": 1, **{field: 1 for field in FIELDS}}):
+                fresh.buckets[doc["_id"]] = doc["bucket"]
+                for field in FIELDS:
+                    if doc.get(field):
+                        fresh.counts["all"][field][doc["_id"]] = doc[field]
+
+            oldest = fresh.hour - timedelta(hours=HISTORY_HOURS - 1)
+            async for doc in counter_history.with_options(read_preference=LISTING_READS).find({"hour": {"$gte": oldest}}):
+                file_id = doc["file_id"]
+                if file_id not in fresh.buckets:
+                    # Only counted in the last week but since deleted (or flushed after this load started)
+                    continue
+                for field in FIELDS:
+                    count = doc.get(field, 0)
+                    if not count:
+                        continue
+                    fresh.slots[doc["hour"]][(field, file_id)] += count
+                    for window, hours in WINDOWS.items():
+                        if hours and doc["hour"] >= fresh.window_start[window]:
+                            fresh.counts[window][field][file_id] += count
+
+            for window in WINDOWS:
+                fresh._rebuild_rankings(window)
+            recorded = self._recorded
+        finally:
+            self._recorded = None
+
+        for name in ("buckets", "counts", "slots", "hour", "window_start", "rankings"):
+            setattr(self, name, getattr(fresh, name))
+        for bucket, file_id, field, amount, hour in recorded:
+            self.record(bucket, file_id, field, amount, hour)
+        logger.info(f"Leaderboard loaded: {len(self.buckets)} counted files")
+
+    async def _run(self, flush):
+        while True:
+            await asyncio.sleep(LEADERBOARD_REFRESH_INTERVAL)
+            try:
+                # Push our own pending increments first so the reload sees them
+                await flush()
+                await self.load()
+            except Exception as e:
+                logger.error(f"Leaderboard refresh failed: {str(e)}")
+
+    def start(self, flush):
+        """Reload every LEADERBOARD_REFRESH_INTERVAL seconds; flush is awaited before each reload."""
+        if LEADERBOARD_REFRESH_INTERVAL > 0 and self._task is None:
+            self._task = asyncio.create_task(self._run(flush))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+leaderboard = Leaderboard(LEADERBOARD_SIZE)
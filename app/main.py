@@ -1,28 +1,75 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException, Query 
-from fastapi.responses import StreamingResponse, JSONResponse 
+from fastapi import FastAPI, UploadFile, File, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse, JSONResponse, Response, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
-from app.db import db, pdf_gridfs, image_gridfs, json_gridfs, word_gridfs, text_gridfs, csv_gridfs, audio_gridfs, video_gridfs, other_gridfs  # Import all buckets
-from app.config import MAX_FILE_SIZE, ALLOWED_TYPES
+from starlette.concurrency import run_in_threadpool
+from app.db import db, connect, close  # The client is created by connect() at startup
+from app.config import MAX_FILE_SIZE, ALLOWED_TYPES, JSON_INDEX_PATHS, EXTRACTION_WORKERS, EXTRACTION_TIMEOUT, DEBUG, PROFILE_INTERVAL, MONGO_WARMUP, ENSURE_INDEXES, LEADERBOARD_SIZE, BATCH_MAX_FILES, BATCH_CONCURRENCY, ZIP_MAX_FILES, PREVIEW_MAX_LIMIT
+from app.extraction import run_extraction
+from app.catalog import BUCKETS, catalog, catalog_reads, ensure_catalog
+from app.search import SEARCH_BUCKETS, ensure_search_indexes, text_search, json_field_search, delete_extracted_content
+from app.preview import UNITS as PREVIEW_UNITS, content_summary, content_total, whole_content, stream_window
+from app.cache import response_cache
+from app.blobcache import blob_cache
+from app.batch import ArchiveError, ArchiveMembers
+from app.zipstream import stream_zip
+from app.derivatives import DERIVATIVE_BUCKETS, content_type_of, ensure_derivative_indexes, get_derivative, parse_variant, schedule_derivatives
+from app.instrumentation import count_round_trips
+from app.metrics import MetricsMiddleware, add_collector, extraction_seconds, render as render_metrics
+from app.counters import counter_buffer
+from app.leaderboard import ensure_leaderboard_indexes, leaderboard
+from app.storage import blobs, ensure_storage_indexes, store_upload, store_revision, finish_revisions, start_releases, delete_stored_file, open_grid_out, blob_id_of, stream_file, read_file
+from app.utils import make_etag, etag_matches, accepts_encoding, parse_range, parse_page_range, stream_gridout, RangeNotSatisfiable, encode_cursor, decode_cursor, datetime_to_ms, ms_to_datetime
 from bson.objectid import ObjectId   
-import io
+from pydantic import BaseModel, Field
 import logging
 import json
-from io import BytesIO
-import PyPDF2 #PDF to text
-from docx import Document  #Word to text
-from motor.motor_asyncio import AsyncIOMotorClient  
-import pandas as pd #CSV to text
-import chardet #Detect encoder
-from typing import Literal
-from datetime import datetime, timedelta
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import asynccontextmanager
+from typing import List, Literal, Optional
+from pymongo import ASCENDING, DESCENDING, UpdateMany, UpdateOne
+from pymongo.errors import BulkWriteError, PyMongoError
+from datetime import timedelta
+import asyncio
+import time
 
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Text extraction runs in a process pool so CPU-bound parsing never holds the server's GIL
+extraction_pool = None
+extraction_tasks = set()  # Keep references so running jobs are not garbage collected
+
+def get_extraction_pool():
+    global extraction_pool
+    if extraction_pool is None:
+        # "spawn" so workers don't inherit the Motor client's threads and sockets
+        extraction_pool = ProcessPoolExecutor(max_workers=EXTRACTION_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return extraction_pool
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await connect(warm_up=MONGO_WARMUP)
+    if ENSURE_INDEXES:
+        # Independent of each other, so their round trips overlap
+        await asyncio.gather(ensure_catalog(), ensure_search_indexes(), ensure_storage_indexes(), ensure_leaderboard_indexes(), ensure_derivative_indexes())
+    await leaderboard.load()
+    counter_buffer.start()
+    leaderboard.start(counter_buffer.flush)
+    # Blobs replaced by updates before a restart
+    start_releases()
+    schedule_requeue()
+    yield
+    await leaderboard.stop()
+    await counter_buffer.stop()
+    if extraction_pool is not None:
+        extraction_pool.shutdown(wait=False, cancel_futures=True)
+    close()
+
 # Initialize FastAPI app
-app = FastAPI(title="My File Upload API")
+app = FastAPI(title="My File Upload API", lifespan=lifespan)
 
 @app.get("/")
 async def root():
@@ -32,8 +79,8 @@ async def root():
 # origins = ["*"]
 origins = ["https://cheerful-froyo-4df5ef.netlify.app"]
 
-#Bucket and Gridfs Dictionary
-bucket_gridfs_dict = {"pdf": pdf_gridfs, "image": image_gridfs, "json": json_gridfs, "word": word_gridfs, "text": text_gridfs, "csv": csv_gridfs, "audio": audio_gridfs, "video": video_gridfs, "other": other_gridfs}
+# GridFS bucket names ("<bucket>.files"/"<bucket>.chunks" collections); storage reads and writes them directly
+bucket_names = set(BUCKETS)
 
 
 app.add_middleware(
@@ -43,43 +90,33 @@ app.add_middleware(
     allow_methods=["GET", "POST", "PUT", "DELETE"],  # Allowed HTTP methods
     allow_headers=["Authorization", "Content-Type"],  # Allowed headers
 )
+# Latency and bytes per route and bucket, for /metrics
+app.add_middleware(MetricsMiddleware, buckets=BUCKETS)
+if DEBUG:
+    from app.profiling import ProfilerMiddleware
+    # ?profile=1 returns the request's sampled stacks instead of its response
+    app.add_middleware(ProfilerMiddleware, interval=PROFILE_INTERVAL)
 
 # Helper function to choose the GridFS bucket based on content_type
 def get_gridfs_bucket(content_type):
     if content_type == "application/pdf":
-        return pdf_gridfs, "pdf", db.pdfContent
+        return "pdf", db.pdfContent
     elif content_type in {"image/jpeg", "image/png", "image/gif", "image/bmp", "image/webp", "image/tiff"}:
-        return image_gridfs, "image", None
+        return "image", None
     elif content_type in {"application/json"}:
-        return json_gridfs, "json", db.jsonContent
+        return "json", db.jsonContent
     elif content_type in {"application/vnd.openxmlformats-officedocument.wordprocessingml.document", "application/msword"}:
-        return word_gridfs, "word", db.wordContent
+        return "word", db.wordContent
     elif content_type in {"text/plain"}:
-        return text_gridfs, "text", db.textContent
+        return "text", db.textContent
     elif content_type in {"text/csv"}:
-        return csv_gridfs, "csv", db.csvContent
+        return "csv", db.csvContent
     elif content_type in {"audio/mpeg", "audio/wav", "audio/x-wav", "audio/ogg", "audio/webm"}:
-        return audio_gridfs, "audio", None
+        return "audio", None
     elif content_type in {"video/mp4", "video/x-msvideo", "video/x-matroska", "video/webm", "video/ogg"}:
-        return video_gridfs, "video", None
+        return "video", None
     else:
-        return other_gridfs, "other", None
-
-# Function to extract text from PDF
-def extract_text_from_pdf(file_bytes):
-    reader = PyPDF2.PdfReader(BytesIO(file_bytes))
-    text = " ".join([page.extract_text() for page in reader.pages if page.extract_text()])
-    return text.strip()
-
-# Extract text from a .docx file.
-def extract_text_from_docx(file_data: bytes) -> str:
-    doc = Document(io.BytesIO(file_data))
-    return "\n".join([para.text for para in doc.paragraphs])
-
-#Detects encoding of a file using chardet.
-def detect_encoding(file_bytes):
-    result = chardet.detect(file_bytes)
-    return result["encoding"]
+        return "other", None
 
 def get_gridfs_files_collection(section_name: str):
     """Returns the GridFS files collection dynamically based on section name."""
@@ -89,16 +126,160 @@ def get_gridfs_files_and_contrnt_collection(section_name: str):
     """Returns the GridFS files collection dynamically based on section name."""
     return db[f"{section_name}.files"], db[f"{section_name}Content"]
 
+# Run the extractor for a stored blob in the process pool and return the content fields
+async def extract_blob(bucket_name: str, blob_id):
+    loop = asyncio.get_running_loop()
+    pool = get_extraction_pool() if EXTRACTION_WORKERS > 0 else None
+    start = time.perf_counter()
+    status = "failed"
+    try:
+        # The worker enforces the timeout itself; wait_for is a backstop in case it can't
+        fields = await asyncio.wait_for(
+            loop.run_in_executor(pool, run_extraction, bucket_name, str(blob_id), EXTRACTION_TIMEOUT),
+            EXTRACTION_TIMEOUT + 5
+        )
+        status = "done"
+        return fields
+    finally:
+        extraction_seconds.observe(time.perf_counter() - start, bucket_name, status)
+
+# Extract a stored blob's content and save it as its <bucket>Content document (keyed by blob_id,
+# so files sharing the blob share the content). Returns the final status ("done" or "failed"),
+# which is recorded on the blob and on every .files document that references it.
+async def run_extraction_job(bucket_name: str, blob_id, filename: str, content_id):
+    files_collection, content_collection = get_gridfs_files_and_contrnt_collection(bucket_name)
+    try:
+        fields = await extract_blob(bucket_name, blob_id)
+    except Exception as e:
+        error = str(e) or type(e).__name__
+        logger.error(f"Extraction failed for blob {blob_id}, Bucket: {bucket_name}: {error}")
+        status = {"extractionStatus": "failed", "extractionError": error}
+        await blobs.update_one({"_id": blob_id}, {"$set": status})
+        await files_collection.update_many({"blob_id": blob_id}, {"$set": status})
+        await finish_revisions(bucket_name, blob_id)
+        return "failed"
+
+    await content_collection.replace_one({"_id": content_id}, {"filename": filename, **fields, "file_id": blob_id}, upsert=True)
+    await blobs.update_one({"_id": blob_id}, {"$set": {"extractionStatus": "done"}, "$unset": {"extractionError": ""}})
+    result = await files_collection.update_many(
+        {"blob_id": blob_id},
+        {"$set": {"content_id": content_id, "extractionStatus": "done"}, "$unset": {"extractionError": ""}}
+    )
+    if result.matched_count == 0:
+        # The file was deleted while we were extracting it
+        await delete_extracted_content(bucket_name, [blob_id])
+    await finish_revisions(bucket_name, blob_id)
+    # New content changes search results
+    await response_cache.invalidate(bucket_name)
+    logger.info(f"Extraction done for blob {blob_id}, Bucket: {bucket_name}")
+    return "done"
+
+# Extract many blobs concurrently (bounded by the pool), then save the results with one
+# insert_many per content collection and one bulk_write per .files collection.
+# A content document that can't be saved marks its blob failed; the others are still recorded.
+# jobs are (bucket_name, blob_id, filename, content_id); returns {blob_id: status}.
+async def run_batch_extraction(jobs: list):
+    results = await asyncio.gather(*(extract_blob(bucket_name, blob_id) for bucket_name, blob_id, filename, content_id in jobs), return_exceptions=True)
+    errors, contents = {}, {}
+    for (bucket_name, blob_id, filename, content_id), fields in zip(jobs, results):
+        if isinstance(fields, BaseException):
+            errors[blob_id] = str(fields) or type(fields).__name__
+            logger.error(f"Extraction failed for blob {blob_id}, Bucket: {bucket_name}: {errors[blob_id]}")
+        else:
+            contents.setdefault(bucket_name, []).append({"_id": content_id, "filename": filename, **fields, "file_id": blob_id})
+
+    for bucket_name, docs in contents.items():
+        try:
+            await db[f"{bucket_name}Content"].insert_many(docs, ordered=False)
+        except BulkWriteError as e:
+            # Unordered: only the documents listed in writeErrors were not inserted
+            failed = {docs[error["index"]]["file_id"]: error.get("errmsg", "Could not save the extracted content") for error in e.details.get("writeErrors", [])}
+        except PyMongoError as e:
+            failed = {doc["file_id"]: str(e) or type(e).__name__ for doc in docs}
+        else:
+            continue
+        logger.error(f"Saving extracted content failed for {len(failed)} blobs, Bucket: {bucket_name}: {next(iter(failed.values()), '')}")
+        errors.update(failed)
+
+    statuses = {}
+    file_ops, blob_ops = {}, []
+    for bucket_name, blob_id, filename, content_id in jobs:
+        if blob_id in errors:
+            update = {"$set": {"extractionStatus": "failed", "extractionError": errors[blob_id]}}
+            statuses[blob_id] = "failed"
+        else:
+            update = {"$set": {"extractionStatus": "done"}, "$unset": {"extractionError": ""}}
+            statuses[blob_id] = "done"
+        blob_ops.append(UpdateOne({"_id": blob_id}, update))
+        if statuses[blob_id] == "done":
+            update = {**update, "$set": {**update["$set"], "content_id": content_id}}
+        file_ops.setdefault(bucket_name, []).append(UpdateMany({"blob_id": blob_id}, update))
+
+    # Status writes are independent of each other: one failing (left pending, re-run at the next start) doesn't stop the rest
+    if blob_ops:
+        try:
+            await blobs.bulk_write(blob_ops, ordered=False)
+        except PyMongoError as e:
+            logger.error(f"Batch extraction: updating blob statuses failed: {str(e)}")
+    for bucket_name, ops in file_ops.items():
+        try:
+            await get_gridfs_files_collection(bucket_name).bulk_write(ops, ordered=False)
+            # Content of files deleted while we were extracting them
+            done = [doc["file_id"] for doc in contents.get(bucket_name, []) if statuses[doc["file_id"]] == "done"]
+            if done:
+                remaining = set(await get_gridfs_files_collection(bucket_name).distinct("blob_id", {"blob_id": {"$in": done}}))
+                orphans = [blob_id for blob_id in done if blob_id not in remaining]
+                if orphans:
+                    await delete_extracted_content(bucket_name, orphans)
+        except PyMongoError as e:
+            logger.error(f"Batch extraction: updating file statuses failed, Bucket: {bucket_name}: {str(e)}")
+        await response_cache.invalidate(bucket_name)
+    logger.info(f"Batch extraction: {list(statuses.values()).count('done')} done, {list(statuses.values()).count('failed')} failed")
+    return statuses
+
+# Run an extraction job in the background and return "pending", or, with EXTRACTION_WORKERS=0,
+# run it before the request returns (useful on serverless hosts) and return its result.
+async def schedule_extraction(job):
+    if EXTRACTION_WORKERS == 0:
+        return await job
+    task = asyncio.create_task(job)
+    extraction_tasks.add(task)
+    task.add_done_callback(extraction_tasks.discard)
+    return "pending"
+
+# Queue content extraction for a stored blob and return its status
+async def queue_extraction(bucket_name: str, blob_id, filename: str, content_id):
+    return await schedule_extraction(run_extraction_job(bucket_name, blob_id, filename, content_id))
+
+# Extraction jobs live in this process only, so the ones still pending when it stopped or crashed
+# are run again at startup (in the background). A job only overwrites its own content document.
+async def requeue_pending_extractions():
+    for bucket_name in SEARCH_BUCKETS:
+        jobs = {}
+        try:
+            async for f in get_gridfs_files_collection(bucket_name).find({"extractionStatus": "pending"}, {"filename": 1, "blob_id": 1, "content_id": 1}):
+                # Files sharing a blob share its extraction
+                jobs.setdefault(blob_id_of(f), (f["filename"], f.get("content_id") or ObjectId()))
+        except Exception as e:
+            logger.error(f"Could not look up pending extractions, Bucket: {bucket_name}: {str(e)}")
+            continue
+        if jobs:
+            logger.info(f"Re-queueing {len(jobs)} pending extractions, Bucket: {bucket_name}")
+            results = await asyncio.gather(*(run_extraction_job(bucket_name, blob_id, filename, content_id) for blob_id, (filename, content_id) in jobs.items()), return_exceptions=True)
+            for error in results:
+                if isinstance(error, Exception):
+                    logger.error(f"Re-queued extraction error, Bucket: {bucket_name}: {str(error)}")
+
+def schedule_requeue():
+    task = asyncio.create_task(requeue_pending_extractions())
+    extraction_tasks.add(task)
+    task.add_done_callback(extraction_tasks.discard)
+
 #View Count
-def countView(bucket: str, file_id: str, inline: bool):
+async def countView(bucket: str, file_id: str, inline: bool):
     # Increment the download count for the file
         if inline == True:
-            db[f"{bucket}.files"].update_one(
-                {"_id": ObjectId(file_id)},
-                {"$inc": {"viewsCount": 1}},
-                upsert=True
-            )
-            logger.info(f"View count for file_id {file_id} incremented.")
+            await counter_buffer.increment(bucket, ObjectId(file_id), "viewsCount")
 
 # Helper function to convert UTC to Bangladesh Time and format it
 def format_bangladesh_time(upload_time):
@@ -118,119 +299,255 @@ async def upload_file(file: UploadFile = File(...)):
         #     logger.error(f"File too large: {file.size} bytes")
         #     raise HTTPException(status_code=400, detail="File too big (max 5MB)")   
         
-        content = await file.read()
-        gridfs_bucket, bucket_name, content_collection = get_gridfs_bucket(file.content_type)
+        bucket_name, content_collection = get_gridfs_bucket(file.content_type)
 
         # Check if a file with the same name already exists in the bucket
-        existing_file = gridfs_bucket.find_one({"filename": file.filename})
+        existing_file = await get_gridfs_files_collection(bucket_name).find_one({"filename": file.filename}, {"_id": 1})
         if existing_file:
             logger.error(f"File already exists: {file.filename}")
             # return {"Message":"File with the same name already exists"}
             raise HTTPException(status_code=400, detail="File with the same name already exists")
             
 
-        file_id = gridfs_bucket.put(content, filename=file.filename, content_type=file.content_type, downloadsCount= 0, viewsCount=0)
-        logger.info(f"Uploaded file: {file.filename}, ID: {file_id}, Bucket: {bucket_name}")
-
-        # Extract Text
-        if bucket_name == "pdf" or bucket_name == "word" or bucket_name == "csv" or bucket_name == "text":
-            #Store pdf content
-            if bucket_name == "pdf":
-                extracted_text = extract_text_from_pdf(content)
-
-            #Store word content
-            if bucket_name == "word":
-                extracted_text = extract_text_from_docx(content)
-
-            #Store txt content
-            if bucket_name == "text":
-                extracted_text = content.decode("utf-8")
-            
-            #Store CSV content
-            if bucket_name == "csv":
-                encoding = detect_encoding(content)
-                df = pd.read_csv(io.BytesIO(content), dtype=str, encoding=encoding, header=None)
-                extracted_text = "\n".join(df.astype(str).apply(lambda x: ", ".join(x), axis=1))
-
-            contentID = content_collection.insert_one({
-                    "filename": file.filename,
-                    "content": extracted_text,
-                    "file_id": file_id
-                }).inserted_id
-            files_collection = get_gridfs_files_collection(bucket_name)
-            files_collection.update_one(
-                    {"_id": ObjectId(file_id)}, # Filter condition
-                    {"$set": {"content_id": ObjectId(contentID)}}  # Correct use of $set
-                )
-            return {"filename": file.filename, "file_id": str(file_id), "content_id": str(contentID), "bucket": bucket_name, "message": "File and Content uploaded!"}
-        
-        elif bucket_name == "json":
-            json_data = json.load(BytesIO(content))
-            extracted_text = content.decode("utf-8")
-            contentID = content_collection.insert_one({
-                "filename": file.filename,
-                "json_object": json_data,
-                "content": extracted_text,
-                "file_id": file_id
-            }).inserted_id
-
-            files_collection = get_gridfs_files_collection(bucket_name)
-            files_collection.update_one(
-                    {"_id": ObjectId(file_id)}, # Filter condition
-                    {"$set": {"content_id": ObjectId(contentID)}}  # Correct use of $set
-                )
-            return {"filename": file.filename, "file_id": str(file_id), "content_id": str(contentID), "bucket": bucket_name, "message": "File and Content uploaded!"}
+        # Content buckets (pdf, word, text, csv, json) get their text extracted in the background.
+        # The content id is reserved now so the client gets it before extraction finishes.
+        fields = {"extractionStatus": "pending", "content_id": ObjectId()} if content_collection is not None else None
+        file_doc, deduplicated = await store_upload(bucket_name, file, fields=fields)
+        file_id = file_doc["_id"]
+        logger.info(f"Uploaded file: {file.filename}, ID: {file_id}, Bucket: {bucket_name}, Size: {file_doc['length']}, Deduplicated: {deduplicated}")
+        await response_cache.invalidate(bucket_name)
+        if not deduplicated:
+            schedule_derivatives(bucket_name, file_doc, lambda: stream_file(bucket_name, file_doc))
+
+        if deduplicated:
+            # Identical content is already stored (and extracted, or being extracted)
+            response = {"filename": file.filename, "file_id": str(file_id), "bucket": bucket_name, "deduplicated": True, "message": "File uploaded, identical content already stored!"}
+            if content_collection is not None:
+                response.update(content_id=str(file_doc["content_id"]), extraction_status=file_doc["extractionStatus"])
+            return response
+
+        if content_collection is not None:
+            contentID = file_doc["content_id"]
+            status = await queue_extraction(bucket_name, file_doc["blob_id"], file.filename, contentID)
+            return {"filename": file.filename, "file_id": str(file_id), "content_id": str(contentID), "bucket": bucket_name, "extraction_status": status, "message": "File uploaded, content extraction queued!"}
         
         else:
             return {"filename": file.filename, "file_id": str(file_id), "bucket": bucket_name, "message": "File uploaded!"}
+    except HTTPException as e:
+        raise e  # Re-raise HTTP exceptions as-is
     except Exception as e:
         logger.error(f"Upload error: {str(e)}")
         raise HTTPException(status_code=500, detail="Internal server error from upload")
 
-# Get all files (list)
-@app.get("/files/")
-async def list_files(sort_by: Literal["upload_time", "filename"] = Query("upload_time"), order: Literal["asc", "desc"] = Query("desc")):
+# One $in query (on the indexed lowercase name) finds which of the names are already taken, as (bucket, filename) pairs
+async def find_taken_names(names: set) -> set:
+    taken = set()
+    if names:
+        async for f in catalog.find({"filename_lower": {"$in": [name.lower() for name in names]}}, {"bucket": 1, "filename": 1}):
+            if f["filename"] in names:
+                taken.add((f["bucket"], f["filename"]))
+    return taken
+
+# Store one file of a batch; results are reported per file instead of failing the request.
+# taken holds the (bucket, filename) pairs already stored or claimed by an earlier file of the batch.
+async def ingest_batch_file(file: UploadFile, taken: set, jobs: list):
+    bucket_name, content_collection = get_gridfs_bucket(file.content_type)
+    result = {"filename": file.filename, "bucket": bucket_name}
     try:
-        
-        # Helper function to process file data
-        def process_file(f, bucket):
-            return {
-                "file_id": str(f._id),
-                "filename": f.filename,
-                "content_type": f.content_type,
-                "bucket": bucket,
-                "upload_time": f.uploadDate,
-                "downloadsCount": getattr(f, 'downloadsCount', 0),
-                "views_Count": getattr(f, 'viewsCount', 0)
-            }
-            
-              # Collect files from all buckets using the helper function
-        pdf_files = [process_file(f, "pdf") for f in pdf_gridfs.find()]
-        image_files = [process_file(f, "image") for f in image_gridfs.find()]
-        json_files = [process_file(f, "json") for f in json_gridfs.find()]       
-        word_files = [process_file(f, "word") for f in word_gridfs.find()]
-        text_files = [process_file(f, "text") for f in text_gridfs.find()]
-        csv_files = [process_file(f, "csv") for f in csv_gridfs.find()]
-        audio_files = [process_file(f, "audio") for f in audio_gridfs.find()]
-        video_files = [process_file(f, "video") for f in video_gridfs.find()]
-        other_files = [process_file(f, "other") for f in other_gridfs.find()]
+        if (bucket_name, file.filename) in taken:
+            return {**result, "status": "error", "error": "File with the same name already exists"}
+        taken.add((bucket_name, file.filename))
 
-        
-        file_list = pdf_files + image_files + json_files + word_files + text_files + csv_files + audio_files + video_files + other_files
+        fields = {"extractionStatus": "pending", "content_id": ObjectId()} if content_collection is not None else None
+        try:
+            file_doc, deduplicated = await store_upload(bucket_name, file, fields=fields)
+        except Exception as e:
+            taken.discard((bucket_name, file.filename))
+            if isinstance(e, HTTPException):
+                return {**result, "status": "error", "error": e.detail}
+            logger.error(f"Batch upload error: {file.filename}: {str(e)}")
+            return {**result, "status": "error", "error": "Internal server error from upload"}
+    finally:
+        await file.close()
+
+    logger.info(f"Uploaded file: {file.filename}, ID: {file_doc['_id']}, Bucket: {bucket_name}, Size: {file_doc['length']}, Deduplicated: {deduplicated}")
+    result.update(status="uploaded", file_id=str(file_doc["_id"]), deduplicated=deduplicated)
+    if not deduplicated:
+        schedule_derivatives(bucket_name, file_doc, lambda: stream_file(bucket_name, file_doc))
+    if content_collection is not None:
+        result.update(content_id=str(file_doc["content_id"]), extraction_status=file_doc["extractionStatus"])
+        if not deduplicated:
+            jobs.append((bucket_name, file_doc["blob_id"], file.filename, file_doc["content_id"]))
+    return result
+
+# Upload many files at once: several "files" parts, or one zip/tar "archive" part
+@app.post("/upload/batch")
+async def upload_batch(files: List[UploadFile] = File(None), archive: Optional[UploadFile] = File(None)):
+    files = list(files or [])
+    if not files and archive is None:
+        raise HTTPException(status_code=400, detail="No files uploaded")
+    if len(files) > BATCH_MAX_FILES:
+        raise HTTPException(status_code=400, detail=f"Too many files (max {BATCH_MAX_FILES})")
+
+    taken = await find_taken_names({file.filename for file in files})
+
+    # A slot is taken before a file is handed over (or an archive member is read) and freed once it is stored,
+    # so at most BATCH_CONCURRENCY uploads are in flight and at most that many members are spooled at a time
+    slots = asyncio.Semaphore(BATCH_CONCURRENCY)
+    jobs = []
+    tasks = []
+    errors = []
+
+    async def ingest(file: UploadFile):
+        try:
+            return await ingest_batch_file(file, taken, jobs)
+        finally:
+            slots.release()
 
-        sort_reverse = order == "desc"
-        if sort_by == "filename":
-            file_list.sort(key=lambda x: x["filename"].lower(), reverse=sort_reverse)
-        else:
-            file_list.sort(key=lambda x: x["upload_time"], reverse=sort_reverse)
-        # file_list.sort(key=lambda x: x[sort_by], reverse= sort_reverse)
+    for file in files:
+        await slots.acquire()
+        tasks.append(asyncio.create_task(ingest(file)))
+
+    truncated = False
+    if archive is not None:
+        members = ArchiveMembers(archive.file, BATCH_MAX_FILES - len(files))
+        try:
+            names = await run_in_threadpool(members.names)
+        except ArchiveError:
+            names = None  # Reported below, when reading the first member fails the same way
+        if names is not None:
+            # A zip lists its members up front: their names are looked up at once, and each is stored as soon as it is read
+            taken |= await find_taken_names(set(names))
+        # Tar members are only known once read: they are looked up one window of BATCH_CONCURRENCY members at a time
+        window_size = 1 if names is not None else BATCH_CONCURRENCY
+        reader = iter(members)
+        window = []
+        done = False
+        while not done:
+            await slots.acquire()
+            try:
+                member = await run_in_threadpool(next, reader, None)
+            except ArchiveError as e:
+                slots.release()
+                logger.error(f"Invalid archive {archive.filename}: {str(e)}")
+                if not tasks and not errors and not window:
+                    raise HTTPException(status_code=400, detail="Archive must be a zip or tar file")
+                # Members read before the damage are stored; the rest of the archive is unreadable
+                errors.append({"filename": archive.filename, "status": "error", "error": "Archive is corrupt, the remaining members were not read"})
+                member, done = None, True
+            if member is None:
+                slots.release()
+                done = True
+            else:
+                filename, upload, error = member
+                if upload is None:
+                    slots.release()
+                    errors.append({"filename": filename, "status": "error", "error": error})
+                else:
+                    window.append(upload)
+            if window and (done or len(window) >= window_size):
+                if names is None:
+                    taken |= await find_taken_names({upload.filename for upload in window})
+                tasks.extend(asyncio.create_task(ingest(upload)) for upload in window)
+                window = []
+        truncated = members.truncated
+    if not tasks and not errors:
+        raise HTTPException(status_code=400, detail="No files uploaded")
+
+    results = list(await asyncio.gather(*tasks)) + errors
+
+    for bucket_name in {result["bucket"] for result in results if result["status"] == "uploaded"}:
+        await response_cache.invalidate(bucket_name)
+    if jobs:
+        statuses = await schedule_extraction(run_batch_extraction(jobs))
+        if statuses != "pending":
+            blob_of = {str(content_id): blob_id for bucket_name, blob_id, filename, content_id in jobs}
+            for result in results:
+                if result.get("content_id") in blob_of:
+                    result["extraction_status"] = statuses[blob_of[result["content_id"]]]
+
+    uploaded = sum(result["status"] == "uploaded" for result in results)
+    logger.info(f"Batch upload: {uploaded} uploaded, {len(results) - uploaded} failed")
+    return {"uploaded": uploaded, "failed": len(results) - uploaded, "truncated": truncated, "results": results}
+
+# Listing fields a client can ask for with ?fields=, mapped to the catalog fields they read
+LIST_FIELDS = {
+    "file_id": "_id",
+    "filename": "filename",
+    "content_type": "content_type",
+    "bucket": "bucket",
+    "upload_time": "uploadDate",
+    "downloadsCount": "downloadsCount",
+    "views_Count": "viewsCount",
+}
+
+def listing_item(f: dict, fields) -> dict:
+    item = {}
+    for name in fields:
+        value = f.get(LIST_FIELDS[name])
+        if name == "file_id":
+            value = str(value)
+        elif name == "upload_time":
+            value = format_bangladesh_time(value)
+        elif name in ("downloadsCount", "views_Count"):
+            value = value or 0
+        item[name] = value
+    return item
+
+# One page of the catalog using keyset pagination on (sort field, _id).
+# Sort, limit and projection all run on the server; the cursor encodes where the last page stopped.
+async def catalog_files(query: dict, sort_by: str, order: str, limit: Optional[int], after: Optional[str], fields: Optional[str]):
+    direction = DESCENDING if order == "desc" else ASCENDING
+    sort_field = "filename_lower" if sort_by == "filename" else "uploadDate"
+
+    wanted = list(LIST_FIELDS) if not fields else ["file_id"] + [name for name in dict.fromkeys(fields.split(",")) if name != "file_id"]
+    unknown = [name for name in wanted if name not in LIST_FIELDS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    projection = {LIST_FIELDS[name]: 1 for name in wanted}
+    projection[sort_field] = 1  # Needed to build the next cursor
+
+    if after:
+        try:
+            cursor_sort, cursor_order, last_value, last_id = decode_cursor(after)
+            if (cursor_sort, cursor_order) != (sort_by, order):
+                raise ValueError("Cursor was made for a different sort")
+            if sort_field == "uploadDate":
+                last_value = ms_to_datetime(last_value)
+            last_id = ObjectId(last_id)
+        except Exception:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        op = "$lt" if direction == DESCENDING else "$gt"
+        query = {"$and": [query, {"$or": [
+            {sort_field: {op: last_value}},
+            {sort_field: last_value, "_id": {op: last_id}}
+        ]}]}
+
+    cursor = catalog_reads.find(query, projection).sort([(sort_field, direction), ("_id", direction)])
+    if limit:
+        cursor = cursor.limit(limit + 1)  # One extra row tells us whether there is a next page
+    docs = await cursor.to_list(length=None)
+
+    next_cursor = None
+    if limit and len(docs) > limit:
+        docs = docs[:limit]
+        last = docs[-1]
+        last_value = datetime_to_ms(last[sort_field]) if sort_field == "uploadDate" else last[sort_field]
+        next_cursor = encode_cursor(sort_by, order, last_value, str(last["_id"]))
+    return [listing_item(f, wanted) for f in docs], next_cursor
 
-        # Format the upload_time to Bangladesh time for each file
-        for file in file_list:
-            file["upload_time"] = format_bangladesh_time(file["upload_time"])
-                        
+# Get all files (list)
+@app.get("/files/")
+async def list_files(request: Request, sort_by: Literal["upload_time", "filename"] = Query("upload_time"), order: Literal["asc", "desc"] = Query("desc"), limit: Optional[int] = Query(None, ge=1, le=1000), after: Optional[str] = Query(None), fields: Optional[str] = Query(None)):
+    async def compute():
+        file_list, next_cursor = await catalog_files({}, sort_by, order, limit, after, fields)
         logger.info(f"Listed {len(file_list)} files")
-        return {"files": file_list}
+        return {"files": file_list, "next_cursor": next_cursor}
+
+    try:
+        return await response_cache.respond(request, BUCKETS, compute)
+    except HTTPException as e:
+        raise e  # Re-raise HTTP exceptions as-is
     except Exception as e:
         logger.error(f"List files error: {str(e)}")
         raise HTTPException(status_code=500, detail="Internal server error")
@@ -238,160 +555,239 @@ async def list_files(sort_by: Literal["upload_time", "filename"] = Query("upload
 
 # Get file for specific file type
 @app.get("/file/{bucket}")
-async def get_files_in_type(bucket: str, sort_by: Literal["upload_time", "filename"] = Query("upload_time"), order: Literal["asc", "desc"] = Query("desc")):
-    try:
-        gridfs_bucket = bucket_gridfs_dict[bucket]
-        # sort_direction = 1 if order == "asc" else -1
-        files = [{"file_id": str(f._id), "filename": f.filename, "content_type": f.content_type, "bucket": bucket, "upload_time": f.uploadDate} for f in gridfs_bucket.find()]
-        # file_data = gridfs_bucket.get(ObjectId(file_id))
-
-        sort_reverse = order == "desc"
-        if sort_by == "filename":
-            files.sort(key=lambda x: x["filename"].lower(), reverse=sort_reverse)
-        else:
-            files.sort(key=lambda x: x["upload_time"], reverse=sort_reverse)
-
+async def get_files_in_type(request: Request, bucket: str, sort_by: Literal["upload_time", "filename"] = Query("upload_time"), order: Literal["asc", "desc"] = Query("desc"), limit: Optional[int] = Query(None, ge=1, le=1000), after: Optional[str] = Query(None), fields: Optional[str] = Query(None)):
+    async def compute():
+        files, next_cursor = await catalog_files({"bucket": bucket}, sort_by, order, limit, after, fields)
         logger.info(f"Listed {len(files)} files")
-        return {"files": files}
+        return {"files": files, "next_cursor": next_cursor}
+
+    try:
+        if bucket not in bucket_names:
+            raise KeyError(bucket)
+        return await response_cache.respond(request, [bucket], compute)
+    except HTTPException as e:
+        raise e  # Re-raise HTTP exceptions as-is
     except Exception as e:
         logger.error(f"List files error: {str(e)}")
         raise HTTPException(status_code=500, detail="Internal server error")
 
 
-# Endpoint to search word
+# Endpoint to search word (text index lookup, ranked by relevance and paginated)
 @app.get("/search/")
-async def search_pdf_by_word(word: str):
-    resultsPDF = db.pdfContent.find({"content": {"$regex": word, "$options": "i"}})
-    resultsWord = db.wordContent.find({"content": {"$regex": word, "$options": "i"}})
-    resultsTxt = db.textContent.find({"content": {"$regex": word, "$options": "i"}})
-    resultsJSON = db.jsonContent.find({"content": {"$regex": word, "$options": "i"}})
-    resultsCSV = db.csvContent.find({"content": {"$regex": word, "$options": "i"}})
-    
-    # matched_file_PDF = [{"filename": doc["filename"], "pdf_id": str(doc["file_id"])} for doc in resultsPDF]
-    # matched_file_Word = [{"filename": doc["filename"], "word_id": str(doc["file_id"])} for doc in resultsWord]
-    # matched_file_Txt = [{"filename": doc["filename"], "text_id": str(doc["file_id"])} for doc in resultsTxt]
-    # matched_file_JSON = [{"filename": doc["filename"], "json_id": str(doc["file_id"])} for doc in resultsJSON]
-    # matched_file_CSV = [{"filename": doc["filename"], "csv_id": str(doc["file_id"])} for doc in resultsCSV]
-    
-    # matched_files = matched_file_PDF + matched_file_Word + matched_file_Txt + matched_file_JSON + matched_file_CSV
-    
-    # if not matched_files:
-    #     # matched_files = []
-    #     raise HTTPException(status_code=404, detail="No matching PDFs found")
-    
-    # return {"matched_pdfs": matched_files}
-
-    matched_files = []
-
-    def get_file_metadata(file_id, fs_bucket, bucket_name):
-        try:
-            file_obj = fs_bucket.get(ObjectId(file_id))
-            return {
-                "file_id": str(file_id),
-                "filename": file_obj.filename,
-                "content_type": file_obj.content_type,
-                "bucket": bucket_name,
-                "upload_time": file_obj.uploadDate,
-                "downloadsCount": getattr(file_obj, 'downloadsCount', 0),
-                "views_Count": getattr(file_obj, 'viewsCount', 0)
+async def search_pdf_by_word(request: Request, word: str, limit: int = Query(20, ge=1, le=100), offset: int = Query(0, ge=0)):
+    stats = {}
+
+    async def compute():
+        with count_round_trips() as round_trips:
+            hits, has_more = await text_search(word, limit, offset)
+
+            # Resolve the metadata of every hit with one $in query on the catalog instead of one lookup per hit.
+            # Content is keyed by blob, so a hit expands to every file sharing that blob.
+            entries = {}
+            if hits:
+                blob_ids = [blob_id for score, bucket_name, blob_id, page_no in hits]
+                async for f in catalog_reads.find({"blob_id": {"$in": blob_ids}}):
+                    entries.setdefault(f["blob_id"], []).append(f)
+        stats.update(round_trips)
+
+        matched_files = []
+        for score, bucket_name, blob_id, page_no in hits:
+            # No entries: content left behind by a file that no longer exists
+            for f in entries.get(blob_id, []):
+                match = {
+                    "file_id": str(f["_id"]),
+                    "filename": f["filename"],
+                    "content_type": f.get("content_type"),
+                    "bucket": bucket_name,
+                    "upload_time": format_bangladesh_time(f["uploadDate"]),
+                    "downloadsCount": f.get("downloadsCount", 0),
+                    "views_Count": f.get("viewsCount", 0),
+                    "score": round(score, 4)
+                }
+                if page_no is not None:
+                    match["page"] = page_no
+                matched_files.append(match)
+
+        logger.info(f"Search '{word}': {len(matched_files)} results, {stats['round_trips']} Mongo round trips")
+        if not matched_files and offset == 0:
+            raise HTTPException(status_code=404, detail="No matching files found", headers={"X-Mongo-Round-Trips": str(stats["round_trips"])})
+        return {"matched_files": matched_files, "next_offset": offset + limit if has_more else None}
+
+    response = await response_cache.respond(request, SEARCH_BUCKETS, compute)
+    # Served from the cache: no round trips at all
+    response.headers["X-Mongo-Round-Trips"] = str(stats.get("round_trips", 0))
+    return response
+
+# Values a JSON query value may be stored as: the string itself, and the number/true/false/null it spells
+def json_query_values(value: str) -> list:
+    values = [value]
+    try:
+        parsed = json.loads(value)
+    except ValueError:
+        return values
+    if parsed is None or isinstance(parsed, (bool, int, float)):
+        values.append(parsed)
+    return values
+
+# Find JSON files by the value at a key path (one of JSON_INDEX_PATHS, looked up in the json_values index)
+@app.get("/json/search")
+async def search_json_field(request: Request, path: str, value: str, limit: int = Query(20, ge=1, le=100), offset: int = Query(0, ge=0)):
+    if path not in JSON_INDEX_PATHS:
+        raise HTTPException(status_code=400, detail=f"Path is not indexed (indexed: {', '.join(JSON_INDEX_PATHS) or 'none, see JSON_INDEX_PATHS'})")
+
+    async def compute():
+        blob_ids, has_more = await json_field_search(path, json_query_values(value), limit, offset)
+        entries = {}
+        if blob_ids:
+            async for f in catalog_reads.find({"blob_id": {"$in": blob_ids}}):
+                entries.setdefault(f["blob_id"], []).append(f)
+        matched_files = [
+            {
+                "file_id": str(f["_id"]),
+                "filename": f["filename"],
+                "bucket": "json",
+                "upload_time": format_bangladesh_time(f["uploadDate"]),
+                "downloadsCount": f.get("downloadsCount", 0),
+                "views_Count": f.get("viewsCount", 0),
             }
-        except Exception:
-            return None
-
-    for doc in resultsPDF:
-        file_meta = get_file_metadata(doc["file_id"], pdf_gridfs, "pdf")
-        if file_meta:
-            matched_files.append(file_meta)
-
-    for doc in resultsWord:
-        file_meta = get_file_metadata(doc["file_id"], word_gridfs, "word")
-        if file_meta:
-            matched_files.append(file_meta)
-
-    for doc in resultsTxt:
-        file_meta = get_file_metadata(doc["file_id"], text_gridfs, "text")
-        if file_meta:
-            matched_files.append(file_meta)
-
-    for doc in resultsJSON:
-        file_meta = get_file_metadata(doc["file_id"], json_gridfs, "json")
-        if file_meta:
-            matched_files.append(file_meta)
-
-    for doc in resultsCSV:
-        file_meta = get_file_metadata(doc["file_id"], csv_gridfs, "csv")
-        if file_meta:
-            matched_files.append(file_meta)
-
-    if not matched_files:
-        raise HTTPException(status_code=404, detail="No matching files found")
+            for blob_id in blob_ids for f in entries.get(blob_id, [])
+        ]
+        logger.info(f"JSON search {path}={value}: {len(matched_files)} results")
+        return {"matched_files": matched_files, "next_offset": offset + limit if has_more else None}
 
-    # Format the upload_time to Bangladesh time for each file
-    for file in matched_files:
-            file["upload_time"] = format_bangladesh_time(file["upload_time"])
-    return {"matched_files": matched_files}
+    return await response_cache.respond(request, ["json"], compute)
 
 # Get a file (download/stream or view inline)
 @app.get("/file/{file_id}/{bucket}")
-async def get_file(file_id: str, bucket: str, inline: bool = False):
+async def get_file(
+    request: Request,
+    file_id: str,
+    bucket: str,
+    inline: bool = False,
+    pages: Optional[str] = Query(None, description='PDF page range for inline views, e.g. "3" or "2-5"'),
+    offset: int = Query(0, ge=0, description="First line/row/page (from 0) of an inline preview window"),
+    limit: Optional[int] = Query(None, ge=1, le=PREVIEW_MAX_LIMIT, description="Lines/rows/pages in an inline preview window"),
+    summary: bool = Query(False, description="Inline preview of counts and first lines only"),
+    variant: Optional[str] = Query(None, description='Thumbnail of an image or video instead of the original, e.g. "thumb" or "medium.jpeg"'),
+):
     try:
-        logger.info(f"Request received - File ID: {file_id}, Bucket: {bucket}, Inline: {inline}")
-        gridfs_bucket = bucket_gridfs_dict[bucket]
-        file_data = gridfs_bucket.get(ObjectId(file_id))
-        logger.info(f"Streaming file: {file_data.filename}, ID: {file_id}, Bucket: {bucket}")
-
-
-        # If inline=True and bucket is "word", return extracted text
-        if inline and bucket == "word":
-            logger.info(f"Attempting to fetch word content for file_id: {file_id}")
-            content_doc = db.wordContent.find_one({"file_id": ObjectId(file_id)})
-            if not content_doc:
-                logger.error(f"No word content found for file_id: {file_id}")
-                raise HTTPException(status_code=404, detail="Word content not found")
-            logger.info(f"Word content retrieved: {content_doc['filename']}")
-            countView(bucket=bucket, file_id=file_id, inline=inline)
-            return {"filename": content_doc["filename"], "content": content_doc["content"]}
-        
-        if inline and bucket == "pdf":
-            logger.info(f"Attempting to fetch pdf content for file_id: {file_id}")
-            content_doc = db.pdfContent.find_one({"file_id": ObjectId(file_id)})
+        # Per-request logs are debug-only (formatted only when enabled); /metrics has the request counts and timings
+        logger.debug("Request received - File ID: %s, Bucket: %s, Inline: %s", file_id, bucket, inline)
+        if bucket not in bucket_names:
+            raise HTTPException(status_code=404, detail="Bucket not found")
+        file_doc = await get_gridfs_files_collection(bucket).find_one({"_id": ObjectId(file_id)})
+        if not file_doc:
+            raise HTTPException(status_code=404, detail="File not found")
+        logger.debug("Streaming file: %s, ID: %s, Bucket: %s", file_doc["filename"], file_id, bucket)
+
+        # A thumbnail / poster frame, generated on first request and stored for the next ones
+        if variant:
+            if bucket not in DERIVATIVE_BUCKETS:
+                raise HTTPException(status_code=400, detail="Variants are only available for image and video files")
+            variant, negotiated = parse_variant(variant, request.headers.get("accept", ""))
+            headers = {"ETag": f'{make_etag(file_doc)[:-1]}-{variant}"', "Content-Disposition": f"inline; filename={variant}"}
+            if negotiated:
+                headers["Vary"] = "Accept"
+            if etag_matches(request.headers.get("if-none-match"), headers["ETag"]):
+                return Response(status_code=304, headers=headers)
+            data = await get_derivative(bucket, file_doc, variant, lambda: stream_file(bucket, file_doc))
+            return Response(data, media_type=content_type_of(variant), headers=headers)
+
+        # Inline word/pdf/csv views return extracted text: all of it, a window of it, or a summary
+        if inline and bucket in PREVIEW_UNITS:
+            logger.debug("Attempting to fetch %s content for file_id: %s", bucket, file_id)
+            content_doc = await db[f"{bucket}Content"].find_one({"file_id": blob_id_of(file_doc)})
+            if not content_doc and file_doc.get("previousBlobId"):
+                # Updated and not re-extracted yet: the previous revision's text until the new one is ready
+                content_doc = await db[f"{bucket}Content"].find_one({"file_id": file_doc["previousBlobId"]})
+            if not content_doc and file_doc.get("extractionStatus") == "pending":
+                return JSONResponse({"extraction_status": "pending", "message": "Content extraction is still running"}, status_code=202)
             if not content_doc:
-                logger.error(f"No Pdf content found for file_id: {file_id}")
-                raise HTTPException(status_code=404, detail="Word content not found")
-            logger.info(f"Pdf content retrieved: {content_doc['filename']}")
-            countView(bucket=bucket, file_id=file_id, inline=inline)
-            return {"filename": content_doc["filename"], "content": content_doc["content"]}
-        
-        if inline and bucket == "csv":
-            logger.info(f"Attempting to fetch word content for file_id: {file_id}")
-            content_doc = db.csvContent.find_one({"file_id": ObjectId(file_id)})
-            if not content_doc:
-                logger.error(f"No CSV content found for file_id: {file_id}")
-                raise HTTPException(status_code=404, detail="Word content not found")
-            logger.info(f"CSV content retrieved: {content_doc['filename']}")
-            countView(bucket=bucket, file_id=file_id, inline=inline)
-            return {"filename": content_doc["filename"], "content": content_doc["content"]}
-        
-        
-        countView(bucket=bucket, file_id=file_id, inline=inline)
+                logger.error(f"No {bucket} content found for file_id: {file_id}")
+                raise HTTPException(status_code=404, detail="Content not found")
+            logger.debug("%s content retrieved: %s", bucket, content_doc["filename"])
+            if bucket == "pdf" and pages:
+                try:
+                    first, last = parse_page_range(pages, content_total(bucket, content_doc) or 0)
+                except ValueError:
+                    raise HTTPException(status_code=400, detail="Invalid page range")
+                offset, limit = first - 1, last - first + 1
+            await countView(bucket=bucket, file_id=file_id, inline=inline)
+            if summary:
+                return content_summary(bucket, content_doc)
+            if limit is not None:
+                return StreamingResponse(stream_window(bucket, content_doc, offset, limit), media_type="application/json")
+            return await whole_content(bucket, content_doc)
+
+        # A compressed file goes out as stored when the client accepts its codec (ranges are served decoded)
+        codec = file_doc.get("codec")
+        encoded = bool(codec) and not request.headers.get("range") and accepts_encoding(request.headers.get("accept-encoding"), codec)
+
+        # Conditional request: the client already has this version (each encoding has its own ETag)
+        etag = make_etag(file_doc)
+        if encoded:
+            etag = f'{etag[:-1]}-{codec}"'
+        vary = {"Vary": "Accept-Encoding"} if codec else {}
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            return Response(status_code=304, headers={"ETag": etag, "Accept-Ranges": "bytes", **vary})
+
+        # Honor Range only when If-Range (if sent) still matches the current version
+        length = file_doc["length"]
+        range_header = request.headers.get("range")
+        if_range = request.headers.get("if-range")
+        if if_range and if_range.strip() != etag:
+            range_header = None
+        try:
+            byte_range = parse_range(range_header, length)
+        except RangeNotSatisfiable:
+            raise HTTPException(status_code=416, detail="Requested range not satisfiable", headers={"Content-Range": f"bytes */{length}"})
+        start, end = byte_range if byte_range else (0, length - 1)
+
+        # Only the request that starts the file counts, not every seek of a media player
+        if start == 0:
+            await countView(bucket=bucket, file_id=file_id, inline=inline)
         # Increment the download count for the file
-        if inline == False:
-            db[f"{bucket}.files"].update_one(
-                {"_id": ObjectId(file_id)},
-                {"$inc": {"downloadsCount": 1}},
-                upsert=True
-            )
-            logger.info(f"Download count for file_id {file_id} incremented.")
+        if inline == False and start == 0:
+            await counter_buffer.increment(bucket, ObjectId(file_id), "downloadsCount")
 
 
         # Otherwise, stream the raw file
         disposition = "inline" if inline else "attachment"
-        logger.info(f"Streaming raw file with disposition: {disposition}")
+        logger.debug("Streaming raw file with disposition: %s", disposition)
+
+        headers = {
+            "Content-Disposition": f"{disposition}; filename={file_doc['filename']}",
+            "Content-Length": str(end - start + 1),
+            "Accept-Ranges": "bytes",
+            "ETag": etag,
+            **vary,
+        }
+        status_code = 200
+        if byte_range:
+            status_code = 206
+            headers["Content-Range"] = f"bytes {start}-{end}/{length}"
+
+        if encoded:
+            # Pass the compressed chunks through untouched
+            headers.update({"Content-Encoding": codec, "Content-Length": str(file_doc["storedLength"])})
+            return StreamingResponse(
+                stream_gridout(open_grid_out(bucket, file_doc)),
+                media_type=file_doc.get("contentType"),
+                headers=headers
+            )
+
+        # Small hot files are served from memory; a memoryview slice serves a range without copying
+        if blob_cache.accepts(bucket, length):
+            data, hit = await blob_cache.get(bucket, blob_id_of(file_doc), lambda: read_file(bucket, file_doc))
+            headers["X-Cache"] = "HIT" if hit else "MISS"
+            return Response(memoryview(data)[start:end + 1], status_code=status_code, media_type=file_doc.get("contentType"), headers=headers)
 
+        # Stream straight from the (possibly shared, possibly compressed) GridFS chunks, one chunk in memory at a time
         return StreamingResponse(
-            io.BytesIO(file_data.read()),
-            media_type=file_data.content_type,
-            headers={"Content-Disposition": f"{disposition}; filename={file_data.filename}"}
+            stream_file(bucket, file_doc, start, end),
+            status_code=status_code,
+            media_type=file_doc.get("contentType"),
+            headers=headers
         )
     except HTTPException as e:
         raise e  # Re-raise HTTP exceptions as-is
@@ -400,33 +796,178 @@ async def get_file(file_id: str, bucket: str, inline: bool = False):
         raise HTTPException(status_code=404, detail="File not found")
 
 
-# Top Dowloaded File Show 
-collections = ["pdf", "image", "json", "word", "text", "csv", "audio", "video", "other"]
+# Top files by a counter, read from the in-memory leaderboard (one catalog $in query for the names)
+async def ranked_files(field: str, numbers: int, bucket: Optional[str], window: str):
+    if bucket is not None and bucket not in bucket_names:
+        raise HTTPException(status_code=404, detail="Bucket not found")
+    ranked = leaderboard.top(field, numbers, bucket, window)
+    entries = {}
+    if ranked:
+        async for f in catalog_reads.find({"_id": {"$in": [file_id for file_id, count in ranked]}}):
+            entries[f["_id"]] = f
+
+    files = []
+    for file_id, count in ranked:
+        f = entries.get(file_id)
+        if not f:
+            continue  # Deleted since it was counted
+        item = {
+            "file_id": str(file_id),
+            "filename": f["filename"],
+            # The leaderboard includes increments that have not been flushed to the catalog yet
+            "downloadsCount": max(leaderboard.total(file_id, "downloadsCount"), f.get("downloadsCount", 0)),
+            "upload_time": format_bangladesh_time(f["uploadDate"]),
+            "collection": f["bucket"],
+            "views_Count": max(leaderboard.total(file_id, "viewsCount"), f.get("viewsCount", 0)),
+            "bucket": f.get("content_type")
+        }
+        if window != "all":
+            item["downloads_in_window" if field == "downloadsCount" else "views_in_window"] = count
+        files.append(item)
+    return files
+
+# Top Dowloaded File Show
 @app.get("/top-downloads/")
-async def top_download_files(numbers: int = Query(5)):
-    all_files = []
-
-    for collection_name in collections:
-        collection = db[f"{collection_name}.files"]
-        cursor = collection.find().sort("downloadsCount", -1).limit(10)
-
-        for file in cursor:
-            all_files.append({
-                "file_id": str(file["_id"]),
-                "filename": file.get("filename"),
-                "downloadsCount": file.get("downloadsCount", 0),
-                "upload_time": file.get("uploadDate"),
-                "collection": collection_name,
-                "views_Count": file.get("viewsCount"),
-                "bucket":file.get("contentType")
-            })
-    # Sort all files combined
-    sorted_files = sorted(all_files, key=lambda x: x["downloadsCount"], reverse=True)
-    # Format the upload_time to Bangladesh time for each file
-    for file in sorted_files:
-            file["upload_time"] = format_bangladesh_time(file["upload_time"])
-    # Return top 5 overall
-    return {"top_downloaded_files": sorted_files[:numbers]}
+async def top_download_files(request: Request, numbers: int = Query(5, ge=1, le=LEADERBOARD_SIZE), bucket: Optional[str] = Query(None), window: Literal["all", "24h", "7d"] = Query("all")):
+    async def compute():
+        return {"top_downloaded_files": await ranked_files("downloadsCount", numbers, bucket, window)}
+    return await response_cache.respond(request, [bucket] if bucket else BUCKETS, compute)
+
+# Top viewed files, same options as /top-downloads/
+@app.get("/top-viewed/")
+async def top_viewed_files(request: Request, numbers: int = Query(5, ge=1, le=LEADERBOARD_SIZE), bucket: Optional[str] = Query(None), window: Literal["all", "24h", "7d"] = Query("all")):
+    async def compute():
+        return {"top_viewed_files": await ranked_files("viewsCount", numbers, bucket, window)}
+    return await response_cache.respond(request, [bucket] if bucket else BUCKETS, compute)
+
+# Response and blob cache hit/miss/eviction counters, for monitoring
+@app.get("/cache/stats")
+async def cache_stats():
+    return {"responses": response_cache.stats(), "blobs": blob_cache.stats()}
+
+# Cache and background work figures, read when /metrics is scraped
+def runtime_metrics():
+    responses, blob_stats = response_cache.stats(), blob_cache.stats()
+    return [
+        ("response_cache_lookups_total", "counter", "Response cache lookups", [({"result": "hit"}, responses["hits"]), ({"result": "miss"}, responses["misses"])]),
+        ("blob_cache_lookups_total", "counter", "Blob cache lookups", [({"result": "hit"}, blob_stats["hits"]), ({"result": "miss"}, blob_stats["misses"])]),
+        ("blob_cache_bytes", "gauge", "Bytes held in the blob cache", [({}, blob_stats["bytes"])]),
+        ("extraction_jobs_in_progress", "gauge", "Extraction jobs queued or running", [({}, len(extraction_tasks))]),
+        ("counter_buffer_pending", "gauge", "Files with view/download increments not yet flushed", [({}, len(counter_buffer.pending))]),
+    ]
+
+add_collector(runtime_metrics)
+
+# Prometheus scrape endpoint: request latency/bytes per route and bucket, extraction time, MongoDB commands
+@app.get("/metrics")
+async def metrics():
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+class FileRef(BaseModel):
+    file_id: str
+    bucket: str
+
+class ZipRequest(BaseModel):
+    files: List[FileRef] = []  # Explicit files, or else:
+    search: Optional[str] = None  # every file matching a search,
+    bucket: Optional[str] = None  # or the newest files of a bucket (all buckets if omitted)
+    limit: int = Field(100, ge=1, le=ZIP_MAX_FILES)
+
+# Catalog entries of the files a ZipRequest asks for, in request / relevance / newest-first order
+async def zip_request_entries(body: ZipRequest):
+    if body.files:
+        if len(body.files) > ZIP_MAX_FILES:
+            raise HTTPException(status_code=400, detail=f"Too many files (max {ZIP_MAX_FILES})")
+        try:
+            wanted = [(ObjectId(ref.file_id), ref.bucket) for ref in body.files]
+        except Exception:
+            raise HTTPException(status_code=404, detail="File not found")
+        found = {f["_id"]: f async for f in catalog.find({"_id": {"$in": [file_id for file_id, bucket in wanted]}})}
+        missing = [str(file_id) for file_id, bucket in wanted if file_id not in found or found[file_id]["bucket"] != bucket]
+        if missing:
+            raise HTTPException(status_code=404, detail=f"Files not found: {', '.join(missing)}")
+        return [found[file_id] for file_id in dict.fromkeys(file_id for file_id, bucket in wanted)]
+
+    if body.search:
+        hits, has_more = await text_search(body.search, body.limit)
+        by_blob = {}
+        async for f in catalog.find({"blob_id": {"$in": [blob_id for score, bucket_name, blob_id, page_no in hits]}}):
+            by_blob.setdefault(f["blob_id"], []).append(f)
+        # Several pages of one PDF can match; the file goes in once
+        matched = {f["_id"]: f for score, bucket_name, blob_id, page_no in hits for f in by_blob.get(blob_id, [])}
+        return list(matched.values())[:body.limit]
+
+    if body.bucket is not None and body.bucket not in bucket_names:
+        raise HTTPException(status_code=404, detail="Bucket not found")
+    query = {"bucket": body.bucket} if body.bucket else {}
+    return await catalog.find(query).sort([("uploadDate", DESCENDING), ("_id", DESCENDING)]).limit(body.limit).to_list(length=None)
+
+# Download several files as one ZIP archive, streamed from GridFS as it is built
+@app.post("/download/zip")
+async def download_zip(body: ZipRequest):
+    entries = await zip_request_entries(body)
+    if not entries:
+        raise HTTPException(status_code=404, detail="No matching files found")
+
+    # The .files documents (chunk size, blob) of every entry, one $in query per bucket
+    file_docs = {}
+    by_bucket = {}
+    for f in entries:
+        by_bucket.setdefault(f["bucket"], []).append(f["_id"])
+    for bucket_name, ids in by_bucket.items():
+        async for file_doc in get_gridfs_files_collection(bucket_name).find({"_id": {"$in": ids}}):
+            file_docs[file_doc["_id"]] = file_doc
+
+    members = []
+    names = set()
+    for f in entries:
+        file_doc = file_docs.get(f["_id"])
+        if file_doc is None:
+            continue  # Deleted since the catalog was read
+        # One folder per bucket; a repeated name gets a numbered suffix
+        arcname = f"{f['bucket']}/{file_doc['filename']}"
+        stem, dot, ext = arcname.rpartition(".") if "." in file_doc["filename"] else (arcname, "", "")
+        n = 1
+        while arcname in names:
+            n += 1
+            arcname = f"{stem} ({n}){dot}{ext}"
+        names.add(arcname)
+        members.append((arcname, f["bucket"], file_doc))
+
+    async def count_downloads():
+        await counter_buffer.increment_many([(bucket_name, file_doc["_id"]) for arcname, bucket_name, file_doc in members], "downloadsCount")
+
+    logger.info(f"Streaming ZIP of {len(members)} files")
+    return StreamingResponse(
+        stream_zip(members, on_complete=count_downloads),
+        media_type="application/zip",
+        headers={"Content-Disposition": "attachment; filename=files.zip"}
+    )
+
+# Content extraction status of a file
+@app.get("/file/{file_id}/{bucket}/status")
+async def get_extraction_status(file_id: str, bucket: str):
+    if bucket not in bucket_names:
+        raise HTTPException(status_code=404, detail="Bucket not found")
+    try:
+        file_object_id = ObjectId(file_id)
+    except Exception:
+        raise HTTPException(status_code=404, detail="File not found")
+    file_doc = await get_gridfs_files_collection(bucket).find_one(
+        {"_id": file_object_id}, {"extractionStatus": 1, "extractionError": 1, "content_id": 1}
+    )
+    if not file_doc:
+        raise HTTPException(status_code=404, detail="File not found")
+    # Files stored before background extraction existed have a content_id but no status
+    status = file_doc.get("extractionStatus") or ("done" if file_doc.get("content_id") else None)
+    content_id = file_doc.get("content_id")
+    return {
+        "file_id": file_id,
+        "bucket": bucket,
+        "extraction_status": status,
+        "content_id": str(content_id) if content_id and status == "done" else None,
+        "error": file_doc.get("extractionError")
+    }
 
 # Update a file
 @app.put("/file/{file_id}/{bucket}")
@@ -440,96 +981,41 @@ async def update_file(file_id: str, bucket: str, file: UploadFile = File(...)):
             raise HTTPException(status_code=400, detail="File too big (max 5MB)")
         
         
-        gridfs_bucket1, bucket_name, content_collection = get_gridfs_bucket(file.content_type)
+        bucket_name, content_collection = get_gridfs_bucket(file.content_type)
 
-        gridfs_bucket = bucket_gridfs_dict[bucket]
         if bucket_name == bucket:
             file_object_id = ObjectId(file_id)
-            if bucket == "pdf" or bucket == "word" or  bucket == "json" or bucket == "csv" or bucket == "text":
-                files_collection, content_collection = get_gridfs_files_and_contrnt_collection(bucket)
-                file_data = files_collection.find_one({"_id": file_object_id})
-                if not file_data:
-                    logger.info("File not found in GridFS")
-                    raise HTTPException(status_code=404, detail="File not found in GridFS")       
-                document = content_collection.find_one({"file_id": file_object_id})
-                if not document:
-                    logger.info("Document not fount")
-                    raise HTTPException(status_code=404, detail="Document referencing file not found")
-                gridfs_bucket.delete(file_object_id)
-                content_collection.delete_one({"_id": document["_id"]})
-                logger.info("File and related document deleted successfully")
-                # return {"message": "File and related document deleted successfully"}
-            else:
-                gridfs_bucket.delete(ObjectId(file_id))
-                logger.info(f"Deleted file ID: {file_id}, Bucket: {bucket}")
-                logger.info("File deleted!")
-                # return {"message": "File deleted!"}
-
-            # gridfs_bucket.delete(ObjectId(file_id))
-            # content = await file.read()
-            content = await file.read()
-            new_file_id = gridfs_bucket.put(content, filename=file.filename, content_type=file.content_type, _id=ObjectId(file_id), downloadsCount= 0, viewsCount=0)
-            logger.info(f"Updated file: {file.filename}, ID: {new_file_id}, Bucket: {bucket}")
-
-
-            # Extract Text
-            if bucket_name == "pdf" or bucket_name == "word" or bucket_name == "csv" or bucket_name == "text":
-                #Store pdf content
-                if bucket_name == "pdf":
-                    extracted_text = extract_text_from_pdf(content)
-
-                #Store word content
-                if bucket_name == "word":
-                    extracted_text = extract_text_from_docx(content)
-
-                #Store txt content
-                if bucket_name == "text":
-                    extracted_text = content.decode("utf-8")
-                
-                #Store CSV content
-                if bucket_name == "csv":
-                    encoding = detect_encoding(content)
-                    df = pd.read_csv(io.BytesIO(content), dtype=str, encoding=encoding, header=None)
-                    extracted_text = "\n".join(df.astype(str).apply(lambda x: ", ".join(x), axis=1))
-
-                new_contentID = content_collection.insert_one({
-                        "filename": file.filename,
-                        "content": extracted_text,
-                        "file_id": ObjectId(file_id),
-                        "_id": ObjectId(document["_id"])
-                    }).inserted_id
-                files_collection = get_gridfs_files_collection(bucket_name)
-                files_collection.update_one(
-                        {"_id": ObjectId(file_id)}, # Filter condition
-                        {"$set": {"content_id": ObjectId(new_contentID)}}  # Correct use of $set
-                    )
-                logger.info("File and Content updated!")
-                return {"filename": file.filename, "file_id": str(file_id), "content_id": str(new_contentID), "bucket": bucket_name, "message": "File and Content updated!"}
-            
-            elif bucket_name == "json":
-                json_data = json.load(BytesIO(content))
-                extracted_text = content.decode("utf-8")
-                new_contentID = content_collection.insert_one({
-                    "filename": file.filename,
-                    "json_object": json_data,
-                    "content": extracted_text,
-                    "file_id": ObjectId(file_id),
-                    "_id": ObjectId(document["_id"])
-                }).inserted_id
-
-                files_collection = get_gridfs_files_collection(bucket_name)
-                files_collection.update_one(
-                        {"_id": ObjectId(file_id)}, # Filter condition
-                        {"$set": {"content_id": ObjectId(new_contentID)}}  # Correct use of $set
-                    )
-                return {"filename": file.filename, "file_id": str(file_id), "content_id": str(new_contentID), "bucket": bucket_name, "message": "File and Content updated!"}
+            file_data = await get_gridfs_files_collection(bucket).find_one({"_id": file_object_id})
+            if not file_data:
+                logger.info("File not found in GridFS")
+                raise HTTPException(status_code=404, detail="File not found in GridFS")
+
+            # Stored as a new revision and swapped in; the file never disappears and keeps its counters
+            fields = {"extractionStatus": "pending", "content_id": ObjectId()} if content_collection is not None else None
+            file_doc, revision = await store_revision(bucket, file_data, file, fields=fields)
+            logger.info(f"Updated file: {file.filename}, ID: {file_id}, Bucket: {bucket}, Size: {file_doc['length']}, Version: {file_doc.get('version', 1)}, Revision: {revision}")
+            await response_cache.invalidate(bucket)
+            if revision == "stored":
+                schedule_derivatives(bucket, file_doc, lambda: stream_file(bucket, file_doc))
+            response = {"filename": file.filename, "file_id": str(file_id), "bucket": bucket_name, "version": file_doc.get("version", 1), "deduplicated": revision == "deduplicated", "unchanged": revision == "unchanged"}
+
+            # Re-extract the content in the background unless identical content is already stored
+            if content_collection is not None:
+                contentID = file_doc.get("content_id")
+                if revision == "stored":
+                    status = await queue_extraction(bucket_name, file_doc["blob_id"], file.filename, contentID)
+                else:
+                    status = file_doc.get("extractionStatus")
+                return {**response, "content_id": str(contentID), "extraction_status": status, "message": "File unchanged!" if revision == "unchanged" else "File updated, content extraction queued!"}
             
             else:
-                return {"filename": file.filename, "file_id": str(new_file_id), "bucket": bucket_name, "message": "File updated!"}
+                return {**response, "message": "File unchanged!" if revision == "unchanged" else "File updated!"}
         else:
             return {"Message": "Please upload same file type!!"}
         
         # return {"filename": file.filename, "file_id": str(new_file_id), "bucket": bucket, "message": "File updated!"}
+    except HTTPException as e:
+        raise e  # Re-raise HTTP exceptions as-is
     except Exception as e:
         logger.error(f"Update error: {str(e)}")
         raise HTTPException(status_code=404, detail="File not found")
@@ -538,47 +1024,21 @@ async def update_file(file_id: str, bucket: str, file: UploadFile = File(...)):
 @app.delete("/file/{file_id}/{bucket}")
 async def delete_file(file_id: str, bucket: str):
     try:
-        gridfs_bucket = bucket_gridfs_dict[bucket]
+        if bucket not in bucket_names:
+            raise HTTPException(status_code=404, detail="Bucket not found")
         file_object_id = ObjectId(file_id)
+        # Find the file in the GridFS files collection
+        file_data = await get_gridfs_files_collection(bucket).find_one({"_id": file_object_id})
+        if not file_data:
+            logger.info("File not found in GridFS")
+            raise HTTPException(status_code=404, detail="File not found in GridFS")
+        # Delete the file; its chunks and related content document go once no other file shares them
+        await delete_stored_file(bucket, file_data)
+        logger.info(f"Deleted file ID: {file_id}, Bucket: {bucket}")
+        await response_cache.invalidate(bucket)
         if bucket == "pdf" or bucket == "word" or  bucket == "json" or bucket == "csv" or bucket == "text":
-            # if bucket == "pdf":
-            #     files_collection = db.pdf.files
-            #     content_collection = db.pdfContent
-            # elif bucket == "word":
-            #     files_collection = db.word.files
-            #     content_collection = db.wordContent
-            # elif bucket == "json":
-            #     files_collection = db.json.files
-            #     content_collection = db.jsonContent
-            # elif bucket == "csv":
-            #     files_collection = db.csv.files
-            #     content_collection = db.csvContent
-            # elif bucket == "text":
-            #     files_collection = db.text.files
-            #     content_collection = db.textContent
-            # else:
-            #     raise HTTPException(status_code=400, detail="Invalid bucket")
-
-            files_collection, content_collection = get_gridfs_files_and_contrnt_collection(bucket)
-            # Find the file in the GridFS files collection
-            file_data = files_collection.find_one({"_id": file_object_id})
-            if not file_data:
-                logger.info("File not found in GridFS")
-                raise HTTPException(status_code=404, detail="File not found in GridFS")       
-            # Find the related document in the other collection that references this file
-            document = content_collection.find_one({"file_id": file_object_id})
-            if not document:
-                logger.info("Document not fount")
-                raise HTTPException(status_code=404, detail="Document referencing file not found")
-            # Delete the file from GridFS
-            gridfs_bucket.delete(file_object_id)
-            # Delete the document from the other collection
-            content_collection.delete_one({"_id": document["_id"]})
-
             return {"message": "File and related document deleted successfully"}
         else:
-            gridfs_bucket.delete(ObjectId(file_id))
-            logger.info(f"Deleted file ID: {file_id}, Bucket: {bucket}")
             return {"message": "File deleted!"}
         # grid_out = gridfs_bucket.get(ObjectId(file_id))
         # content_ID = grid_out.content_id
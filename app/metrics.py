@@ -0,0 +1,153 @@
+"""Request, extraction and MongoDB metrics in the Prometheus text format.
+
+``GET /metrics`` renders everything registered here. ``MetricsMiddleware``
+times every request by route template and bucket (so ``/file/{file_id}/{bucket}``
+is one series per bucket, not one per file) and counts the response bytes
+actually sent. The CommandListener in app.instrumentation times every
+database command, and extraction jobs record how long each file type takes.
+
+The counters and histograms are small in-process objects, not the
+prometheus_client package: each worker process exposes its own values, as
+Prometheus expects when it scrapes several workers. They are updated from
+Motor's threads as well as the event loop, hence the lock.
+"""
+import threading
+import time
+from bisect import bisect_left
+from urllib.parse import parse_qs
+
+# Latency buckets in seconds, from a cache hit to a large download or extraction
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+_lock = threading.Lock()
+_metrics = []
+# Functions returning extra (name, type, help, [(labels, value)]) metrics at render time, e.g. cache stats
+_collectors = []
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _label_text(names, values) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values = {}
+        _metrics.append(self)
+
+    def inc(self, *labels, amount: float = 1):
+        with _lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self):
+        for labels, value in sorted(self.values.items()):
+            yield f"{self.name}{_label_text(self.labels, labels)} {value}"
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self.values = {}  # labels -> [count per bucket (+Inf last), sum]
+        _metrics.append(self)
+
+    def observe(self, value: float, *labels):
+        index = bisect_left(self.buckets, value)
+        with _lock:
+            series = self.values.get(labels)
+            if series is None:
+                series = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def samples(self):
+        names = self.labels + ("le",)
+        for labels, (counts, total) in sorted(self.values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                yield f"{self.name}_bucket{_label_text(names, labels + (bound,))} {cumulative}"
+            yield f"{self.name}_sum{_label_text(self.labels, labels)} {total}"
+            yield f"{self.name}_count{_label_text(self.labels, labels)} {cumulative}"
+
+
+def add_collector(collect):
+    _collectors.append(collect)
+
+
+def render() -> str:
+    lines = []
+    with _lock:
+        for metric in _metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+    for collect in _collectors:
+        for name, kind, help, samples in collect():
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            lines.extend(f"{name}{_label_text(tuple(labels), tuple(labels.values()))} {value}" for labels, value in samples)
+    return "\n".join(lines) + "\n"
+
+
+request_seconds = Histogram("http_request_duration_seconds", "Time from request to the last response byte", ("method", "route", "bucket", "status"))
+response_bytes = Counter("http_response_bytes_total", "Response body bytes sent", ("route", "bucket"))
+extraction_seconds = Histogram("extraction_duration_seconds", "Time to extract one file's content, including any wait for a worker", ("bucket", "status"))
+mongo_command_seconds = Histogram("mongodb_command_duration_seconds", "Time per MongoDB command, as measured by the driver", ("command",))
+mongo_command_failures = Counter("mongodb_command_failures_total", "MongoDB commands that failed", ("command",))
+
+
+# Route template of a request (after routing) and the bucket it is about, if any
+def request_labels(scope, buckets):
+    path = getattr(scope.get("route"), "path", None) or "unmatched"
+    bucket = scope.get("path_params", {}).get("bucket")
+    if not bucket:
+        bucket = parse_qs(scope.get("query_string", b"").decode("latin-1")).get("bucket", [""])[0]
+    # Any other value would make a series per typo
+    return path, bucket if bucket in buckets else ""
+
+
+class MetricsMiddleware:
+    """ASGI middleware timing each request to its last byte and counting the bytes sent."""
+
+    def __init__(self, app, buckets):
+        self.app = app
+        self.buckets = set(buckets)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        status = 500
+        sent = 0
+
+        async def counting_send(message):
+            nonlocal status, sent
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                sent += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, counting_send)
+        finally:
+            route, bucket = request_labels(scope, self.buckets)
+            request_seconds.observe(time.perf_counter() - start, scope["method"], route, bucket, str(status))
+            if sent:
+                response_bytes.inc(route, bucket, amount=sent)
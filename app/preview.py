@@ -0,0 +1,136 @@
+"""Inline previews of extracted content: whole, windowed or summarized.
+
+An inline view used to send a file's whole extracted text in one JSON
+document. With ``?offset=&limit=`` it sends only a window of it (lines of
+a Word file, rows of a CSV, pages of a PDF), read from the few
+content_chunks / pdfPages documents the window overlaps and streamed out
+as it is read. ``?summary=true`` sends the counts and first lines that
+extraction saved on the ``<bucket>Content`` document.
+
+Files extracted before the text was chunked still have it in ``content``;
+their windows are cut from that in memory.
+"""
+import json
+
+from pymongo import ASCENDING, DESCENDING
+
+from app.config import PREVIEW_LINES
+from app.search import content_chunks, pdf_pages
+
+# What offset/limit count in each previewable bucket
+UNITS = {"word": "line", "pdf": "page", "csv": "row"}
+# <bucket>Content field holding the number of units
+TOTAL_FIELDS = {"line": "lines", "page": "pages", "row": "rows"}
+# Fields of the <bucket>Content document passed along with a preview when present
+EXTRA_FIELDS = ("truncated", "columns", "dtypes")
+
+# Streamed windows are sent in pieces of about this many bytes
+FLUSH_BYTES = 64 * 1024
+
+
+def content_total(bucket: str, content_doc: dict):
+    unit = UNITS[bucket]
+    total = content_doc.get(TOTAL_FIELDS[unit])
+    if total is None and "content" in content_doc and unit != "page":
+        total = content_doc["content"].count("\n") + 1
+    return total
+
+
+def content_summary(bucket: str, content_doc: dict) -> dict:
+    preview = content_doc.get("preview")
+    if preview is None:
+        # Extracted before previews were computed
+        preview = content_doc.get("content", "").split("\n", PREVIEW_LINES)[:PREVIEW_LINES]
+    summary = {"filename": content_doc["filename"], "unit": UNITS[bucket], "total": content_total(bucket, content_doc), "preview": preview}
+    summary.update({field: content_doc[field] for field in EXTRA_FIELDS if field in content_doc})
+    return summary
+
+
+async def whole_content(bucket: str, content_doc: dict) -> dict:
+    """The whole extracted text, as inline views have always returned it."""
+    response = {"filename": content_doc["filename"]}
+    if "content" in content_doc:
+        return {**response, "content": content_doc["content"]}
+    if bucket == "pdf":
+        page_docs = pdf_pages.find({"file_id": content_doc["file_id"]}, {"_id": 0, "text": 1}).sort("page_no", ASCENDING)
+        return {
+            **response,
+            "content": " ".join([page["text"] async for page in page_docs if page["text"]]).strip(),
+            "page_count": content_doc.get("pages", 0),
+            "truncated": content_doc.get("truncated", False),
+        }
+    chunks = content_chunks.find({"file_id": content_doc["file_id"]}, {"_id": 0, "text": 1}).sort("chunk_no", ASCENDING)
+    response["content"] = "\n".join([chunk["text"] async for chunk in chunks])
+    if bucket == "csv":
+        response.update({"rows": content_doc.get("rows"), "columns": content_doc.get("columns"), "dtypes": content_doc.get("dtypes")})
+    return response
+
+
+# Lines offset .. offset+limit-1 from content_chunks, reading only the chunks that overlap them
+async def iter_chunk_lines(blob_id, offset: int, limit: int):
+    end = offset + limit
+    first = await content_chunks.find_one({"file_id": blob_id, "first_line": {"$lte": offset}}, {"first_line": 1}, sort=[("first_line", DESCENDING)])
+    if first is None:
+        return
+    chunks = content_chunks.find(
+        {"file_id": blob_id, "first_line": {"$gte": first["first_line"], "$lt": end}}, {"_id": 0, "first_line": 1, "text": 1}
+    ).sort("first_line", ASCENDING)
+    async for chunk in chunks:
+        lines = chunk["text"].split("\n")
+        for line in lines[max(offset - chunk["first_line"], 0):end - chunk["first_line"]]:
+            yield line
+
+
+# Pages offset+1 .. offset+limit (page numbers start at 1)
+async def iter_pages(blob_id, offset: int, limit: int):
+    page_docs = pdf_pages.find(
+        {"file_id": blob_id, "page_no": {"$gt": offset, "$lte": offset + limit}}, {"_id": 0, "page_no": 1, "text": 1}
+    ).sort("page_no", ASCENDING)
+    async for page in page_docs:
+        yield page
+
+
+# Window of text extracted before it was chunked (a PDF's text is then a single page)
+async def iter_legacy(bucket: str, content: str, offset: int, limit: int):
+    if bucket == "pdf":
+        if offset == 0:
+            yield {"page_no": 1, "text": content}
+        return
+    for line in content.split("\n")[offset:offset + limit]:
+        yield line
+
+
+async def stream_window(bucket: str, content_doc: dict, offset: int, limit: int):
+    """Yield a JSON document with the limit lines/rows/pages after offset as ``items``.
+
+    Pages are ``{"page_no", "text"}`` objects, lines and rows plain strings.
+    """
+    header = {
+        "filename": content_doc["filename"],
+        "unit": UNITS[bucket],
+        "offset": offset,
+        "limit": limit,
+        "total": content_total(bucket, content_doc),
+    }
+    header.update({field: content_doc[field] for field in EXTRA_FIELDS if field in content_doc})
+    if "content" in content_doc:
+        items = iter_legacy(bucket, content_doc["content"], offset, limit)
+    elif bucket == "pdf":
+        items = iter_pages(content_doc["file_id"], offset, limit)
+    else:
+        items = iter_chunk_lines(content_doc["file_id"], offset, limit)
+
+    parts = [json.dumps(header)[:-1], ', "items": [']
+    size = 0
+    separator = ""
+    async for item in items:
+        part = separator + json.dumps(item)
+        separator = ", "
+        parts.append(part)
+        size += len(part)
+        if size >= FLUSH_BYTES:
+            yield "".join(parts).encode("utf-8")
+            parts = []
+            size = 0
+    parts.append("]}")
+    yield "".join(parts).encode("utf-8")
@@ -0,0 +1,73 @@
+"""Sampling profiler for single requests, in debug mode only (``DEBUG=true``).
+
+Add ``profile=1`` to any request's query string and the response body is
+replaced by the event loop thread's stacks, sampled every
+``PROFILE_INTERVAL`` seconds while the request ran, in the "folded" format
+that flamegraph.pl, speedscope and inferno read::
+
+    curl 'http://localhost:8000/search/?word=invoice&profile=1' > search.folded
+    flamegraph.pl search.folded > search.svg
+
+The sampler is a thread reading ``sys._current_frames()``, so the profiled
+code runs unmodified. Everything else the event loop does meanwhile (other
+requests, background flushes) is sampled too, so profile on a quiet server.
+Database time shows up as the awaits waiting on Motor's threads.
+"""
+import sys
+import threading
+from collections import Counter
+from urllib.parse import parse_qs
+
+from fastapi.responses import PlainTextResponse
+
+
+class StackSampler:
+    def __init__(self, thread_id: int, interval: float):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(f"{code.co_name} ({code.co_filename.rsplit('/', 1)[-1]}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if names:
+                self.stacks[";".join(reversed(names))] += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self) -> str:
+        self._stop.set()
+        self._thread.join()
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+class ProfilerMiddleware:
+    """ASGI middleware answering ``?profile=1`` requests with their sampled stacks."""
+
+    def __init__(self, app, interval: float):
+        self.app = app
+        self.interval = interval
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or parse_qs(scope.get("query_string", b"").decode("latin-1")).get("profile") != ["1"]:
+            await self.app(scope, receive, send)
+            return
+
+        async def discard(message):
+            pass
+
+        sampler = StackSampler(threading.get_ident(), self.interval)
+        sampler.start()
+        try:
+            await self.app(scope, receive, discard)
+        finally:
+            stacks = sampler.stop()
+        await PlainTextResponse(stacks)(scope, receive, send)
@@ -0,0 +1,144 @@
+"""Full-text search over the extracted content collections.
+
+Each ``<bucket>Content`` collection gets a MongoDB text index on ``content``,
+so a search is an index lookup ranked by ``textScore`` instead of an
+unanchored ``$regex`` scan over every stored document.
+
+PDF text is stored one document per page in ``pdfPages`` and Word, text and
+CSV text in ``content_chunks`` documents of consecutive lines (the
+<bucket>Content documents only summarize them), so PDF hits name the page
+that matched.
+Files extracted before that still have their text in <bucket>Content and
+are found there.
+
+JSON files are also chunked as text (one ``path: value`` line per value),
+and the values at ``JSON_INDEX_PATHS`` go to ``json_values``, one document
+per (file, path, value), so ``json_field_search`` finds the files holding a
+value with one index lookup.
+"""
+import asyncio
+
+from pymongo import ASCENDING, DESCENDING, TEXT, IndexModel
+from pymongo.errors import CollectionInvalid
+
+from app.config import CONTENT_BLOCK_COMPRESSOR
+from app.db import LISTING_READS, db
+
+# Buckets whose files have an extracted <bucket>Content document
+SEARCH_BUCKETS = ["pdf", "word", "text", "json", "csv"]
+
+CONTENT_INDEXES = [
+    IndexModel([("content", TEXT)], name="content_text", default_language="none"),
+    IndexModel([("file_id", ASCENDING)], name="file_id"),
+]
+
+# Per-page PDF text
+pdf_pages = db["pdfPages"]
+
+PAGE_INDEXES = [
+    IndexModel([("text", TEXT)], name="text_text", default_language="none"),
+    IndexModel([("file_id", ASCENDING), ("page_no", ASCENDING)], name="file_id_page_no", unique=True),
+]
+
+# Extracted text split into runs of lines (CSV rows), one collection for every bucket
+content_chunks = db["content_chunks"]
+
+CHUNK_INDEXES = [
+    IndexModel([("text", TEXT)], name="text_text", default_language="none"),
+    IndexModel([("file_id", ASCENDING), ("chunk_no", ASCENDING)], name="file_id_chunk_no", unique=True),
+    # Finds the chunks a preview window overlaps
+    IndexModel([("file_id", ASCENDING), ("first_line", ASCENDING)], name="file_id_first_line"),
+]
+
+# Values at the indexed key paths of JSON files
+json_values = db["json_values"]
+
+JSON_VALUE_INDEXES = [
+    IndexModel([("path", ASCENDING), ("value", ASCENDING), ("file_id", DESCENDING)], name="path_value_file_id"),
+    IndexModel([("file_id", ASCENDING)], name="file_id"),
+]
+json_value_reads = json_values.with_options(read_preference=LISTING_READS)
+
+
+async def ensure_search_indexes():
+    existing = set(await db.list_collection_names())
+    collections = [(f"{bucket}Content", CONTENT_INDEXES) for bucket in SEARCH_BUCKETS] + [
+        ("pdfPages", PAGE_INDEXES), ("content_chunks", CHUNK_INDEXES), ("json_values", JSON_VALUE_INDEXES)
+    ]
+    for name, indexes in collections:
+        if CONTENT_BLOCK_COMPRESSOR and name not in existing:
+            # Extracted text must stay plain for the text index, so compress it on disk instead.
+            # This only applies when the collection is created; existing ones keep their setting.
+            try:
+                await db.create_collection(name, storageEngine={"wiredTiger": {"configString": f"block_compressor={CONTENT_BLOCK_COMPRESSOR}"}})
+            except CollectionInvalid:
+                pass  # Created by another worker meanwhile
+        await db[name].create_indexes(indexes)
+
+
+async def delete_extracted_content(bucket: str, blob_ids: list):
+    """Delete the extracted content (PDF pages and content chunks too) of blobs nobody references any more."""
+    await db[f"{bucket}Content"].delete_many({"file_id": {"$in": blob_ids}})
+    await content_chunks.delete_many({"file_id": {"$in": blob_ids}})
+    if bucket == "pdf":
+        await pdf_pages.delete_many({"file_id": {"$in": blob_ids}})
+    if bucket == "json":
+        await json_values.delete_many({"file_id": {"$in": blob_ids}})
+
+
+# Collections a search queries, with the bucket of their hits (None = stored on each hit)
+search_sources = [
+    (collection.with_options(read_preference=LISTING_READS), bucket)
+    for collection, bucket in [(db[f"{bucket}Content"], bucket) for bucket in SEARCH_BUCKETS] + [(pdf_pages, "pdf"), (content_chunks, None)]
+]
+
+
+async def text_search(word: str, limit: int, offset: int = 0):
+    """Return one page of (score, bucket, file_id, page_no) hits, best first, and whether more exist.
+
+    ``page_no`` is the matching PDF page, or None for whole-document hits.
+    Every collection returns its own top ``offset + limit + 1`` hits from the
+    text index (all are queried concurrently); those are merged by score
+    and the requested window is cut out. A file's text spans many
+    content_chunks documents, so each collection groups its matches by
+    (file_id, page_no) first, keeping the best score: one file matching in
+    many chunks is one hit and can't crowd the others out of the quota.
+    """
+    wanted = offset + limit + 1
+
+    async def collection_hits(collection, bucket):
+        cursor = collection.aggregate([
+            {"$match": {"$text": {"$search": word}}},
+            {"$group": {
+                "_id": {"file_id": "$file_id", "page_no": "$page_no"},
+                "score": {"$max": {"$meta": "textScore"}},
+                "bucket": {"$first": "$bucket"},
+            }},
+            {"$sort": {"score": -1}},
+            {"$limit": wanted},
+        ])
+        return [(doc["score"], doc.get("bucket") or bucket, doc["_id"]["file_id"], doc["_id"].get("page_no")) for doc in await cursor.to_list(length=wanted)]
+
+    hits = [hit for source_hits in await asyncio.gather(*(collection_hits(*source) for source in search_sources)) for hit in source_hits]
+    hits.sort(key=lambda hit: hit[0], reverse=True)
+    # Files extracted before chunking can also match in <bucket>Content; only their best hit counts
+    seen = set()
+    hits = [hit for hit in hits if (hit[2], hit[3]) not in seen and not seen.add((hit[2], hit[3]))]
+    return hits[offset:offset + limit], len(hits) > offset + limit
+
+
+async def json_field_search(path: str, values: list, limit: int, offset: int = 0):
+    """Return one page of the blob ids whose JSON has one of ``values`` at ``path``, newest first, and whether more exist.
+
+    A file has one json_values document per value it holds, so the matches
+    are grouped by file before the page is cut: skip and limit count files.
+    """
+    cursor = json_value_reads.aggregate([
+        {"$match": {"path": path, "value": {"$in": values}}},
+        {"$group": {"_id": "$file_id"}},
+        {"$sort": {"_id": -1}},
+        {"$skip": offset},
+        {"$limit": limit + 1},
+    ])
+    blob_ids = [doc["_id"] async for doc in cursor]
+    return blob_ids[:limit], len(blob_ids) > limit
@@ -0,0 +1,383 @@
+"""Content-addressed file storage on top of the GridFS buckets.
+
+Every ``<bucket>.files`` document carries a ``blob_id``: the ``files_id`` its
+chunks are stored under in ``<bucket>.chunks``. A new upload normally owns
+its chunks (``blob_id == _id``). With ``DEDUP_UPLOADS`` on, the ``blobs``
+collection maps (bucket, sha256) to a blob and counts its references. An
+upload whose bytes are already stored becomes an alias: it gets a new
+``.files`` document pointing at the existing chunks and extracted content,
+and no data is written. Chunks and content are only deleted when the last
+reference goes away.
+
+Documents written before blob_id existed have no such field; their chunks
+live under their own ``_id``, which ``blob_id_of`` falls back to.
+
+Buckets with a storage codec (see app.compression) hold compressed chunks;
+``stream_file`` and ``read_file`` give back the original bytes either way.
+
+An update never deletes the file: ``store_revision`` stores the new bytes as
+another blob and swaps the ``.files`` document's blob_id to it in one
+compare-and-swap, keeping the id and the counters. The old blob is released
+REVISION_GC_DELAY seconds later (recorded in ``blob_releases`` so a restart
+doesn't leak it).
+"""
+import asyncio
+import hashlib
+import logging
+from datetime import datetime, timedelta, timezone
+
+from bson.objectid import ObjectId
+from fastapi import HTTPException, UploadFile
+from pymongo import ASCENDING, IndexModel, ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from app.catalog import BUCKETS, remove_catalog_entry, upsert_catalog_entry
+from app.compression import BUCKET_CODECS, decode_stream, get_codec
+from app.config import DEDUP_UPLOADS, MAX_FILE_SIZE, REVISION_GC_DELAY, UPLOAD_BLOCK_SIZE
+from app.blobcache import blob_cache
+from app.db import chunk_size_of, db, get_database
+from app.derivatives import DERIVATIVE_BUCKETS, delete_derivatives
+from app.leaderboard import leaderboard
+from app.search import SEARCH_BUCKETS, delete_extracted_content
+from app.utils import stream_gridout
+
+logger = logging.getLogger(__name__)
+
+blobs = db["blobs"]
+# Blobs replaced by an update, released once "due" has passed
+blob_releases = db["blob_releases"]
+# Background release tasks (kept so they are not garbage collected)
+release_tasks = set()
+
+# Chunks are inserted about this many bytes at a time (four chunks of GridFS's default 255 KiB)
+INSERT_BYTES = 1024 * 1024
+
+
+async def ensure_storage_indexes():
+    await blobs.create_indexes([IndexModel([("bucket", ASCENDING), ("sha256", ASCENDING)], name="bucket_sha256", unique=True)])
+    await blob_releases.create_indexes([IndexModel([("due", ASCENDING)], name="due")])
+    await asyncio.gather(*(db[f"{bucket}.files"].create_indexes([IndexModel([("blob_id", ASCENDING)], name="blob_id")]) for bucket in BUCKETS))
+    # Finds the extractions a restart interrupted; only pending files are indexed
+    await asyncio.gather(*(
+        db[f"{bucket}.files"].create_indexes([IndexModel([("extractionStatus", ASCENDING)], name="extractionStatus_pending", partialFilterExpression={"extractionStatus": "pending"})])
+        for bucket in SEARCH_BUCKETS
+    ))
+
+
+def blob_id_of(file_doc: dict):
+    return file_doc.get("blob_id", file_doc["_id"])
+
+
+# GridOut that reads a file's (possibly shared, possibly compressed) chunks, built without another round trip
+def open_grid_out(bucket_name: str, file_doc: dict):
+    from motor.motor_asyncio import AsyncIOMotorGridOut
+    stored = {"_id": blob_id_of(file_doc), "length": file_doc.get("storedLength", file_doc["length"])}
+    return AsyncIOMotorGridOut(get_database()[bucket_name], file_document={**file_doc, **stored})
+
+
+def stream_file(bucket_name: str, file_doc: dict, start: int = 0, end: int = None):
+    """Async iterator over a file's original bytes start..end (inclusive), decompressing if needed."""
+    if not file_doc["length"]:
+        return stream_gridout(open_grid_out(bucket_name, file_doc), 0, -1)
+    codec = get_codec(file_doc.get("codec"))
+    if codec is None:
+        return stream_gridout(open_grid_out(bucket_name, file_doc), start, end)
+    return decode_stream(stream_gridout(open_grid_out(bucket_name, file_doc)), codec, start, end)
+
+
+async def read_file(bucket_name: str, file_doc: dict) -> bytes:
+    return b"".join([data async for data in stream_file(bucket_name, file_doc)])
+
+
+# Size and hash the upload spool in one pass, before anything is written to the database
+async def hash_upload(file: UploadFile):
+    sha256 = hashlib.sha256()
+    length = 0
+    await file.seek(0)
+    while True:
+        block = await file.read(UPLOAD_BLOCK_SIZE)
+        if not block:
+            break
+        length += len(block)
+        if length > MAX_FILE_SIZE:
+            logger.error(f"File too large: {file.filename} exceeded {MAX_FILE_SIZE} bytes")
+            raise HTTPException(status_code=413, detail=f"File too big (max {MAX_FILE_SIZE} bytes)")
+        sha256.update(block)
+    return sha256.hexdigest(), length
+
+
+# Write the upload spool as GridFS chunks under blob_id, a few chunks per insert.
+# With a codec the chunks hold the compressed stream. Returns the number of bytes stored.
+async def write_chunks(bucket_name: str, blob_id, file: UploadFile, chunk_size: int, codec=None):
+    chunks = db[f"{bucket_name}.chunks"]
+    per_insert = max(1, INSERT_BYTES // chunk_size)
+    compressor = codec.compressor() if codec else None
+    pending = []
+    buffer = b""
+    n = 0
+    stored = 0
+    await file.seek(0)
+    try:
+        eof = False
+        while not eof:
+            block = await file.read(UPLOAD_BLOCK_SIZE)
+            eof = not block
+            if compressor:
+                block = compressor.flush() if eof else compressor.compress(block)
+            stored += len(block)
+            buffer += block
+            while len(buffer) >= chunk_size or (eof and buffer):
+                pending.append({"files_id": blob_id, "n": n, "data": buffer[:chunk_size]})
+                buffer = buffer[chunk_size:]
+                n += 1
+                if len(pending) == per_insert:
+                    await chunks.insert_many(pending)
+                    pending = []
+        if pending:
+            await chunks.insert_many(pending)
+    except BaseException:
+        # Don't leave a half-written blob behind
+        await chunks.delete_many({"files_id": blob_id})
+        raise
+    return stored
+
+
+def _upload_date():
+    # BSON dates have millisecond precision; truncate now so the value we return matches what is stored
+    now = datetime.now(timezone.utc)
+    return now.replace(microsecond=now.microsecond // 1000 * 1000, tzinfo=None)
+
+
+# Record a newly written blob so identical uploads can share it
+async def register_blob(bucket_name: str, file_doc: dict):
+    blob = {"_id": file_doc["blob_id"], "bucket": bucket_name, "sha256": file_doc["sha256"], "length": file_doc["length"], "chunkSize": file_doc["chunkSize"], "refcount": 1}
+    for name in ("codec", "storedLength", "extractionStatus", "content_id"):
+        if name in file_doc:
+            blob[name] = file_doc[name]
+    try:
+        await blobs.insert_one(blob)
+    except DuplicateKeyError:
+        # An identical upload registered the hash first; this file simply keeps its own chunks
+        pass
+
+
+async def store_upload(bucket_name: str, file: UploadFile, fields: dict = None):
+    """Store an upload in a bucket and return ``(file_doc, deduplicated)``.
+
+    ``fields`` are extra ``.files`` fields (``extractionStatus``/``content_id``
+    for content buckets). When the upload aliases an existing blob, those two
+    are taken from the blob instead and ``deduplicated`` is True.
+    """
+    digest, length = await hash_upload(file)
+    files_collection = db[f"{bucket_name}.files"]
+    file_doc = {
+        "_id": ObjectId(),
+        "filename": file.filename,
+        "contentType": file.content_type,
+        "length": length,
+        "chunkSize": chunk_size_of(bucket_name),
+        "uploadDate": _upload_date(),
+        "downloadsCount": 0,
+        "viewsCount": 0,
+        "sha256": digest,
+        "version": 1,
+        **(fields or {}),
+    }
+
+    if DEDUP_UPLOADS:
+        blob = await blobs.find_one({"bucket": bucket_name, "sha256": digest})
+        if blob:
+            original = dict(file_doc)
+            if await alias_blob(bucket_name, file_doc, blob):
+                logger.info(f"Deduplicated upload: {file.filename} shares blob {blob['_id']}, Bucket: {bucket_name}")
+                return file_doc, True
+            # The blob was deleted meanwhile: drop what was copied from it (its chunk size, codec,
+            # extraction status and content_id) and store the upload as a blob of its own
+            file_doc.clear()
+            file_doc.update(original)
+
+    blob_id = file_doc["_id"]
+    file_doc["blob_id"] = blob_id
+    codec = BUCKET_CODECS.get(bucket_name)
+    file_doc.pop("codec", None)
+    file_doc.pop("storedLength", None)
+    stored = await write_chunks(bucket_name, blob_id, file, file_doc["chunkSize"], codec)
+    if codec:
+        file_doc.update(codec=codec.name, storedLength=stored)
+    await files_collection.insert_one(file_doc)
+    if DEDUP_UPLOADS:
+        await register_blob(bucket_name, file_doc)
+    await upsert_catalog_entry(bucket_name, file_doc)
+    return file_doc, False
+
+
+async def store_revision(bucket_name: str, file_doc: dict, file: UploadFile, fields: dict = None):
+    """Make an upload the new content of an existing file and return ``(file_doc, status)``.
+
+    The upload goes to a fresh blob (or takes a reference on an identical
+    stored one), then the ``.files`` document is switched to it with a
+    compare-and-swap on its current blob_id: readers see the old revision or
+    the new one, never a missing file, and a failure before the swap leaves
+    the file as it was. The id, counters and upload history are kept and
+    ``version`` goes up by one. ``fields`` are as for store_upload.
+
+    ``status`` is "unchanged" when the bytes are the same as now (nothing is
+    written; only the name and type are updated), "deduplicated" when another
+    stored blob had them, or "stored". Raises a 409 if another request
+    updated or deleted the file meanwhile.
+    """
+    digest, length = await hash_upload(file)
+    files_collection = db[f"{bucket_name}.files"]
+    renamed = {"filename": file.filename, "contentType": file.content_type}
+    if digest == file_doc.get("sha256"):
+        if any(file_doc.get(name) != value for name, value in renamed.items()):
+            file_doc = await files_collection.find_one_and_update({"_id": file_doc["_id"]}, {"$set": renamed}, return_document=ReturnDocument.AFTER)
+            if file_doc is None:
+                raise HTTPException(status_code=409, detail="The file was deleted by another request")
+            await upsert_catalog_entry(bucket_name, file_doc)
+        return file_doc, "unchanged"
+
+    revision = {**renamed, "length": length, "sha256": digest, "uploadDate": _upload_date(), "version": file_doc.get("version", 1) + 1, **(fields or {})}
+    blob = None
+    if DEDUP_UPLOADS:
+        blob = await blobs.find_one_and_update({"bucket": bucket_name, "sha256": digest}, {"$inc": {"refcount": 1}}, return_document=ReturnDocument.AFTER)
+    if blob is not None:
+        status = "deduplicated"
+        revision.update(blob_id=blob["_id"], chunkSize=blob["chunkSize"])
+        for name in ("codec", "storedLength", "extractionStatus", "content_id"):
+            if name in blob:
+                revision[name] = blob[name]
+    else:
+        status = "stored"
+        revision.update(blob_id=ObjectId(), chunkSize=chunk_size_of(bucket_name))
+        codec = BUCKET_CODECS.get(bucket_name)
+        stored = await write_chunks(bucket_name, revision["blob_id"], file, revision["chunkSize"], codec)
+        if codec:
+            revision.update(codec=codec.name, storedLength=stored)
+        if DEDUP_UPLOADS:
+            await register_blob(bucket_name, revision)
+
+    old_blob_id = blob_id_of(file_doc)
+    # While the new revision's text is being extracted, inline views keep showing the last extracted
+    # revision's: that blob stays referenced as previousBlobId and is released when the extraction ends
+    releases = [old_blob_id]
+    previous = file_doc.get("previousBlobId")
+    if revision.get("extractionStatus") == "pending":
+        revision["previousBlobId"] = previous or old_blob_id
+        if previous is None:
+            releases = []
+    elif previous is not None:
+        releases.append(previous)
+    current = {"_id": file_doc["_id"], "blob_id": old_blob_id} if "blob_id" in file_doc else {"_id": file_doc["_id"], "blob_id": {"$exists": False}}
+    update = {"$set": revision}
+    stale = {name: "" for name in ("codec", "storedLength", "extractionError", "previousBlobId") if name not in revision}
+    if stale:
+        update["$unset"] = stale
+    new_doc = await files_collection.find_one_and_update(current, update, return_document=ReturnDocument.AFTER)
+    if new_doc is None:
+        # Updated or deleted by someone else since we read it: give back the blob we took
+        await release_blob(bucket_name, revision["blob_id"])
+        raise HTTPException(status_code=409, detail="The file was changed or deleted by another request, try again")
+    await upsert_catalog_entry(bucket_name, new_doc)
+    for blob_id in releases:
+        await schedule_release(bucket_name, blob_id)
+    return new_doc, status
+
+
+async def finish_revisions(bucket_name: str, blob_id):
+    """Once blob_id's extraction has ended, release the previous revisions the files on it kept for their text."""
+    files_collection = db[f"{bucket_name}.files"]
+    async for f in files_collection.find({"blob_id": blob_id, "previousBlobId": {"$exists": True}}, {"previousBlobId": 1}):
+        # Claimed first, so only one job releases it
+        if await files_collection.find_one_and_update({"_id": f["_id"], "previousBlobId": f["previousBlobId"]}, {"$unset": {"previousBlobId": ""}}):
+            await schedule_release(bucket_name, f["previousBlobId"])
+
+
+async def alias_blob(bucket_name: str, file_doc: dict, blob: dict) -> bool:
+    """Point file_doc at an existing blob. Returns False if the blob was deleted meanwhile."""
+    files_collection = db[f"{bucket_name}.files"]
+    file_doc.update(blob_id=blob["_id"], chunkSize=blob["chunkSize"])
+    # The blob may have been stored with a codec (or without one) regardless of the bucket's current setting
+    for name in ("codec", "storedLength"):
+        file_doc.pop(name, None)
+        if name in blob:
+            file_doc[name] = blob[name]
+    for name in ("extractionStatus", "content_id"):
+        if name in blob:
+            file_doc[name] = blob[name]
+    # Insert first, then take the reference: a concurrent extraction job that finishes
+    # after our read of the blob will update this document through its blob_id
+    await files_collection.insert_one(file_doc)
+    blob = await blobs.find_one_and_update({"_id": blob["_id"]}, {"$inc": {"refcount": 1}}, return_document=ReturnDocument.AFTER)
+    if blob is None:
+        await files_collection.delete_one({"_id": file_doc["_id"]})
+        del file_doc["blob_id"]
+        return False
+    status = {name: blob[name] for name in ("extractionStatus", "content_id") if name in blob and blob[name] != file_doc.get(name)}
+    if status:
+        file_doc.update(status)
+        await files_collection.update_one({"_id": file_doc["_id"]}, {"$set": status})
+    await upsert_catalog_entry(bucket_name, file_doc)
+    return True
+
+
+async def delete_stored_file(bucket_name: str, file_doc: dict):
+    """Delete a file. Its chunks and extracted content go too once no other file references them."""
+    blob_id = blob_id_of(file_doc)
+    blob_cache.discard(bucket_name, blob_id)
+    await db[f"{bucket_name}.files"].delete_one({"_id": file_doc["_id"]})
+    await remove_catalog_entry(file_doc["_id"])
+    leaderboard.remove(file_doc["_id"])
+    await release_blob(bucket_name, blob_id)
+    if "previousBlobId" in file_doc:
+        await release_blob(bucket_name, file_doc["previousBlobId"])
+
+
+async def release_blob(bucket_name: str, blob_id):
+    """Drop one reference to a blob; its chunks, extracted content and derivatives go with the last one."""
+    blob = await blobs.find_one_and_update({"_id": blob_id}, {"$inc": {"refcount": -1}}, return_document=ReturnDocument.AFTER)
+    if blob is not None:
+        if blob["refcount"] > 0:
+            return
+        # Only delete if nobody took a new reference since our decrement
+        if not await blobs.find_one_and_delete({"_id": blob_id, "refcount": {"$lte": 0}}):
+            return
+
+    blob_cache.discard(bucket_name, blob_id)
+    await db[f"{bucket_name}.chunks"].delete_many({"files_id": blob_id})
+    if bucket_name in SEARCH_BUCKETS:
+        await delete_extracted_content(bucket_name, [blob_id])
+    if bucket_name in DERIVATIVE_BUCKETS:
+        await delete_derivatives([blob_id])
+
+
+async def release_due_blobs():
+    """Release the replaced blobs whose grace period is over. Each is claimed first, so only one worker releases it."""
+    while True:
+        release = await blob_releases.find_one_and_delete({"due": {"$lte": datetime.now(timezone.utc).replace(tzinfo=None)}})
+        if release is None:
+            return
+        await release_blob(release["bucket"], release["blob_id"])
+        logger.info(f"Released replaced blob {release['blob_id']}, Bucket: {release['bucket']}")
+
+
+async def _release_later(delay: float):
+    await asyncio.sleep(delay)
+    try:
+        await release_due_blobs()
+    except Exception as e:
+        logger.error(f"Releasing replaced blobs failed: {str(e)}")
+
+
+def start_releases(delay: float = REVISION_GC_DELAY):
+    """Release due blobs after delay seconds, in the background (also run at startup for ones left by a restart)."""
+    task = asyncio.create_task(_release_later(delay))
+    release_tasks.add(task)
+    task.add_done_callback(release_tasks.discard)
+
+
+# Release a blob replaced by an update once downloads already streaming it have had time to finish
+async def schedule_release(bucket_name: str, blob_id):
+    due = datetime.now(timezone.utc).replace(tzinfo=None) + timedelta(seconds=REVISION_GC_DELAY)
+    await blob_releases.insert_one({"bucket": bucket_name, "blob_id": blob_id, "due": due})
+    start_releases()
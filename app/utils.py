@@ -0,0 +1,145 @@
+import base64
+import json
+import re
+from datetime import datetime, timedelta
+
+# Single "bytes=start-end" / "bytes=start-" / "bytes=-suffix" range
+RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+class RangeNotSatisfiable(Exception):
+    """Raised when a Range header cannot be served for a file of the given length."""
+
+
+# Build a strong ETag from the .files document (sha256 > md5 > id/length/uploadDate)
+def make_etag(file_doc: dict) -> str:
+    metadata = file_doc.get("metadata") or {}
+    digest = file_doc.get("sha256") or metadata.get("sha256") or file_doc.get("md5")
+    if not digest:
+        upload_date = file_doc.get("uploadDate")
+        stamp = int(upload_date.timestamp() * 1000) if upload_date else 0
+        digest = f"{file_doc['_id']}-{file_doc.get('length', 0)}-{stamp}"
+    return f'"{digest}"'
+
+
+# Does an If-None-Match header match this ETag?
+def etag_matches(header: str, etag: str) -> bool:
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    candidates = [tag.strip() for tag in header.split(",")]
+    # Weak comparison: W/"x" matches "x"
+    return etag in candidates or f"W/{etag}" in candidates
+
+
+# Does an Accept-Encoding header explicitly accept this content-coding (with q > 0)?
+def accepts_encoding(header: str, coding: str) -> bool:
+    for item in (header or "").split(","):
+        name, _, params = item.partition(";")
+        if name.strip().lower() != coding:
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        return q > 0
+    return False
+
+
+def parse_range(header: str, length: int):
+    """Return the inclusive (start, end) byte range asked for, or None for the whole file.
+
+    Only a single range is supported; multi-range requests fall back to the
+    whole file, which RFC 9110 allows.
+    """
+    if not header:
+        return None
+    match = RANGE_RE.match(header.strip())
+    if not match:
+        return None
+    start, end = match.groups()
+    if not start and not end:
+        return None
+    if not start:
+        # Suffix range: the last N bytes
+        suffix = int(end)
+        if suffix == 0:
+            raise RangeNotSatisfiable()
+        return max(length - suffix, 0), length - 1
+    start = int(start)
+    end = int(end) if end else length - 1
+    if start >= length or end < start:
+        raise RangeNotSatisfiable()
+    return start, min(end, length - 1)
+
+
+async def stream_gridout(grid_out, start: int = 0, end: int = None):
+    """Yield the bytes of an open GridOut from start to end (inclusive), one chunk at a time.
+
+    Reads are aligned to the GridFS chunk size, so memory per request stays
+    bounded by one chunk no matter how large the file is.
+    """
+    if end is None:
+        end = grid_out.length - 1
+    remaining = end - start + 1
+    if start:
+        grid_out.seek(start)
+    chunk_size = grid_out.chunk_size
+    while remaining > 0:
+        # First read ends on a chunk boundary, later reads are whole chunks
+        to_read = min(chunk_size - (grid_out.tell() % chunk_size), remaining)
+        data = await grid_out.read(to_read)
+        if not data:
+            break
+        remaining -= len(data)
+        yield data
+
+
+def parse_page_range(value: str, page_count: int):
+    """Parse "N", "A-B" or "A-" into an inclusive (first, last) page range; None means every page.
+
+    Raises ValueError if it is malformed.
+    """
+    if not value:
+        return 1, page_count
+    first, dash, last = value.partition("-")
+    first = int(first)
+    last = (int(last) if last else page_count) if dash else first
+    if first < 1 or last < first:
+        raise ValueError("Invalid page range")
+    return first, last
+
+
+# Opaque pagination cursors: url-safe base64 of a small JSON list
+def encode_cursor(*values) -> str:
+    raw = json.dumps(values, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(token: str) -> list:
+    """Decode a cursor made by encode_cursor; raises ValueError if it is malformed."""
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        values = json.loads(raw)
+    except Exception:
+        raise ValueError("Invalid cursor")
+    if not isinstance(values, list):
+        raise ValueError("Invalid cursor")
+    return values
+
+
+# Milliseconds since the epoch <-> naive UTC datetime (BSON dates have millisecond precision)
+EPOCH = datetime(1970, 1, 1)
+
+
+def datetime_to_ms(value: datetime) -> int:
+    return (value.replace(tzinfo=None) - EPOCH) // timedelta(milliseconds=1)
+
+
+def ms_to_datetime(value: int) -> datetime:
+    return EPOCH + timedelta(milliseconds=value)
@@ -0,0 +1,84 @@
+"""Streaming ZIP archives built on the fly from GridFS chunks.
+
+``zipfile`` can write to a stream it cannot seek: it then puts each entry's
+CRC and sizes in a data descriptor after the data. The archive is written to
+a small in-memory sink that is emptied after every GridFS chunk, so memory
+stays at about one chunk no matter how large the archive gets, and no temp
+file is needed.
+"""
+import zipfile
+
+from starlette.concurrency import run_in_threadpool
+
+from app.storage import stream_file
+
+# Already-compressed formats are stored as-is; deflating them again only costs CPU
+STORED_PREFIXES = ("image/", "audio/", "video/")
+STORED_TYPES = {
+    "application/pdf",
+    "application/zip",
+    "application/gzip",
+    "application/x-gzip",
+    "application/x-7z-compressed",
+    "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+}
+
+
+def compression_for(content_type: str) -> int:
+    content_type = (content_type or "").split(";")[0].strip().lower()
+    if content_type in STORED_TYPES or content_type.startswith(STORED_PREFIXES):
+        return zipfile.ZIP_STORED
+    return zipfile.ZIP_DEFLATED
+
+
+class ZipSink:
+    """Write-only, unseekable file object that collects what zipfile writes until drained."""
+
+    def __init__(self):
+        self.parts = []
+
+    def write(self, data) -> int:
+        self.parts.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self.parts)
+        self.parts = []
+        return data
+
+
+async def stream_zip(entries, on_complete=None):
+    """Yield a ZIP archive of entries, given as ``(arcname, bucket, file_doc)``.
+
+    ``on_complete`` is awaited once the whole archive has been sent, so a
+    client that disconnects half way is not counted as a download.
+    """
+    sink = ZipSink()
+    archive = zipfile.ZipFile(sink, "w")
+    for arcname, bucket, file_doc in entries:
+        info = zipfile.ZipInfo(arcname, date_time=file_doc["uploadDate"].timetuple()[:6])
+        info.compress_type = compression_for(file_doc.get("contentType"))
+        info.external_attr = 0o644 << 16
+        deflated = info.compress_type == zipfile.ZIP_DEFLATED
+        # The sizes are only known afterwards, so large entries must be zip64 from the start
+        with archive.open(info, "w", force_zip64=file_doc["length"] > (1 << 30)) as member:
+            if file_doc["length"]:
+                async for data in stream_file(bucket, file_doc):
+                    if deflated:
+                        # zlib releases the GIL, so compress off the event loop
+                        await run_in_threadpool(member.write, data)
+                    else:
+                        member.write(data)
+                    data = sink.drain()
+                    if data:
+                        yield data
+        data = sink.drain()
+        if data:
+            yield data
+    archive.close()
+    yield sink.drain()
+    if on_complete is not None:
+        await on_complete()
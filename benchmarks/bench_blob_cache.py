@@ -0,0 +1,74 @@
+"""Download latency and blob cache hit ratio under a Zipf-distributed workload.
+
+Start the API against a local mongod, once with the cache off and once on:
+
+    BLOB_CACHE_MAX_BYTES=0 uvicorn app.main:app --port 8000
+    uvicorn app.main:app --port 8000
+
+and run ``python benchmarks/bench_blob_cache.py`` against each. The script
+uploads --files small images, then downloads them with popularity following
+a Zipf law (file k is requested with weight 1/k^s). The hit ratio comes from
+the X-Cache response header.
+"""
+import argparse
+import json
+import os
+import random
+import time
+import uuid
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+
+def upload(base, payload):
+    boundary = uuid.uuid4().hex
+    body = (
+        f"--{boundary}\r\n"
+        f'Content-Disposition: form-data; name="file"; filename="zipf-{boundary}.png"\r\n'
+        "Content-Type: image/png\r\n\r\n"
+    ).encode() + payload + f"\r\n--{boundary}--\r\n".encode()
+    req = urllib.request.Request(f"{base}/upload/", data=body, method="POST",
+                                 headers={"Content-Type": f"multipart/form-data; boundary={boundary}"})
+    with urllib.request.urlopen(req) as resp:
+        return json.loads(resp.read())["file_id"]
+
+
+def download(url):
+    start = time.perf_counter()
+    with urllib.request.urlopen(url) as resp:
+        resp.read()
+        hit = resp.headers.get("X-Cache") == "HIT"
+    return time.perf_counter() - start, hit
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--base", default="http://127.0.0.1:8000")
+    parser.add_argument("--files", type=int, default=500)
+    parser.add_argument("--size", type=int, default=32 * 1024)
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--zipf", type=float, default=1.1, help="Zipf exponent s")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    ids = [upload(args.base, os.urandom(args.size)) for _ in range(args.files)]
+    rng = random.Random(args.seed)
+    weights = [1 / (k ** args.zipf) for k in range(1, len(ids) + 1)]
+    urls = [f"{args.base}/file/{file_id}/image" for file_id in rng.choices(ids, weights, k=args.requests)]
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        results = list(pool.map(download, urls))
+    wall = time.perf_counter() - start
+
+    latencies = sorted(latency for latency, hit in results)
+    hits = sum(hit for latency, hit in results)
+    print(f"{args.requests} downloads over {args.files} files of {args.size} B, zipf s={args.zipf}, concurrency {args.concurrency}")
+    print(f"hit ratio: {hits / len(results):.1%}")
+    print(f"throughput: {len(results) / wall:.0f} req/s")
+    print(f"latency: p50={latencies[len(latencies) // 2] * 1000:.1f} ms  p99={latencies[int(len(latencies) * 0.99)] * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""Storage size and throughput of the GridFS storage codecs on a sample corpus.
+
+Runs offline, without MongoDB, using the same block-by-block compression as
+the upload path:
+
+    python benchmarks/bench_compression.py                 # synthetic text/csv/json corpus
+    python benchmarks/bench_compression.py --corpus docs/  # every file under docs/
+
+Run it from the repository root (app.config reads the same .env as the API).
+zstd is measured only when the zstandard package is installed.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from app.compression import CODEC_TYPES  # noqa: E402
+from app.config import UPLOAD_BLOCK_SIZE  # noqa: E402
+
+WORDS = "invoice order customer total amount status shipped pending report quarter revenue region".split()
+
+
+def synthetic_corpus(rng, size):
+    rows = [f"{i},{rng.choice(WORDS)},{rng.randint(1, 10000)},{rng.random():.4f}" for i in range(size // 32)]
+    records = [{"id": i, "name": rng.choice(WORDS), "tags": rng.sample(WORDS, 3), "score": rng.random()} for i in range(size // 96)]
+    text = " ".join(rng.choice(WORDS) for _ in range(size // 7))
+    return {
+        "sample.csv": "\n".join(rows).encode(),
+        "sample.json": json.dumps(records, indent=2).encode(),
+        "sample.txt": text.encode(),
+    }
+
+
+def load_corpus(path):
+    corpus = {}
+    for root, dirs, files in os.walk(path):
+        for name in files:
+            with open(os.path.join(root, name), "rb") as f:
+                corpus[os.path.relpath(os.path.join(root, name), path)] = f.read()
+    return corpus
+
+
+def compress(codec, data):
+    compressor = codec.compressor()
+    parts = [compressor.compress(data[i:i + UPLOAD_BLOCK_SIZE]) for i in range(0, len(data), UPLOAD_BLOCK_SIZE)]
+    parts.append(compressor.flush())
+    return b"".join(parts)
+
+
+def decompress(codec, data, chunk_size=255 * 1024):
+    decompressor = codec.decompressor()
+    parts = [decompressor.decompress(data[i:i + chunk_size]) for i in range(0, len(data), chunk_size)]
+    parts.append(decompressor.flush())
+    return b"".join(parts)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--corpus", help="Directory of sample files (default: synthetic)")
+    parser.add_argument("--size", type=int, default=8 * 1024 * 1024, help="Bytes per synthetic file")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.corpus) if args.corpus else synthetic_corpus(random.Random(args.seed), args.size)
+    raw_total = sum(len(data) for data in corpus.values())
+    print(f"corpus: {len(corpus)} files, {raw_total / 1e6:.1f} MB")
+    print(f"{'codec':<6} {'stored MB':>10} {'ratio':>7} {'compress MB/s':>14} {'decompress MB/s':>16}")
+    for name, codec_type in CODEC_TYPES.items():
+        try:
+            codec = codec_type()
+        except ImportError:
+            print(f"{name:<6} (not installed)")
+            continue
+        stored = 0
+        compress_time = decompress_time = 0.0
+        for data in corpus.values():
+            start = time.perf_counter()
+            packed = compress(codec, data)
+            compress_time += time.perf_counter() - start
+            start = time.perf_counter()
+            assert decompress(codec, packed) == data
+            decompress_time += time.perf_counter() - start
+            stored += len(packed)
+        print(f"{name:<6} {stored / 1e6:>10.2f} {raw_total / stored:>6.1f}x {raw_total / 1e6 / compress_time:>14.0f} {raw_total / 1e6 / decompress_time:>16.0f}")
+
+
+if __name__ == "__main__":
+    main()
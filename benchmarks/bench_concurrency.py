@@ -0,0 +1,84 @@
+"""Mixed upload / download / list load test against a running API.
+
+Start the API against a local mongod first, e.g.
+
+    MONGODB_URI=mongodb://localhost:27017 MAX_FILE_SIZE=104857600 \\
+        uvicorn app.main:app --port 8000
+
+then run ``python benchmarks/bench_concurrency.py``. Run it once on the
+revision before the Motor change and once after to compare p99 latency.
+"""
+import argparse
+import json
+import os
+import statistics
+import time
+import uuid
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+
+def request(method, url, body=None, headers=None):
+    req = urllib.request.Request(url, data=body, method=method, headers=headers or {})
+    start = time.perf_counter()
+    with urllib.request.urlopen(req) as resp:
+        data = resp.read()
+    return time.perf_counter() - start, data
+
+
+def multipart(filename, content_type, payload):
+    boundary = uuid.uuid4().hex
+    body = (
+        f"--{boundary}\r\n"
+        f'Content-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+        f"Content-Type: {content_type}\r\n\r\n"
+    ).encode() + payload + f"\r\n--{boundary}--\r\n".encode()
+    return body, {"Content-Type": f"multipart/form-data; boundary={boundary}"}
+
+
+def upload(base, size):
+    body, headers = multipart(f"bench-{uuid.uuid4().hex}.bin", "application/octet-stream", os.urandom(size))
+    elapsed, data = request("POST", f"{base}/upload/", body, headers)
+    return elapsed, json.loads(data)["file_id"]
+
+
+def percentile(samples, pct):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * pct / 100))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--base", default="http://127.0.0.1:8000")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--size", type=int, default=1024 * 1024, help="upload/download payload in bytes")
+    args = parser.parse_args()
+
+    # Seed a few files so downloads have something to hit
+    seeded = [upload(args.base, args.size)[1] for _ in range(10)]
+
+    def run(i):
+        kind = ("upload", "download", "download", "list")[i % 4]
+        if kind == "upload":
+            return kind, upload(args.base, args.size)[0]
+        if kind == "download":
+            return kind, request("GET", f"{args.base}/file/{seeded[i % len(seeded)]}/other")[0]
+        return kind, request("GET", f"{args.base}/files/")[0]
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        results = list(pool.map(run, range(args.requests)))
+    wall = time.perf_counter() - start
+
+    print(f"{args.requests} requests, concurrency {args.concurrency}, {args.requests / wall:.1f} req/s")
+    for kind in ("upload", "download", "list"):
+        samples = [elapsed for k, elapsed in results if k == kind]
+        print(
+            f"{kind:>8}: n={len(samples):5d}  p50={statistics.median(samples) * 1000:8.1f} ms"
+            f"  p99={percentile(samples, 99) * 1000:8.1f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
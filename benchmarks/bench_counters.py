@@ -0,0 +1,64 @@
+"""Download throughput with inline vs write-behind view/download counting.
+
+Start the API against a local mongod once per mode:
+
+    COUNTER_FLUSH_INTERVAL=0 uvicorn app.main:app --port 8000   # one $inc per request
+    COUNTER_FLUSH_INTERVAL=5 uvicorn app.main:app --port 8000   # batched bulk_write
+
+and run ``python benchmarks/bench_counters.py`` against each. The script
+uploads a few small files, then hammers their download URLs.
+"""
+import argparse
+import json
+import os
+import time
+import uuid
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+
+def upload(base, payload):
+    boundary = uuid.uuid4().hex
+    body = (
+        f"--{boundary}\r\n"
+        f'Content-Disposition: form-data; name="file"; filename="bench-{boundary}.png"\r\n'
+        "Content-Type: image/png\r\n\r\n"
+    ).encode() + payload + f"\r\n--{boundary}--\r\n".encode()
+    req = urllib.request.Request(f"{base}/upload/", data=body, method="POST",
+                                 headers={"Content-Type": f"multipart/form-data; boundary={boundary}"})
+    with urllib.request.urlopen(req) as resp:
+        return json.loads(resp.read())["file_id"]
+
+
+def download(url):
+    start = time.perf_counter()
+    with urllib.request.urlopen(url) as resp:
+        resp.read()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--base", default="http://127.0.0.1:8000")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--files", type=int, default=20)
+    parser.add_argument("--size", type=int, default=4096)
+    args = parser.parse_args()
+
+    # Random bytes so deduplication doesn't fold the files into one
+    ids = [upload(args.base, os.urandom(args.size)) for _ in range(args.files)]
+    urls = [f"{args.base}/file/{file_id}/image" for file_id in ids]
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        latencies = sorted(pool.map(lambda i: download(urls[i % len(urls)]), range(args.requests)))
+    wall = time.perf_counter() - start
+
+    print(f"{args.requests} downloads of {args.size} B, concurrency {args.concurrency}")
+    print(f"throughput: {args.requests / wall:.0f} req/s")
+    print(f"latency: p50={latencies[len(latencies) // 2] * 1000:.1f} ms  p99={latencies[int(len(latencies) * 0.99)] * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
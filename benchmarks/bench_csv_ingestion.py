@@ -0,0 +1,85 @@
+"""Time and peak memory of CSV text extraction: row-wise apply vs chunked, vectorized join.
+
+Runs offline, without MongoDB. Generates a CSV (1M rows by default) and
+extracts it both ways, each in a fresh process so peak RSS is comparable:
+
+    python benchmarks/bench_csv_ingestion.py --rows 1000000
+
+Run it from the repository root (app.config reads the same .env as the API).
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+
+def make_csv(path, rows, seed):
+    rng = random.Random(seed)
+    cities = ["Dhaka", "Chittagong", "Khulna", "Sylhet", "Rajshahi", "Barisal"]
+    with open(path, "w") as f:
+        f.write("id,name,city,amount,score\n")
+        for i in range(rows):
+            f.write(f"{i},user{rng.randint(1, 99999)},{rng.choice(cities)},{rng.randint(1, 100000)},{rng.random():.5f}\n")
+
+
+def rowwise(path):
+    # The extractor before chunking: whole file in one DataFrame, a Python lambda per row
+    import pandas as pd
+    from app.extraction import detect_encoding
+    with open(path, "rb") as stream:
+        encoding = detect_encoding(stream, sample_size=os.path.getsize(path))
+        stream.seek(0)
+        df = pd.read_csv(stream, dtype=str, encoding=encoding, header=None)
+        return len("\n".join(df.astype(str).apply(lambda x: ", ".join(x), axis=1)))
+
+
+class NullCollection:
+    def delete_many(self, query):
+        pass
+
+    def insert_many(self, docs):
+        pass
+
+
+def chunked(path):
+    from app.extraction import store_csv_chunks
+    with open(path, "rb") as stream:
+        return store_csv_chunks({"content_chunks": NullCollection()}, None, stream)["rows"]
+
+
+def run(name, path, results):
+    start = time.perf_counter()
+    globals()[name](path)
+    elapsed = time.perf_counter() - start
+    # ru_maxrss is KiB on Linux
+    results[name] = (elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.csv")
+        make_csv(path, args.rows, args.seed)
+        print(f"{args.rows} rows, {os.path.getsize(path) / 1e6:.1f} MB")
+        ctx = multiprocessing.get_context("spawn")
+        results = ctx.Manager().dict()
+        for name in ("rowwise", "chunked"):
+            process = ctx.Process(target=run, args=(name, path, results))
+            process.start()
+            process.join()
+            elapsed, peak = results[name]
+            print(f"{name:<8} {elapsed:7.2f} s  peak RSS {peak:7.0f} MB")
+
+
+if __name__ == "__main__":
+    main()
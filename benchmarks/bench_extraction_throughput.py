@@ -0,0 +1,60 @@
+"""Upload throughput with text extraction inline vs offloaded to the worker pool.
+
+Start the API against a local mongod twice, once per mode:
+
+    EXTRACTION_WORKERS=0 uvicorn app.main:app --port 8000   # extract inside the request
+    EXTRACTION_WORKERS=4 uvicorn app.main:app --port 8000   # extract in the process pool
+
+and run ``python benchmarks/bench_extraction_throughput.py --file big.pdf``
+against each. Any PDF/DOCX/CSV works; a few hundred pages makes the
+difference obvious.
+"""
+import argparse
+import mimetypes
+import os
+import time
+import uuid
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+
+def upload(base, payload, content_type, suffix):
+    boundary = uuid.uuid4().hex
+    body = (
+        f"--{boundary}\r\n"
+        f'Content-Disposition: form-data; name="file"; filename="bench-{boundary}{suffix}"\r\n'
+        f"Content-Type: {content_type}\r\n\r\n"
+    ).encode() + payload + f"\r\n--{boundary}--\r\n".encode()
+    req = urllib.request.Request(f"{base}/upload/", data=body, method="POST",
+                                 headers={"Content-Type": f"multipart/form-data; boundary={boundary}"})
+    start = time.perf_counter()
+    with urllib.request.urlopen(req) as resp:
+        resp.read()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--base", default="http://127.0.0.1:8000")
+    parser.add_argument("--file", required=True, help="document to upload repeatedly")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--uploads", type=int, default=64)
+    args = parser.parse_args()
+
+    with open(args.file, "rb") as f:
+        payload = f.read()
+    content_type = mimetypes.guess_type(args.file)[0] or "application/octet-stream"
+    suffix = os.path.splitext(args.file)[1]
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        latencies = sorted(pool.map(lambda _: upload(args.base, payload, content_type, suffix), range(args.uploads)))
+    wall = time.perf_counter() - start
+
+    print(f"{args.uploads} uploads of {len(payload) / 1024:.0f} KiB ({content_type}), concurrency {args.concurrency}")
+    print(f"throughput: {args.uploads / wall:.2f} uploads/s")
+    print(f"latency: p50={latencies[len(latencies) // 2] * 1000:.0f} ms  max={latencies[-1] * 1000:.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
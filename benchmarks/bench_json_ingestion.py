@@ -0,0 +1,127 @@
+"""Time, peak memory and stored bytes of JSON extraction: embedded document vs streamed projection.
+
+Runs offline, without MongoDB. Generates a JSON array (or NDJSON) of order
+records and extracts it both ways, each in a fresh process so peak RSS is
+comparable:
+
+    python benchmarks/bench_json_ingestion.py --records 200000
+    python benchmarks/bench_json_ingestion.py --format ndjson
+    JSON_INDEX_PATHS=id,customer.id,status python benchmarks/bench_json_ingestion.py
+
+"embedded" is the extractor before streaming: the decoded text and the
+parsed object in one jsonContent document (MongoDB rejects it past 16 MB).
+"streamed" is store_json, with ijson if installed, otherwise orjson/json;
+its stored bytes are the content_chunks and json_values documents. Run it
+from the repository root (app.config reads the same .env as the API).
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+BSON_MAX_SIZE = 16 * 1024 * 1024
+
+
+def make_json(path, records, fmt, seed):
+    rng = random.Random(seed)
+    statuses = ["paid", "pending", "shipped", "cancelled"]
+    with open(path, "w") as f:
+        if fmt == "array":
+            f.write("[")
+        for i in range(records):
+            record = {
+                "id": i,
+                "status": rng.choice(statuses),
+                "customer": {"id": f"c{rng.randint(1, 50000)}", "name": f"user{rng.randint(1, 99999)}"},
+                "items": [{"sku": f"sku{rng.randint(1, 5000)}", "qty": rng.randint(1, 9), "price": round(rng.random() * 100, 2)} for _ in range(rng.randint(1, 4))],
+            }
+            if fmt == "array":
+                f.write(("," if i else "") + json.dumps(record))
+            else:
+                f.write(json.dumps(record) + "\n")
+        if fmt == "array":
+            f.write("]")
+
+
+def embedded(path):
+    import bson
+    with open(path, "rb") as stream:
+        content = stream.read().decode("utf-8")
+    if not content.lstrip().startswith(("{", "[")) or "\n{" in content:
+        # The old extractor failed on NDJSON; parse it as a list to size the document anyway
+        json_object = [json.loads(line) for line in content.splitlines() if line.strip()]
+    else:
+        json_object = json.loads(content)
+    return len(bson.encode({"filename": "bench.json", "json_object": json_object, "content": content}))
+
+
+class SizingCollection:
+    def __init__(self, sizes):
+        self.sizes = sizes
+
+    def delete_many(self, query):
+        pass
+
+    def insert_many(self, docs):
+        import bson
+        self.sizes.extend(len(bson.encode(doc)) for doc in docs)
+
+
+class SizingDatabase(dict):
+    def __missing__(self, name):
+        self[name] = SizingCollection(self.sizes)
+        return self[name]
+
+
+def streamed(path):
+    from app.extraction import store_json
+    db = SizingDatabase()
+    db.sizes = []
+    with open(path, "rb") as stream:
+        fields = store_json(db, None, stream)
+    return sum(db.sizes) + len(json.dumps(fields)), max(db.sizes, default=0)
+
+
+def run(name, path, results):
+    start = time.perf_counter()
+    stored = globals()[name](path)
+    elapsed = time.perf_counter() - start
+    # ru_maxrss is KiB on Linux
+    results[name] = (elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, stored)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--records", type=int, default=200_000)
+    parser.add_argument("--format", choices=["array", "ndjson"], default="array")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.json")
+        make_json(path, args.records, args.format, args.seed)
+        print(f"{args.records} records ({args.format}), {os.path.getsize(path) / 1e6:.1f} MB")
+        ctx = multiprocessing.get_context("spawn")
+        results = ctx.Manager().dict()
+        for name in ("embedded", "streamed"):
+            process = ctx.Process(target=run, args=(name, path, results))
+            process.start()
+            process.join()
+            elapsed, peak, stored = results[name]
+            if name == "embedded":
+                note = "  (over the 16 MB document limit)" if stored > BSON_MAX_SIZE else ""
+                print(f"{name:<9} {elapsed:7.2f} s  peak RSS {peak:7.0f} MB  stored {stored / 1e6:7.1f} MB in one document{note}")
+            else:
+                total, largest = stored
+                print(f"{name:<9} {elapsed:7.2f} s  peak RSS {peak:7.0f} MB  stored {total / 1e6:7.1f} MB, largest document {largest / 1e6:.2f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,220 @@
+"""Compare MongoDB client configurations (pool, compression, read preference, write concern, chunk size).
+
+Needs a local replica set, so secondaryPreferred reads have somewhere to go,
+e.g. three mongods:
+
+    for port in 27017 27018 27019; do
+        mkdir -p /tmp/rs/$port
+        mongod --replSet rs0 --port $port --dbpath /tmp/rs/$port --fork --logpath /tmp/rs/$port.log
+    done
+    mongosh --port 27017 --eval 'rs.initiate({_id: "rs0", members: [
+        {_id: 0, host: "localhost:27017"}, {_id: 1, host: "localhost:27018"}, {_id: 2, host: "localhost:27019"}]})'
+
+then, from the repository root:
+
+    python benchmarks/bench_mongo_client.py
+    python benchmarks/bench_mongo_client.py --configs default,secondary --config 'pool500:MONGO_MAX_POOL_SIZE=500'
+
+For each configuration the script starts the API with those settings (on
+top of the .env), uploads small text files and a video of random bytes, and
+runs each workload at --concurrency: listings, searches, top downloads,
+small downloads (each writes its counter through, so the counter write
+concern is on the path), full video downloads and Range reads of the
+video. Response and blob caches are turned off so every request reaches the
+database. The uploaded files are deleted afterwards. Compare the rows
+against "default"; run it a few times, replica sets on one machine are
+noisy.
+"""
+import argparse
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+DEFAULT_URI = "mongodb://localhost:27017,localhost:27018,localhost:27019/?replicaSet=rs0"
+
+CONFIGS = {
+    "default": {},
+    "pool": {"MONGO_MIN_POOL_SIZE": "20", "MONGO_MAX_POOL_SIZE": "200"},
+    "compressed": {"MONGO_COMPRESSORS": "zstd,snappy,zlib"},
+    "secondary": {"MONGO_LISTING_READ_PREFERENCE": "secondaryPreferred"},
+    "counters-w1": {"COUNTER_WRITE_CONCERN": "1"},
+    "chunks": {"GRIDFS_CHUNK_SIZES": "video=4194304,text=65536"},
+    "tuned": {
+        "MONGO_MIN_POOL_SIZE": "20", "MONGO_MAX_POOL_SIZE": "200", "MONGO_COMPRESSORS": "zstd,snappy,zlib",
+        "MONGO_LISTING_READ_PREFERENCE": "secondaryPreferred", "COUNTER_WRITE_CONCERN": "1", "GRIDFS_CHUNK_SIZES": "video=4194304,text=65536",
+    },
+}
+
+WORDS = ["invoice", "receipt", "contract", "report", "summary", "budget", "meeting", "project", "quarter", "review"]
+
+
+def request(method, url, body=None, headers=None):
+    req = urllib.request.Request(url, data=body, method=method, headers=headers or {})
+    start = time.perf_counter()
+    with urllib.request.urlopen(req) as resp:
+        data = resp.read()
+    return time.perf_counter() - start, data
+
+
+def upload(base, filename, content_type, payload):
+    boundary = uuid.uuid4().hex
+    body = (
+        f"--{boundary}\r\n"
+        f'Content-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+        f"Content-Type: {content_type}\r\n\r\n"
+    ).encode() + payload + f"\r\n--{boundary}--\r\n".encode()
+    seconds, data = request("POST", f"{base}/upload/", body, {"Content-Type": f"multipart/form-data; boundary={boundary}"})
+    return seconds, json.loads(data)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(env, timeout):
+    port = free_port()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=ROOT, env=env,
+    )
+    base = f"http://127.0.0.1:{port}"
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        try:
+            request("GET", f"{base}/")
+            return server, base
+        except (urllib.error.URLError, ConnectionError, OSError):
+            time.sleep(0.05)
+    server.terminate()
+    raise TimeoutError("The API did not start")
+
+
+def wait_extracted(base, file_id, timeout=60):
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        seconds, data = request("GET", f"{base}/file/{file_id}/text/status")
+        if json.loads(data).get("extraction_status") != "pending":
+            return
+        time.sleep(0.1)
+
+
+def range_header(size, length=65536):
+    start = random.randrange(size - length)
+    return {"Range": f"bytes={start}-{start + length - 1}"}
+
+
+def run_load(urls, concurrency, requests, headers=None):
+    """Issue the requests (cycling through urls) and return (req/s, p50 ms, p99 ms, bytes/s)."""
+    def one(i):
+        url = urls[i % len(urls)]
+        seconds, data = request("GET", url, headers=headers(i) if headers else None)
+        return seconds, len(data)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(one, range(requests)))
+    wall = time.perf_counter() - start
+    latencies = sorted(seconds for seconds, size in results)
+    return requests / wall, latencies[len(latencies) // 2] * 1000, latencies[int(len(latencies) * 0.99)] * 1000, sum(size for seconds, size in results) / wall
+
+
+def bench_config(overrides, args):
+    env = {
+        **os.environ,
+        "MONGODB_URI": args.uri,
+        "MAX_FILE_SIZE": str(max(args.video_mb * 2 * 1024 * 1024, int(os.environ.get("MAX_FILE_SIZE", 0) or 0))),
+        # Every request goes to the database
+        "RESPONSE_CACHE_TTL": "0",
+        "BLOB_CACHE_MAX_BYTES": "0",
+        "COUNTER_FLUSH_INTERVAL": "0",
+        **overrides,
+    }
+    server, base = start_server(env, args.timeout)
+    uploaded = []
+    results = {}
+    try:
+        run = uuid.uuid4().hex[:8]
+        for i in range(args.files):
+            text = " ".join(random.choice(WORDS) + str(random.randrange(1000)) for _ in range(args.words))
+            seconds, doc = upload(base, f"bench-{run}-{i}.txt", "text/plain", f"{random.choice(WORDS)} {text}\n".encode())
+            uploaded.append((doc["file_id"], "text"))
+        wait_extracted(base, uploaded[-1][0])
+        video = os.urandom(args.video_mb * 1024 * 1024)
+        seconds, doc = upload(base, f"bench-{run}.mp4", "video/mp4", video)
+        uploaded.append((doc["file_id"], "video"))
+        results["video upload MB/s"] = args.video_mb / seconds
+
+        n, c = args.requests, args.concurrency
+        text_urls = [f"{base}/file/{file_id}/text" for file_id, bucket in uploaded if bucket == "text"]
+        video_url = f"{base}/file/{uploaded[-1][0]}/video"
+        workloads = {
+            "list": ([f"{base}/files/?limit=50"], n, None),
+            "search": ([f"{base}/search/?word={word}&limit=20" for word in WORDS], n, None),
+            "top": ([f"{base}/top-downloads/?numbers=20"], n, None),
+            "download text": (text_urls, n, None),
+            "download video": ([video_url], max(c, n // 50), None),
+            "range 64 KiB": ([video_url], n, lambda i: range_header(len(video))),
+        }
+        for workload, (urls, count, headers) in workloads.items():
+            results[workload] = run_load(urls, c, count, headers)
+    finally:
+        for file_id, bucket in uploaded:
+            try:
+                request("DELETE", f"{base}/file/{file_id}/{bucket}")
+            except urllib.error.URLError:
+                pass
+        server.terminate()
+        server.wait()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--uri", default=os.environ.get("BENCH_MONGODB_URI", DEFAULT_URI))
+    parser.add_argument("--configs", default=",".join(CONFIGS), help="comma-separated names of the built-in configurations")
+    parser.add_argument("--config", action="append", default=[], metavar="NAME:VAR=VALUE,...", help="an extra configuration")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--files", type=int, default=200)
+    parser.add_argument("--words", type=int, default=500, help="words per text file")
+    parser.add_argument("--video-mb", type=int, default=64)
+    parser.add_argument("--timeout", type=float, default=60, help="seconds to wait for the server")
+    args = parser.parse_args()
+
+    configs = {name: CONFIGS[name] for name in args.configs.split(",") if name}
+    for extra in args.config:
+        name, _, settings = extra.partition(":")
+        configs[name] = dict(item.split("=", 1) for item in settings.split(",") if "=" in item)
+
+    table = {}
+    for name, overrides in configs.items():
+        print(f"{name}: {overrides or 'defaults'}", file=sys.stderr)
+        table[name] = bench_config(overrides, args)
+
+    print(f"\n{args.requests} requests per workload, concurrency {args.concurrency}")
+    print(f"{'config':<14}{'workload':<18}{'req/s':>9}{'p50 ms':>9}{'p99 ms':>9}{'MB/s':>9}")
+    for name, results in table.items():
+        print(f"{name:<14}{'video upload':<18}{'':>27}{results.pop('video upload MB/s'):>9.1f}")
+        for workload, (rate, p50, p99, throughput) in results.items():
+            print(f"{name:<14}{workload:<18}{rate:>9.0f}{p50:>9.1f}{p99:>9.1f}{throughput / 1e6:>9.1f}")
+    if "default" in table:
+        base = table["default"]
+        print("\nreq/s relative to default")
+        for name, results in table.items():
+            if name != "default":
+                print(f"{name:<14}" + "  ".join(f"{workload} {results[workload][0] / base[workload][0]:.2f}x" for workload in results))
+
+
+if __name__ == "__main__":
+    main()
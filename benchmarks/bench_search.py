@@ -0,0 +1,73 @@
+"""Search latency: unanchored $regex scan vs the text index, on a synthetic corpus.
+
+Needs a local mongod (no API server). It fills a scratch database with
+synthetic extracted-content documents, then times both query styles:
+
+    python benchmarks/bench_search.py --uri mongodb://localhost:27017 --docs 100000
+"""
+import argparse
+import random
+import statistics
+import time
+
+from pymongo import MongoClient, TEXT
+
+WORDS = [f"w{i:05d}" for i in range(20000)]
+
+
+def document(rng, words_per_doc):
+    # Zipf-like word frequencies, like real prose
+    words = rng.choices(WORDS, weights=[1 / (rank + 1) for rank in range(len(WORDS))], k=words_per_doc)
+    return " ".join(words)
+
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--uri", default="mongodb://localhost:27017")
+    parser.add_argument("--docs", type=int, default=100000)
+    parser.add_argument("--words-per-doc", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--limit", type=int, default=20)
+    args = parser.parse_args()
+
+    client = MongoClient(args.uri)
+    collection = client["search_bench"]["textContent"]
+    collection.drop()
+
+    rng = random.Random(42)
+    batch = []
+    for i in range(args.docs):
+        batch.append({"filename": f"doc-{i}.txt", "content": document(rng, args.words_per_doc)})
+        if len(batch) == 1000:
+            collection.insert_many(batch)
+            batch = []
+    if batch:
+        collection.insert_many(batch)
+    start = time.perf_counter()
+    collection.create_index([("content", TEXT)], default_language="none")
+    print(f"{args.docs} documents, text index built in {time.perf_counter() - start:.1f} s")
+
+    # A frequent, a mid-frequency and a rare term
+    for word in (WORDS[3], WORDS[500], WORDS[15000]):
+        regex_ms = timed(lambda: list(collection.find({"content": {"$regex": word, "$options": "i"}}, {"_id": 1}).limit(args.limit)), args.repeat)
+        regex_all_ms = timed(lambda: collection.count_documents({"content": {"$regex": word, "$options": "i"}}), args.repeat)
+        text_ms = timed(lambda: list(
+            collection.find({"$text": {"$search": word}}, {"score": {"$meta": "textScore"}})
+            .sort([("score", {"$meta": "textScore"})]).limit(args.limit)
+        ), args.repeat)
+        print(f"{word}: regex first page {regex_ms:8.1f} ms | regex all hits {regex_all_ms:8.1f} ms | $text ranked page {text_ms:8.1f} ms")
+
+    client.drop_database("search_bench")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""Cold-start cost: import time per module and time to the first response.
+
+Every measurement runs in a fresh interpreter, like a serverless cold start:
+
+    python benchmarks/bench_startup.py                     # imports + first responses
+    python benchmarks/bench_startup.py --imports-only      # no MongoDB needed
+    ENSURE_INDEXES=false python benchmarks/bench_startup.py
+
+Run it from the repository root (the API reads the same .env). Import times
+come from ``python -X importtime -c "import app.main"``; the table lists the
+app modules and the heavy libraries, cumulative (including what they import),
+as the median of --runs runs. Time to first response starts uvicorn and
+measures from process start until ``GET /`` answers, which includes the
+lifespan startup (client creation, warm-up ping, indexes, leaderboard load),
+then how much longer until a database-backed ``GET /files/`` answers.
+"""
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+LIBRARIES = ["fastapi", "starlette", "pydantic", "pymongo", "motor", "pandas", "numpy", "PyPDF2", "docx", "chardet", "PIL"]
+
+
+def import_times():
+    """Cumulative import time in ms of every top-level and app.* module, plus the wall time of the import."""
+    code = "import time; start = time.perf_counter(); import app.main; print(time.perf_counter() - start)"
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=ROOT, capture_output=True, text=True, check=True)
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        try:
+            _, cumulative, name = line.split("|")
+            cumulative = int(cumulative)
+        except ValueError:
+            continue  # The header line
+        module = name.strip()  # Nested imports are indented
+        if module.startswith("app.") or module in LIBRARIES:
+            times[module] = cumulative / 1000
+    return times, float(result.stdout.strip()) * 1000
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for(url, deadline):
+    while time.perf_counter() < deadline:
+        try:
+            with urllib.request.urlopen(url, timeout=5) as resp:
+                resp.read()
+                return time.perf_counter()
+        except (urllib.error.URLError, ConnectionError, OSError):
+            time.sleep(0.005)
+    raise TimeoutError(f"No response from {url}")
+
+
+def first_responses(timeout):
+    port = free_port()
+    start = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=ROOT,
+    )
+    try:
+        alive = wait_for(f"http://127.0.0.1:{port}/", start + timeout)
+        listed = wait_for(f"http://127.0.0.1:{port}/files/", start + timeout)
+    finally:
+        server.terminate()
+        server.wait()
+    return (alive - start) * 1000, (listed - alive) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--imports-only", action="store_true", help="skip starting the server")
+    parser.add_argument("--timeout", type=float, default=60, help="seconds to wait for the server")
+    args = parser.parse_args()
+
+    runs = [import_times() for _ in range(args.runs)]
+    modules = sorted({name for times, total in runs for name in times})
+    rows = [(name, statistics.median(times.get(name, 0) for times, total in runs)) for name in modules]
+    print(f"{'module':<24}{'import ms':>10}")
+    for name, ms in sorted(rows, key=lambda row: -row[1]):
+        print(f"{name:<24}{ms:>10.1f}")
+    print(f"{'import app.main (wall)':<24}{statistics.median(total for times, total in runs):>10.1f}")
+    not_loaded = [name for name in LIBRARIES if name not in modules]
+    if not_loaded:
+        print(f"not imported at startup: {', '.join(not_loaded)}")
+
+    if args.imports_only:
+        return
+    samples = [first_responses(args.timeout) for _ in range(args.runs)]
+    print(f"\nfirst response (GET /):            {statistics.median(alive for alive, listed in samples):8.1f} ms after process start")
+    print(f"first database response (/files/): {statistics.median(listed for alive, listed in samples):8.1f} ms later")
+
+
+if __name__ == "__main__":
+    main()
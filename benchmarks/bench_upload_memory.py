@@ -0,0 +1,96 @@
+"""Peak server memory while uploading large files concurrently.
+
+Start the API against a local mongod with a size limit above the test size, e.g.
+
+    MONGODB_URI=mongodb://localhost:27017 MAX_FILE_SIZE=2147483648 \\
+        uvicorn app.main:app --port 8000
+
+then run ``python benchmarks/bench_upload_memory.py --pid <uvicorn pid>``.
+The request bodies are generated on the fly, so the client itself stays small.
+They are random bytes: identical uploads would be deduplicated and zeros
+compressed away by a storage codec, so most of them would write nothing.
+"""
+import argparse
+import http.client
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+BLOCK_SIZE = 1024 * 1024
+
+
+def rss_bytes(pid):
+    with open(f"/proc/{pid}/status") as status:
+        for line in status:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) * 1024
+    return 0
+
+
+def upload(base, size):
+    boundary = uuid.uuid4().hex
+    head = (
+        f"--{boundary}\r\n"
+        f'Content-Disposition: form-data; name="file"; filename="bench-{boundary}.bin"\r\n'
+        "Content-Type: application/octet-stream\r\n\r\n"
+    ).encode()
+    tail = f"\r\n--{boundary}--\r\n".encode()
+
+    def body():
+        yield head
+        remaining = size
+        while remaining:
+            block = os.urandom(min(BLOCK_SIZE, remaining))
+            remaining -= len(block)
+            yield block
+        yield tail
+
+    url = urlparse(base)
+    conn = http.client.HTTPConnection(url.hostname, url.port, timeout=3600)
+    start = time.perf_counter()
+    conn.request("POST", "/upload/", body=body(), headers={
+        "Content-Type": f"multipart/form-data; boundary={boundary}",
+        "Content-Length": str(len(head) + size + len(tail)),
+    })
+    resp = conn.getresponse()
+    resp.read()
+    conn.close()
+    return resp.status, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--base", default="http://127.0.0.1:8000")
+    parser.add_argument("--pid", type=int, required=True, help="pid of the uvicorn worker")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--size", type=int, default=1024 ** 3, help="bytes per upload")
+    args = parser.parse_args()
+
+    baseline = rss_bytes(args.pid)
+    peak = baseline
+    done = threading.Event()
+
+    def sample():
+        nonlocal peak
+        while not done.is_set():
+            peak = max(peak, rss_bytes(args.pid))
+            time.sleep(0.05)
+
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        results = list(pool.map(lambda _: upload(args.base, args.size), range(args.concurrency)))
+    done.set()
+    sampler.join()
+
+    mib = 1024 * 1024
+    print(f"{args.concurrency} uploads of {args.size / mib:.0f} MiB, statuses {sorted({s for s, _ in results})}")
+    print(f"slowest upload: {max(t for _, t in results):.1f} s")
+    print(f"server RSS: baseline {baseline / mib:.0f} MiB, peak {peak / mib:.0f} MiB, growth {(peak - baseline) / mib:.0f} MiB")
+
+
+if __name__ == "__main__":
+    main()